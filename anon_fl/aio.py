@@ -0,0 +1,331 @@
+"""
+Minimal async view layer of anon_fl/asgi.py. Django 1.10 has no async views, so endpoints which wait on external I/O
+are plain coroutines: ORM calls run in a thread pool, notify service calls are awaited on the event loop.
+Every other request is passed to the WSGI application, which runs in its own thread pool.
+
+Coroutine routes skip django middleware, AsyncRouter does their part itself: route stats, metrics and Server-Timing
+of anon_fl/profiling.py, replica stickiness after writes, compression and CORS headers of simple requests
+(preflight OPTIONS requests are not routed and reach corsheaders)
+"""
+import asyncio
+import json
+import logging
+import re
+import sys
+import tempfile
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+
+from anon_fl import compression, metrics
+from anon_fl.db.router import SAFE_METHODS, stick_to_primary
+from anon_fl.profiling import RequestProfile, route_stats, server_timing, track_sql
+
+logger = logging.getLogger(__name__)
+
+database_executor = ThreadPoolExecutor(settings.ASGI_DATABASE_THREADS)
+wsgi_executor = ThreadPoolExecutor(settings.ASGI_WSGI_THREADS)
+
+# body of fallback requests is spooled to disk above this size
+SPOOL_SIZE = 1024 * 1024
+
+
+# RequestProfile of the request served by a task, queries of its database calls are counted there
+request_profiles = weakref.WeakKeyDictionary()
+
+
+def current_task():
+    # asyncio.current_task is 3.7+
+    return (getattr(asyncio, 'current_task', None) or asyncio.Task.current_task)()
+
+
+def database_sync_to_async(func):
+    """
+    Runs func in database thread pool. Connections of pool threads are recycled as request threads do
+    """
+    def run(profile, *args, **kwargs):
+        close_old_connections()
+        try:
+            if profile is None:
+                return func(*args, **kwargs)
+            with track_sql(profile):
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        profile = request_profiles.get(current_task())
+        return await asyncio.get_event_loop().run_in_executor(database_executor,
+                                                              partial(run, profile, *args, **kwargs))
+
+    return wrapper
+
+
+def header_environ(scope):
+    """
+    Request headers as WSGI environ keys, repeated headers are joined
+    """
+    environ = {}
+    for name, value in scope['headers']:
+        key = name.decode('latin1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+class AsyncRequest:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        # authentication classes read headers from META
+        self.META = header_environ(scope)
+        self.body = body
+        self.user = None
+        self.auth = None
+
+    @property
+    def data(self):
+        if not self.body:
+            return {}
+        try:
+            return json.loads(self.body.decode())
+        except ValueError as e:
+            raise exceptions.ParseError('JSON parse error - {0}'.format(e))
+
+
+def cors_headers(request):
+    """
+    Headers corsheaders middleware adds to responses of simple cross-origin requests
+    """
+    origin = request.META.get('HTTP_ORIGIN')
+    if not origin:
+        return {}
+
+    credentials = getattr(settings, 'CORS_ALLOW_CREDENTIALS', False)
+    if settings.CORS_ORIGIN_ALLOW_ALL and not credentials:
+        headers = {'Access-Control-Allow-Origin': '*'}
+    elif settings.CORS_ORIGIN_ALLOW_ALL or urlsplit(origin).netloc in getattr(settings, 'CORS_ORIGIN_WHITELIST', ()):
+        headers = {'Access-Control-Allow-Origin': origin, 'Vary': 'Origin'}
+    else:
+        return {}
+
+    if credentials:
+        headers['Access-Control-Allow-Credentials'] = 'true'
+    expose = getattr(settings, 'CORS_EXPOSE_HEADERS', ())
+    if expose:
+        headers['Access-Control-Expose-Headers'] = ', '.join(expose)
+    return headers
+
+
+class JSONResponse:
+    def __init__(self, data, status=200, headers=None):
+        self.data = data
+        self.status = status
+        self.headers = headers or {}
+
+    async def send(self, send, request):
+        body = JSONRenderer().render(self.data)
+        headers = dict(self.headers, **cors_headers(request))
+        headers['Content-Type'] = 'application/json'
+
+        if len(body) >= settings.COMPRESSION_MIN_SIZE:
+            headers['Vary'] = ', '.join(filter(None, (headers.get('Vary'), 'Accept-Encoding')))
+            encoding = compression.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+            if encoding != compression.IDENTITY:
+                body = compression.compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(len(body))
+
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def exception_response(exc):
+    """
+    Same status codes and bodies as DRF exception handler
+    """
+    if isinstance(exc, Http404):
+        exc = exceptions.NotFound()
+
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers['WWW-Authenticate'] = 'Bearer'
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = str(exc.wait)
+    return JSONResponse(data, exc.status_code, headers)
+
+
+async def read_body(receive, max_size=None):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if max_size is not None and len(body) > max_size:
+            raise exceptions.ValidationError({'detail': 'Request body is too large'})
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+class WsgiFallback:
+    """
+    Serves request with WSGI application in a thread. Response chunks are passed through a bounded queue,
+    so streamed responses are not buffered and the request is closed in the thread which served it
+    """
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': client[0],
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        environ.update(header_environ(scope))
+        return environ
+
+    def run(self, environ, loop, queue):
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', int(status.split(' ', 1)[0]), headers))
+
+        try:
+            result = self.wsgi_application(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as e:
+            put(('error', e))
+        else:
+            put(('end', None))
+
+    async def __call__(self, scope, receive, send):
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as body:
+            while True:
+                message = await receive()
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            loop = asyncio.get_event_loop()
+            queue = asyncio.Queue(maxsize=4)
+            task = loop.run_in_executor(wsgi_executor, self.run, self.environ(scope, body), loop, queue)
+
+            while True:
+                item = await queue.get()
+                if item[0] == 'start':
+                    await send({'type': 'http.response.start', 'status': item[1],
+                                'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                                            for name, value in item[2]]})
+                elif item[0] == 'body':
+                    await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+                elif item[0] == 'error':
+                    await task
+                    raise item[1]
+                else:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+
+            await task
+
+
+class AsyncRouter:
+    """
+    ASGI application: requests matching (method, path pattern) of `routes` are served by coroutine views,
+    all others by `fallback`. Only JSON bodies are handled by coroutines
+    """
+    def __init__(self, routes, fallback):
+        self.routes = [(method, re.compile(pattern), view) for method, pattern, view in routes]
+        self.fallback = fallback
+
+    def match(self, scope):
+        if scope['type'] != 'http':
+            return None, None
+
+        content_type = dict(scope['headers']).get(b'content-type', b'application/json')
+        if not content_type.startswith(b'application/json'):
+            return None, None
+
+        for method, pattern, view in self.routes:
+            match = pattern.match(scope['path'])
+            if match is not None and scope['method'] == method:
+                return view, match.groupdict()
+
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        view, kwargs = self.match(scope)
+        if view is None:
+            return await self.fallback(scope, receive, send)
+
+        started = time.perf_counter()
+        profile = request_profiles[current_task()] = RequestProfile()
+        request = AsyncRequest(scope, b'')
+        try:
+            request.body = await read_body(receive, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+            response = await view(request, **kwargs)
+            # the client's next reads must see its write, as ReplicaRoutingMiddleware ensures for sync views
+            if request.method not in SAFE_METHODS and request.user is not None and response.status < 400:
+                await database_sync_to_async(stick_to_primary)(request.user.id)
+        except (exceptions.APIException, Http404) as e:
+            response = exception_response(e)
+        except Exception:
+            logger.exception('%s %s failed', scope['method'], scope['path'])
+            response = JSONResponse({'detail': 'Server error'}, 500)
+
+        wall = time.perf_counter() - started
+        route = '{0} async {1}'.format(scope['method'], view.__name__)
+        route_stats.record(route, wall, profile)
+        metrics.observe_request(route, response.status, wall, profile.sql_count, profile.sql_time)
+        response.headers['Server-Timing'] = server_timing(wall, profile)
+
+        await response.send(send, request)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,19 @@
+"""
+ASGI config for anon_fl project.
+
+Chat message send, order application create and status change, and notifications mark-as-read are served by
+coroutines of api/async_views.py, every other request by the WSGI application in a thread pool.
+Runs under any ASGI 3 server, i.e.
+
+    uvicorn anon_fl.asgi:application --port 8000
+"""
+
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "anon_fl.settings")
+
+from anon_fl.wsgi import application as wsgi_application  # noqa, sets up django
+from anon_fl.aio import AsyncRouter, WsgiFallback  # noqa
+from api.async_views import routes  # noqa
+
+application = AsyncRouter(routes, WsgiFallback(wsgi_application))
@@ -0,0 +1,26 @@
+from redis_cache import RedisCache
+
+from anon_fl.metrics import cache_requests
+
+MISSING = object()
+
+
+class InstrumentedRedisCache(RedisCache):
+    """
+    Redis cache counting hits and misses
+    """
+    def get(self, key, default=None, version=None):
+        value = super().get(key, MISSING, version=version)
+        if value is MISSING:
+            cache_requests.labels('miss').inc()
+            return default
+
+        cache_requests.labels('hit').inc()
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version=version)
+        cache_requests.labels('hit').inc(len(values))
+        cache_requests.labels('miss').inc(len(keys) - len(values))
+        return values
@@ -0,0 +1,126 @@
+"""
+Response compression negotiated from Accept-Encoding: brotli when the optional `brotli` package is installed
+and the client accepts it, gzip otherwise.
+
+The middleware sits between UpdateCacheMiddleware and FetchFromCacheMiddleware, so the response cache stores
+already compressed bytes and serves them on hit without recompression. Accept-Encoding is normalized to the
+chosen encoding before cache lookup, so there is one cache entry per encoding, not per browser header variant
+"""
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = re.compile(r'^(application/(json|javascript|xml)|text/)')
+IDENTITY = 'identity'
+
+
+def parse_accept_encoding(header):
+    """
+    {encoding: q} of Accept-Encoding header
+    """
+    accepted = {}
+    for part in header.split(','):
+        encoding, _, params = part.strip().partition(';')
+        if not encoding:
+            continue
+        q = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        accepted[encoding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = parse_accept_encoding(header or '')
+    available = ('br', 'gzip') if brotli is not None else ('gzip',)
+    candidates = [encoding for encoding in available if accepted.get(encoding, accepted.get('*', 0)) > 0]
+    if not candidates:
+        return IDENTITY
+    # highest q wins, server preference breaks ties
+    return max(candidates, key=lambda encoding: (accepted.get(encoding, accepted.get('*', 0)),
+                                                 -available.index(encoding)))
+
+
+def gzip_compressor():
+    # wbits 16 + MAX_WBITS writes gzip header and trailer
+    return zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    compressor = gzip_compressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """
+    Every chunk is flushed, so streamed response keeps its time to first byte
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    compressor = gzip_compressor()
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def is_compressible(response):
+    # file downloads are sent as stored: their Content-Length and byte ranges refer to the file
+    return (not response.has_header('Content-Encoding')
+            and not response.has_header('Content-Disposition')
+            and COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')) is not None
+            and (response.streaming or len(response.content) >= settings.COMPRESSION_MIN_SIZE))
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        request.META['HTTP_ACCEPT_ENCODING'] = encoding
+
+        response = self.get_response(request)
+
+        # cached responses come back with Content-Encoding already set
+        if not is_compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding == IDENTITY:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # compressed body is a different representation, strong ETag must not match the identity one
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+def check_connections(**kwargs):
+    """
+    Persistent connections may be dropped by server or pgbouncer while idle. Connection which was not checked
+    for DB_HEALTH_CHECK_INTERVAL seconds is pinged before request and reopened lazily if it is gone
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+
+        checked_at = getattr(connection, 'health_checked_at', None)
+        if checked_at is not None and now - checked_at < settings.DB_HEALTH_CHECK_INTERVAL:
+            continue
+
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            connection.close()
@@ -0,0 +1,110 @@
+"""
+PostgreSQL backend with per-process connection pool. Django connections are thread-local, the pool is shared
+by all threads of a worker: connection closed by django (at the end of request with CONN_MAX_AGE = 0) goes back
+to the pool and is handed out to the next thread instead of being closed
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.postgresql_psycopg2.base import DatabaseWrapper as PostgresDatabaseWrapper
+from psycopg2 import extensions
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, size, timeout, health_check_interval):
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, connect):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError('connection pool exhausted')
+
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection, released_at = self.idle.pop()
+
+                if self.is_usable(connection, released_at):
+                    return connection
+                connection.close()
+
+            return connect()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection, errors_occurred=False):
+        """
+        Returns connection to the pool. Connection whose owner ran into a database error or that is no longer usable
+        is closed instead, so it is never handed out again
+        """
+        try:
+            if errors_occurred or not self.is_usable(connection, time.monotonic()):
+                connection.close()
+                return
+
+            status = connection.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                connection.close()
+                return
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        except Exception:
+            connection.close()
+        finally:
+            self.slots.release()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, released_at in idle:
+            connection.close()
+
+    def is_usable(self, connection, released_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+
+def get_pool(alias):
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = ConnectionPool(settings.DB_POOL_SIZE, settings.DB_POOL_TIMEOUT,
+                                          settings.DB_HEALTH_CHECK_INTERVAL)
+        return pools[alias]
+
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close_idle()
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        return get_pool(self.alias).acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            get_pool(self.alias).release(self.connection, self.errors_occurred)
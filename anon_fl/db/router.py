@@ -0,0 +1,163 @@
+"""
+Read replica routing. Reads of list and retrieve actions of views with ReplicaReadsMixin go to replicas from
+DATABASE_REPLICAS, everything else reads from primary. Replicas are not used when:
+- the user made a successful write in the last REPLICA_STICKY_SECONDS (read-after-write)
+- replica lags more than REPLICA_MAX_LAG seconds or does not answer
+- reads are inside transaction
+Authentication and permission checks always read from primary
+"""
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction, ProgrammingError
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+LAG_QUERIES = (
+    # PostgreSQL 10+
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END',
+    # PostgreSQL 9.x
+    'SELECT CASE WHEN pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END',
+)
+
+_local = threading.local()
+
+
+def measure_lag(alias):
+    """
+    Replication lag in seconds. Server which is not in recovery (plain second database) has no lag
+    """
+    for query in LAG_QUERIES:
+        try:
+            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                cursor.execute(query)
+                lag = cursor.fetchone()[0]
+            return float(lag or 0)
+        except ProgrammingError:
+            # function does not exist in this server version
+            continue
+    return 0.0
+
+
+class ReplicaHealth:
+    """
+    Per-process cache of replica lag, each replica is checked at most once per REPLICA_LAG_CHECK_INTERVAL
+    """
+    def __init__(self, measure=measure_lag, clock=time.monotonic):
+        self.measure = measure
+        self.clock = clock
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        now = self.clock()
+        with self.lock:
+            checked_at, healthy = self.checked.get(alias, (None, True))
+            if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+                return healthy
+            # other threads keep using previous state while this one checks
+            self.checked[alias] = (now, healthy)
+
+        try:
+            lag = self.measure(alias)
+            healthy = lag <= settings.REPLICA_MAX_LAG
+            if not healthy:
+                logger.warning('replica %s lags %.1fs, reading from primary', alias, lag)
+        except Exception as e:
+            logger.warning('replica %s check failed: %r', alias, e)
+            healthy = False
+
+        with self.lock:
+            self.checked[alias] = (now, healthy)
+        return healthy
+
+
+health = ReplicaHealth()
+_round_robin = itertools.count()
+
+
+def use_replica(value):
+    _local.use_replica = value
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not getattr(_local, 'use_replica', False) or connections['default'].in_atomic_block:
+            return 'default'
+
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas:
+            return 'default'
+
+        start = next(_round_robin)
+        for i in range(len(replicas)):
+            alias = replicas[(start + i) % len(replicas)]
+            if health.is_healthy(alias):
+                return alias
+
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def sticky_key(user_id):
+    return 'db:sticky:{0}'.format(user_id)
+
+
+def stick_to_primary(user_id):
+    """
+    Reads of the user go to primary for REPLICA_STICKY_SECONDS. Called after writes of authenticated requests,
+    and by views that create or log in the user
+    """
+    cache.set(sticky_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+class ReplicaReadsMixin:
+    """
+    DRF view mixin: `replica_actions` of safe requests read from replicas once the request is authenticated
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and getattr(self, 'action', None) in self.replica_actions:
+            # anonymous requests never write, so they skip stickiness lookup
+            user_id = request.user.id
+            use_replica(user_id is None or cache.get(sticky_key(user_id)) is None)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Keeps every request on primary until a view opts in, marks users sticky after their successful writes
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        use_replica(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica(False)
+
+        # DRF sets authenticated user on django request too
+        user_id = getattr(getattr(request, 'user', None), 'id', None)
+        if request.method not in SAFE_METHODS and user_id is not None and response.status_code < 400:
+            stick_to_primary(user_id)
+
+        return response
@@ -0,0 +1,47 @@
+"""
+Gunicorn production profile: gunicorn -c anon_fl/gunicorn_conf.py anon_fl.wsgi:application
+
+Every value can be overridden with GUNICORN_* environment variables
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', ':8000')
+
+# threads let a worker serve other requests while one waits on notify service or database
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# gevent and eventlet only
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+
+# workers are recycled after random number of requests around max_requests, so they never restart all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# django is imported once in master, workers share its memory pages
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', None)
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole gevent hub without green wait callback
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('psycogreen is not installed, database queries will block gevent workers')
+        else:
+            patch_psycopg()
+
+
+def child_exit(server, worker):
+    from anon_fl.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
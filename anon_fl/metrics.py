@@ -0,0 +1,70 @@
+"""
+Prometheus metrics. Values are aggregated in-process; with `prometheus_multiproc_dir` set every gunicorn worker
+and celery child writes them to its own mmap file, and the exporter merges files of all processes on scrape
+"""
+import os
+
+from django.http import HttpResponse
+from django.views.decorators.cache import never_cache
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, start_http_server
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR = os.environ.get('prometheus_multiproc_dir') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+http_request_duration = Histogram('http_request_duration_seconds', 'API request latency',
+                                  ('route', 'status'), buckets=REQUEST_BUCKETS)
+http_request_queries = Histogram('http_request_db_queries', 'Database queries per API request',
+                                 ('route',), buckets=QUERY_BUCKETS)
+http_request_db_duration = Histogram('http_request_db_duration_seconds', 'Database time per API request',
+                                     ('route',), buckets=REQUEST_BUCKETS)
+
+cache_requests = Counter('cache_requests_total', 'Redis cache lookups', ('result',))
+
+celery_task_duration = Histogram('celery_task_duration_seconds', 'Celery task run time', ('task', 'state'),
+                                 buckets=REQUEST_BUCKETS + (30, 60, 300))
+celery_queue_lag = Histogram('celery_queue_lag_seconds', 'Time between task publish and start', ('queue',),
+                             buckets=REQUEST_BUCKETS + (30, 60, 300))
+
+notify_request_duration = Histogram('notify_request_duration_seconds', 'Notify service call latency', ('path',),
+                                    buckets=REQUEST_BUCKETS)
+notify_errors = Counter('notify_errors_total', 'Failed or skipped notify service calls', ('path', 'reason'))
+notify_circuit_open = Gauge('notify_circuit_open', 'Notify circuit breaker is open', multiprocess_mode='max')
+notify_circuit_trips = Counter('notify_circuit_trips_total', 'Notify circuit breaker trips')
+notify_parked = Gauge('notify_parked_notifications', 'Undelivered parked notifications', multiprocess_mode='livesum')
+
+
+def observe_request(route, status, wall, sql_count, sql_time):
+    http_request_duration.labels(route, '{0}xx'.format(status // 100)).observe(wall)
+    http_request_queries.labels(route).observe(sql_count)
+    http_request_db_duration.labels(route).observe(sql_time)
+
+
+def get_registry():
+    if MULTIPROC_DIR is None:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+@never_cache
+def metrics_view(request):
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def start_exporter(port):
+    """
+    Standalone exporter for processes without django views, i.e. celery worker
+    """
+    start_http_server(port, registry=get_registry())
+
+
+def mark_process_dead(pid):
+    if MULTIPROC_DIR is not None:
+        multiprocess.mark_process_dead(pid)
+
@@ -1,7 +1,18 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
 import jwt
 from django.conf import settings
 import requests
 
+from anon_fl import metrics
+from anon_fl.profiling import timed_http
+
 BASE_URL = settings.NOTIFY_URL
 
 ORDER_CHAT_NEW_MESSAGE = 'ORDER_CHAT_NEW_MESSAGE'
@@ -9,23 +20,281 @@ ORDER_APPLICATION_REQUEST_RECEIVED = 'ORDER_APPLICATION_REQUEST_RECEIVED'
 ORDER_APPLICATION_APPROVED = 'ORDER_APPLICATION_APPROVED'
 ORDER_APPLICATION_DECLINED = 'ORDER_APPLICATION_DECLINED'
 
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling notify service after `failure_threshold` consecutive failures. After `reset_timeout` seconds
+    single probe call is let through (half-open state): success closes the circuit, failure opens it again
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        self.on_state_change = on_state_change
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+
+            return False
+
+    def success(self):
+        with self.lock:
+            changed = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+        if changed and self.on_state_change is not None:
+            self.on_state_change(self.CLOSED)
+
+    def failure(self):
+        tripped = False
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    tripped = True
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+        if tripped and self.on_state_change is not None:
+            self.on_state_change(self.OPEN)
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            # any exception ends the call, a half-open probe must not stay taken forever
+            self.failure()
+            raise
+
+        if result.status_code >= 500:
+            self.failure()
+            result.raise_for_status()
+
+        self.success()
+        return result
+
+
+def breaker_state_changed(state):
+    metrics.notify_circuit_open.set(state == CircuitBreaker.OPEN)
+    if state == CircuitBreaker.OPEN:
+        metrics.notify_circuit_trips.inc()
+
+
+breaker = CircuitBreaker(settings.NOTIFY_FAILURE_THRESHOLD, settings.NOTIFY_RESET_TIMEOUT,
+                         on_state_change=breaker_state_changed)
+
+# notifications which were not delivered while notify service was unavailable,
+# redelivered in background after next successful call
+parked = deque(maxlen=settings.NOTIFY_PARKED_MAX)
+
 
 def generate_jwt():
     return jwt.encode({}, settings.JWT_NOTIFY_SECRET)
 
 
-def notify(user_ids, entity_id, key, data):
-    return requests.post(BASE_URL + '/notify', json={
+def post(path, payload, timeout=None):
+    if timeout is None:
+        timeout = settings.NOTIFY_TIMEOUT
+    payload['token'] = generate_jwt()
+    with timed_http(), metrics.notify_request_duration.labels(path).time():
+        return breaker.call(requests.post, BASE_URL + path, json=payload, timeout=timeout)
+
+
+def deliver(path, payload, timeout=None):
+    """
+    Never raises: on failure or open circuit payload is parked and None is returned
+    """
+    try:
+        response = post(path, payload, timeout)
+    except (CircuitOpen, requests.RequestException) as e:
+        logger.warning('notify %s failed: %r, parking', path, e)
+        metrics.notify_errors.labels(path, 'circuit_open' if isinstance(e, CircuitOpen) else 'error').inc()
+        parked.append((path, payload))
+        metrics.notify_parked.set(len(parked))
+        return None
+
+    schedule_redelivery()
+    return response
+
+
+redelivery_lock = threading.Lock()
+redelivery = None
+
+
+def schedule_redelivery():
+    """
+    Starts redelivery of parked notifications in a background thread, unless it is running or nothing is parked:
+    the request whose call succeeded does not wait for the backlog. Returns the started thread
+    """
+    global redelivery
+    with redelivery_lock:
+        if not parked or (redelivery is not None and redelivery.is_alive()):
+            return None
+        redelivery = threading.Thread(target=redeliver_parked, name='notify-redelivery', daemon=True)
+        redelivery.start()
+        return redelivery
+
+
+def redeliver_parked():
+    """
+    Redelivers parked notifications until none is left or a call fails
+    """
+    try:
+        while True:
+            try:
+                path, payload = parked.popleft()
+            except IndexError:
+                return
+
+            try:
+                post(path, payload)
+            except (CircuitOpen, requests.RequestException):
+                parked.appendleft((path, payload))
+                return
+    finally:
+        metrics.notify_parked.set(len(parked))
+
+
+def stats():
+    return {
+        'state': breaker.state,
+        'failures': breaker.failures,
+        'trips': breaker.trips,
+        'parked': len(parked)
+    }
+
+
+def notify(user_ids, entity_id, key, data, timeout=None):
+    return deliver('/notify', {
+        'user_ids': user_ids,
+        'entity_id': entity_id,
+        'key': key,
+        'data': data
+    }, timeout)
+
+
+def read_notifications(user_id, timeout=None):
+    return deliver('/notifications/read', {
+        'user_id': user_id
+    }, timeout)
+
+
+class NotifyUnavailable(Exception):
+    pass
+
+
+async def http_post_json(url, payload, timeout):
+    """
+    Minimal HTTP/1.1 client for async views: one connection per call, returns response status
+    """
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    parts = urlsplit(url)
+    body = json.dumps(payload).encode()
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80),
+                                            connect_timeout)
+    try:
+        writer.write('POST {0} HTTP/1.1\r\nHost: {1}\r\nContent-Type: application/json\r\n'
+                     'Content-Length: {2}\r\nConnection: close\r\n\r\n'.format(parts.path or '/', parts.netloc,
+                                                                              len(body)).encode() + body)
+        status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+        # body is not used, but the server should not see connection reset before it has answered
+        await asyncio.wait_for(reader.read(), read_timeout)
+    finally:
+        writer.close()
+
+    try:
+        return int(status_line.split()[1])
+    except (IndexError, ValueError):
+        raise NotifyUnavailable('malformed response {0!r}'.format(status_line))
+
+
+async def post_async(path, payload, timeout=None):
+    """
+    Async counterpart of post() sharing the same circuit breaker
+    """
+    if timeout is None:
+        timeout = settings.NOTIFY_TIMEOUT
+    if not breaker.allow():
+        raise CircuitOpen
+
+    token = generate_jwt()
+    payload['token'] = token.decode() if isinstance(token, bytes) else token
+    with metrics.notify_request_duration.labels(path).time():
+        try:
+            status = await http_post_json(BASE_URL + path, payload, timeout)
+        except BaseException:
+            # cancellation included, a half-open probe must not stay taken forever
+            breaker.failure()
+            raise
+
+    if status >= 500:
+        breaker.failure()
+        raise NotifyUnavailable('status {0}'.format(status))
+
+    breaker.success()
+    return status
+
+
+async def deliver_async(path, payload, timeout=None):
+    """
+    Never raises: on failure or open circuit payload is parked
+    """
+    try:
+        status = await post_async(path, payload, timeout)
+    except (CircuitOpen, OSError, asyncio.TimeoutError, NotifyUnavailable) as e:
+        logger.warning('notify %s failed: %r, parking', path, e)
+        metrics.notify_errors.labels(path, 'circuit_open' if isinstance(e, CircuitOpen) else 'error').inc()
+        parked.append((path, payload))
+        metrics.notify_parked.set(len(parked))
+        return None
+
+    schedule_redelivery()
+    return status
+
+
+async def notify_async(user_ids, entity_id, key, data, timeout=None):
+    return await deliver_async('/notify', {
         'user_ids': user_ids,
         'entity_id': entity_id,
         'key': key,
-        'data': data,
-        'token': generate_jwt()
-    })
+        'data': data
+    }, timeout)
 
 
-def read_notifications(user_id):
-    return requests.post(BASE_URL + '/notifications/read', json={
-        'user_id': user_id,
-        'token': generate_jwt()
-    })
+async def read_notifications_async(user_id, timeout=None):
+    return await deliver_async('/notifications/read', {
+        'user_id': user_id
+    }, timeout)
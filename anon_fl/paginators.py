@@ -1,5 +1,48 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
-class EnlargedResultsSetPagination(PageNumberPagination):
+class ResultsSetPagination(PageNumberPagination):
+    """
+    PAGE_SIZE by default, clients may ask up to public_max_page_size objects with `page_size`,
+    staff up to max_page_size
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
+    public_max_page_size = 200
+
+    def get_page_size(self, request):
+        page_size = super().get_page_size(request)
+        if page_size is not None and not request.user.is_staff:
+            return min(page_size, self.public_max_page_size)
+        return page_size
+
+    def paginate_queryset_lazy(self, queryset, request, view=None):
+        """
+        Same as paginate_queryset, but returns unevaluated queryset of the page for streaming
+        """
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        self.request = request
+        return self.page.object_list
+
+
+class EnlargedResultsSetPagination(ResultsSetPagination):
+    page_size = 40
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Newest first, without COUNT query and with stable pages while new rows are inserted
+    """
     page_size = 40
+    ordering = '-created_at'
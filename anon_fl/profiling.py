@@ -0,0 +1,165 @@
+"""
+Low-overhead request profiling: per route wall time, SQL count and time, outbound HTTP time,
+plus full cProfile traces for a sampled fraction of requests
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from anon_fl import metrics
+
+_local = threading.local()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.http_time = 0.0
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_time += time.perf_counter() - started
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def timed_http():
+    """
+    Wraps outbound HTTP calls, so their time is accounted to the current request
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile = current_profile()
+        if profile is not None:
+            profile.http_time += time.perf_counter() - started
+
+
+class RouteStats:
+    """
+    In-process aggregates per route: [requests, wall, sql count, sql time, http time, max wall]
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, wall, profile):
+        with self.lock:
+            stats = self.routes.setdefault(route, [0, 0.0, 0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += wall
+            stats[2] += profile.sql_count
+            stats[3] += profile.sql_time
+            stats[4] += profile.http_time
+            stats[5] = max(stats[5], wall)
+
+    def snapshot(self):
+        with self.lock:
+            return {route: dict(zip(('requests', 'wall', 'sql_count', 'sql_time', 'http_time', 'max_wall'), stats))
+                    for route, stats in self.routes.items()}
+
+
+route_stats = RouteStats()
+
+
+@contextmanager
+def track_sql(profile):
+    """
+    Django >= 2.0 has execute wrappers. Older versions only can time queries with debug cursor,
+    so queries_log of every connection is read after request
+    """
+    if hasattr(connections['default'], 'execute_wrapper'):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile.sql_wrapper))
+            yield
+        return
+
+    # every connection gets a fresh log for the request, so saturated or disabled log does not matter
+    state = []
+    for connection in connections.all():
+        state.append((connection, connection.force_debug_cursor, connection.queries_log))
+        connection.force_debug_cursor = True
+        connection.queries_log = deque(maxlen=connection.queries_limit)
+    try:
+        yield
+    finally:
+        for connection, force_debug_cursor, queries_log in state:
+            queries = connection.queries_log
+            profile.sql_count += len(queries)
+            profile.sql_time += sum(float(query['time']) for query in queries)
+
+            connection.force_debug_cursor = force_debug_cursor
+            if force_debug_cursor or settings.DEBUG:
+                queries_log.extend(queries)
+            connection.queries_log = queries_log
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.url_name if match is not None and match.url_name else 'unresolved'
+    return '{0} {1}'.format(request.method, name)
+
+
+def save_profile(profiler, route):
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    filename = '{0:.6f}-{1}.prof'.format(time.time(), route.replace(' ', '-'))
+    profiler.dump_stats(os.path.join(settings.PROFILING_DIR, filename))
+
+
+def server_timing(wall, profile):
+    return 'total;dur={0:.1f}, sql;dur={1:.1f}, http;dur={2:.1f}, python;dur={3:.1f}'.format(
+        wall * 1000, profile.sql_time * 1000, profile.http_time * 1000,
+        (wall - profile.sql_time - profile.http_time) * 1000)
+
+
+class ProfilingMiddleware:
+    """
+    Adds Server-Timing header and collects per route stats. Sampled cProfile traces are saved to PROFILING_DIR
+    and can be inspected with pstats or snakeviz
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = _local.profile = RequestProfile()
+        profiler = cProfile.Profile() if random.random() < settings.PROFILING_SAMPLE_RATE else None
+
+        started = time.perf_counter()
+        try:
+            with track_sql(profile):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _local.profile = None
+
+        wall = time.perf_counter() - started
+        route = route_name(request)
+        route_stats.record(route, wall, profile)
+        metrics.observe_request(route, response.status_code, wall, profile.sql_count, profile.sql_time)
+        if profiler is not None:
+            save_profile(profiler, route)
+
+        response['Server-Timing'] = server_timing(wall, profile)
+        return response
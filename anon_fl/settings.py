@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+from datetime import timedelta
 
 from os.path import join, dirname
 from dotenv import load_dotenv
@@ -49,13 +50,14 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'corsheaders',
     'api.apps.ApiConfig',
-    'debug_toolbar'
 ]
 
 REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
+    'DEFAULT_PAGINATION_CLASS': 'anon_fl.paginators.ResultsSetPagination',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.JWTAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 }
 
@@ -67,8 +69,10 @@ REST_FRAMEWORK_EXTENSIONS = {
 }
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'anon_fl.profiling.ProfilingMiddleware',
+    'anon_fl.db.router.ReplicaRoutingMiddleware',
     'django.middleware.cache.UpdateCacheMiddleware',
+    'anon_fl.compression.CompressionMiddleware',
     'django.middleware.cache.FetchFromCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,6 +85,14 @@ MIDDLEWARE = [
     'django.middleware.locale.LocaleMiddleware'
 ]
 
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
+# share of requests which get full cProfile trace saved to PROFILING_DIR
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.001))
+PROFILING_DIR = os.environ.get('PROFILING_DIR', '/tmp/anon_fl/profiles')
+
 ROOT_URLCONF = 'anon_fl.urls'
 
 TEMPLATES = [
@@ -101,6 +113,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'anon_fl.wsgi.application'
 
+# threads of every ASGI process (anon_fl/asgi.py): for ORM calls of async views, and for all other requests
+ASGI_DATABASE_THREADS = int(os.environ.get('ASGI_DATABASE_THREADS', 8))
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 8))
+
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
@@ -112,20 +128,74 @@ DATABASES = {
         'USER': os.environ.get('DB_USER', 'postgres'),
         'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
         'HOST': os.environ.get('DB_HOST', 'db'),
-        'PORT': os.environ.get('DB_PORT', '5432')
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        # connection is kept open between requests of the same thread for this number of seconds
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 300))
     }
 }
 
+# idle connection is pinged before reuse if it was not checked for this number of seconds
+DB_HEALTH_CHECK_INTERVAL = 30
+
+# optional per-worker pool shared by threads: at most DB_POOL_SIZE connections, waiting up to DB_POOL_TIMEOUT
+# seconds for a free one. Connections are returned to the pool at the end of every request
+if os.environ.get('DB_POOL') == '1':
+    DATABASES['default'].update({
+        'ENGINE': 'anon_fl.db.pooled',
+        'CONN_MAX_AGE': 0
+    })
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+DB_POOL_TIMEOUT = 10
+
+# read replicas, comma separated host[:port][/name] entries, i.e. "replica1,localhost:5433/anon_fl".
+# List and retrieve reads of views with ReplicaReadsMixin go to replicas, everything else uses default database
+DATABASE_REPLICAS = []
+for i, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(','))):
+    address, _, name = replica.strip().partition('/')
+    host, _, port = address.partition(':')
+    alias = 'replica{0}'.format(i + 1)
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                            NAME=name or DATABASES['default']['NAME'], TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['anon_fl.db.router.ReplicaRouter']
+# client reads from primary for this number of seconds after its successful write
+REPLICA_STICKY_SECONDS = 5
+# replica lagging more than this number of seconds is skipped, lag is checked once per interval in every process
+REPLICA_MAX_LAG = 5
+REPLICA_LAG_CHECK_INTERVAL = 5
+
 # cache
 CACHES = {
     'default': {
-        'BACKEND': 'redis_cache.RedisCache',
+        'BACKEND': 'anon_fl.cache_backends.InstrumentedRedisCache',
         'LOCATION': os.environ.get('REDIS_HOST', 'redis') + ':' + os.environ.get('REDIS_PORT', '6379'),
     }
 }
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
+# token key -> user record cache of api.authentication.CachedTokenAuthentication
+AUTH_TOKEN_CACHE_TTL = 300
+# in-process level can't be invalidated from other workers, so its ttl is kept short
+AUTH_TOKEN_LOCAL_CACHE_SIZE = 10000
+AUTH_TOKEN_LOCAL_CACHE_TTL = 10
+
+# order id -> (chat id, customer id, contractor id) cache of api.participants
+CHAT_PARTICIPANTS_CACHE_TTL = 24 * 60 * 60
+
+# list pages of at least this number of objects are streamed: objects are serialized STREAMING_CHUNK_SIZE at a time
+# and sent in chunks of about STREAMING_BUFFER_SIZE bytes
+STREAMING_MIN_PAGE_SIZE = 100
+STREAMING_CHUNK_SIZE = 200
+STREAMING_BUFFER_SIZE = 16 * 1024
+
+# responses of at least COMPRESSION_MIN_SIZE bytes are compressed with brotli (if `brotli` package is installed)
+# or gzip. Compressed responses are stored in response cache, so levels only cost CPU on cache misses
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -165,6 +235,42 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
+# content-addressed attachment storage (api/storage.py)
+ATTACHMENTS_ROOT = os.environ.get('ATTACHMENTS_ROOT', os.path.join(BASE_DIR, 'attachments'))
+ATTACHMENTS_URL = '/attachments/'
+ATTACHMENT_MAX_SIZE = 100 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# internal nginx location of ATTACHMENTS_ROOT, downloads are handed off to it with X-Accel-Redirect.
+# Empty value makes django send files itself (no nginx in front)
+ATTACHMENTS_ACCEL_PREFIX = os.environ.get('ATTACHMENTS_ACCEL_PREFIX', '/protected-attachments/')
+
+# attachment previews (api/previews.py): kind -> bounding box
+PREVIEW_SIZES = {
+    'thumbnail': (256, 256),
+    'preview': (1280, 1280),
+}
+PREVIEW_QUALITY = 80
+# seconds pdftoppm may spend on the first page
+PREVIEW_TIMEOUT = 30
+# failed preview generation (full disk, pdftoppm timeout) is retried after PREVIEW_RETRY_DELAY seconds
+PREVIEW_MAX_RETRIES = 3
+PREVIEW_RETRY_DELAY = 60
+
+# resumable chat attachment uploads (api/uploads.py)
+UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# seconds without a chunk after which session and its file are removed
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# marketplace statistics (api/stats.py), updated every STATS_INTERVAL seconds by celery beat
+STATS_INTERVAL = 5 * 60
+STATS_BATCH_SIZE = 5000
+# seconds the watermark is moved back: rows committed after the update started but stamped before it are reread
+STATS_WATERMARK_OVERLAP = 2 * 60
+# seconds /stats/ responses are cached by the site cache and clients
+STATS_CACHE_SECONDS = 5 * 60
+STATS_PRICE_PERCENTILES = (25, 50, 75, 90)
+
 INTERNAL_IPS = [
     '127.0.0.1'
 ]
@@ -185,14 +291,26 @@ BROKER_HEARTBEAT = '?heartbeat=30'
 if not BROKER_URL.endswith(BROKER_HEARTBEAT):
     BROKER_URL += BROKER_HEARTBEAT
 
-BROKER_POOL_LIMIT = 1
+# producer connections per process: web threads publishing on commit must not wait for a single connection
+BROKER_POOL_LIMIT = int(os.environ.get('BROKER_POOL_LIMIT', 10))
 BROKER_CONNECTION_TIMEOUT = 10
 
 CELERY_DEFAULT_QUEUE = 'default'
 CELERY_QUEUES = (
     Queue('default', Exchange('default'), routing_key='default'),
-    Queue('registration_email', Exchange('registration_email')),
+    Queue('notifications', Exchange('notifications'), routing_key='notifications'),
+    Queue('fanout', Exchange('fanout'), routing_key='fanout'),
+    Queue('registration_email', Exchange('registration_email'), routing_key='registration_email'),
+    Queue('previews', Exchange('previews'), routing_key='previews'),
 )
+# tasks are routed here, not in task decorators. Glob patterns route future tasks by naming convention
+CELERY_ROUTES = {
+    'api.tasks.send_notification': {'queue': 'notifications'},
+    'api.tasks.notify_*': {'queue': 'notifications'},
+    'api.tasks.fanout_*': {'queue': 'fanout'},
+    'api.tasks.*registration_email*': {'queue': 'registration_email'},
+    'api.tasks.generate_previews': {'queue': 'previews'},
+}
 
 # Sensible settings for celery
 CELERY_ALWAYS_EAGER = False
@@ -213,16 +331,43 @@ REDIS_HOST = os.environ.get('REDIS_PORT_6379_TCP_ADDR', 'redis')
 
 # Set redis as celery result backend
 CELERY_RESULT_BACKEND = 'redis://%s:%d/%d' % (REDIS_HOST, REDIS_PORT, REDIS_DB)
-CELERY_REDIS_MAX_CONNECTIONS = 1
+CELERY_REDIS_MAX_CONNECTIONS = int(os.environ.get('CELERY_REDIS_MAX_CONNECTIONS', 20))
 
 # Don't use pickle as serializer, json is much safer
 CELERY_TASK_SERIALIZER = "json"
 CELERY_ACCEPT_CONTENT = ['application/json']
 
 CELERYD_HIJACK_ROOT_LOGGER = False
-CELERYD_PREFETCH_MULTIPLIER = 1
+# workers started with a profile below override it
+CELERYD_PREFETCH_MULTIPLIER = 4
 CELERYD_MAX_TASKS_PER_CHILD = 1000
 
+# worker profiles of run_celery.sh (api/workers.py): queues consumed, pool and prefetch per process.
+# Short I/O bound tasks prefetch many messages per process, long CPU bound ones take one at a time
+# and are handed to whichever process is free (fair scheduling)
+CELERY_WORKER_PROFILES = {
+    'default': {'queues': ['default', 'notifications', 'fanout'], 'concurrency': 8, 'prefetch_multiplier': 16},
+    'email': {'queues': ['registration_email'], 'concurrency': 2, 'prefetch_multiplier': 1},
+    'previews': {'queues': ['previews'], 'concurrency': os.cpu_count() or 1, 'prefetch_multiplier': 1,
+                 'fair': True, 'max_tasks_per_child': 100},
+    # development: one worker for every queue
+    'all': {'queues': [queue.name for queue in CELERY_QUEUES], 'concurrency': 4, 'prefetch_multiplier': 4},
+}
+
+# run by `celery beat -A api.celeryconf`
+CELERYBEAT_SCHEDULE = {
+    'gc-upload-sessions': {
+        'task': 'api.tasks.gc_upload_sessions',
+        'schedule': timedelta(hours=1),
+    },
+    'update-marketplace-stats': {
+        'task': 'api.tasks.update_marketplace_stats',
+        'schedule': timedelta(seconds=STATS_INTERVAL),
+        # a late run is superseded by the next one
+        'options': {'expires': STATS_INTERVAL},
+    },
+}
+
 LOGGING = {
     'version': 1,
     'filters': {
@@ -247,10 +392,27 @@ LOGGING = {
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+# email
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+DEFAULT_FROM_EMAIL = 'autechregescom@gmail.com'
+# registration emails are buffered and sent in batches over a single SMTP connection
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 100))
+EMAIL_BATCH_DELAY = int(os.environ.get('EMAIL_BATCH_DELAY', 5))
+
 NOTIFY_URL = "%s:%s" % (os.environ.get('NOTIFY_SERVICE_HOST', 'notify'), os.environ.get('NOTIFY_SERVICE_PORT', '8882'))
+# (connect, read) timeouts of a single notify call, seconds
+NOTIFY_TIMEOUT = (0.5, float(os.environ.get('NOTIFY_TIMEOUT', 2)))
+# circuit breaker opens after this number of consecutive failures and lets a probe through after reset timeout
+NOTIFY_FAILURE_THRESHOLD = 5
+NOTIFY_RESET_TIMEOUT = 30
+NOTIFY_PARKED_MAX = 10000
 
 JWT_USER_SECRET = os.environ.get('JWT_USER_SECRET', '4b9cba3582ece685857c19e381c99781d9cd44c4')
 JWT_NOTIFY_SECRET = os.environ.get('JWT_NOTIFY_SECRET', '655b747e495a195217241dfcb27eaf5ef8c3e7a4')
+# lifetime of user access and refresh tokens, seconds
+JWT_ACCESS_TTL = 15 * 60
+JWT_REFRESH_TTL = 14 * 24 * 60 * 60
 
 if DEBUG:
     import logging
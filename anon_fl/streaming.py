@@ -0,0 +1,100 @@
+"""
+Streaming list responses. Large pages are serialized object by object from a queryset iterator and sent with
+StreamingHttpResponse, so neither the list of serialized dicts nor the rendered page is ever held in memory.
+Output is byte for byte the same as JSONRenderer gives for the paginated response
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework.compat import SHORT_SEPARATORS, LONG_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+def iterate(queryset, chunk_size):
+    """
+    Single query iterator over queryset. QuerySet.iterator() ignores prefetch_related,
+    so lookups are prefetched for every chunk of objects instead
+    """
+    lookups = queryset._prefetch_related_lookups
+    chunk = []
+    for instance in queryset.iterator():
+        chunk.append(instance)
+        if len(chunk) == chunk_size:
+            prefetch_related_objects(chunk, *lookups)
+            yield from chunk
+            chunk = []
+
+    if chunk:
+        prefetch_related_objects(chunk, *lookups)
+        yield from chunk
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    def render_stream(self, envelope, results, buffer_size):
+        """
+        Renders envelope with `results` list appended as the last key. Items are rendered one by one
+        and sent in chunks of about `buffer_size` bytes
+        """
+        item_separator, key_separator = [separator.encode() for separator in
+                                         (SHORT_SEPARATORS if self.compact else LONG_SEPARATORS)]
+
+        head = self.render(envelope)[:-1]
+        buffer = bytearray(head)
+        if envelope:
+            buffer += item_separator
+        buffer += b'"results"' + key_separator + b'['
+
+        first = True
+        for item in results:
+            if not first:
+                buffer += item_separator
+            first = False
+            buffer += self.render(item)
+
+            if len(buffer) >= buffer_size:
+                yield bytes(buffer)
+                buffer.clear()
+
+        buffer += b']}'
+        yield bytes(buffer)
+
+
+class StreamingListMixin:
+    """
+    List action which streams pages of at least STREAMING_MIN_PAGE_SIZE objects.
+    Smaller pages and non JSON formats are rendered as usual
+    """
+    def list(self, request, *args, **kwargs):
+        return self.paginated_list(self.filter_queryset(self.get_queryset()))
+
+    def paginated_list(self, queryset):
+        paginator = self.paginator
+        page_size = paginator.get_page_size(self.request) if hasattr(paginator, 'paginate_queryset_lazy') else None
+
+        if not page_size or page_size < settings.STREAMING_MIN_PAGE_SIZE \
+                or self.request.accepted_renderer.format != 'json':
+            page = self.paginate_queryset(queryset)
+            if page is None:
+                return Response(self.get_serializer(queryset, many=True).data)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        page = paginator.paginate_queryset_lazy(queryset, self.request, view=self)
+        # rows are fetched after middlewares returned, so database is chosen now
+        page = page.using(page.db)
+        serializer = self.get_serializer()
+
+        envelope = OrderedDict([
+            ('count', paginator.page.paginator.count),
+            ('next', paginator.get_next_link()),
+            ('previous', paginator.get_previous_link()),
+        ])
+        results = (serializer.to_representation(instance)
+                   for instance in iterate(page, settings.STREAMING_CHUNK_SIZE))
+
+        return StreamingHttpResponse(
+            StreamingJSONRenderer().render_stream(envelope, results, settings.STREAMING_BUFFER_SIZE),
+            content_type='application/json'
+        )
@@ -2,9 +2,11 @@ from django.conf.urls import url, include
 from django.contrib import admin
 
 from anon_fl import settings
+from anon_fl.metrics import metrics_view
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics$', metrics_view, name='metrics'),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^', include('api.urls'))
 ]
@@ -0,0 +1,158 @@
+"""
+Write paths shared by sync views (api/views.py) and async views (api/async_views.py). Functions do database work
+only and raise DRF exceptions, notify service calls are left to the caller
+"""
+from django.db import transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAcceptable, NotFound, PermissionDenied
+
+from anon_fl import notify_api
+from api import models, storage
+from api.models import Order, OrderApplication, OrderChat, OrderChatAttachment, UploadSession
+from api.participants import warm_chat_participants
+from api.serializers import OrderApplicationListSerializer
+from api.tasks import queue_previews, send_notification
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = {'application': 'Cannot apply to own order'}
+
+
+class OrderClosed(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = {'order': 'Order already has contractor. Applications are no longer accepted'}
+
+
+def save_chat_message(serializer, participants, sender_id):
+    """
+    Saves validated message serializer. Returns message data for notification and ids of receivers
+    """
+    serializer.save(chat_id=participants.chat_id, sender_id=sender_id)
+    OrderChat.objects.filter(id=participants.chat_id).update(messages_count=F('messages_count') + 1)
+    return chat_message_payload(serializer, participants, sender_id)
+
+
+def chat_message_payload(serializer, participants, sender_id):
+    data = serializer.data
+    data['order_title'], data['order_id'] = participants.order_title, participants.order_id
+    receivers = [_id for _id in [participants.contractor_id, participants.customer_id] if _id != sender_id]
+    return data, receivers
+
+
+def commit_chat_upload(session, path, serializer, participants):
+    """
+    Stores verified file of upload session at `path` and posts it to the chat with a message from validated
+    serializer. Returns message data and receivers as save_chat_message does
+    """
+    with transaction.atomic():
+        # session could be removed by garbage collection while its file was hashed
+        if not UploadSession.objects.select_for_update().filter(id=session.id).exists():
+            raise NotFound({'upload': 'Upload session not found'})
+
+        stored = storage.store(storage.TempBlob(path, session.hash, session.size))
+        queue_previews(stored, session.filename)
+        message = serializer.save(chat_id=participants.chat_id, sender_id=session.user_id)
+        OrderChatAttachment.objects.create(message=message, filename=session.filename, hash=session.hash,
+                                           url=storage.blob_url(session.hash))
+        OrderChat.objects.filter(id=participants.chat_id).update(messages_count=F('messages_count') + 1)
+        # file is removed on commit, unless it was moved to storage
+        session.delete()
+
+    return chat_message_payload(serializer, participants, session.user_id)
+
+
+def apply_to_order(order_id, applicant_id):
+    """
+    Returns order and serialized application with order title
+    """
+    order = Order.objects.filter(id=order_id).first()
+    if order is None:
+        raise NotFound({'order': 'Order not found'})
+
+    if order.customer_id == applicant_id:
+        raise Conflict
+
+    if order.contractor_id is not None:
+        raise OrderClosed
+
+    application, created = OrderApplication.apply(order_id, applicant_id)
+    if not application:
+        raise OrderClosed
+
+    serialized = OrderApplicationListSerializer(application).data
+    serialized['order_title'] = order.title
+    return order, serialized
+
+
+def withdraw_application(order_id, applicant_id):
+    """
+    Applicant withdraws own application, unless it is accepted. Conflict if it was accepted or declined
+    after it was read
+    """
+    application = OrderApplication.objects.filter(applicant_id=applicant_id, order_id=order_id).first()
+    if application is None:
+        raise NotFound
+
+    if application.status == models.ApplicationStatus.ACCEPTED.value:
+        raise NotAcceptable
+
+    if not application.set_status(models.ApplicationStatus.WITHDRAWN.value):
+        raise Conflict({'application': 'Application status has changed'})
+
+    return application
+
+
+def change_application_status(customer_id, order_id, application_id, application_status):
+    """
+    Customer accepts or declines application. Accepting declines all other new applications of the order.
+    Notifications are queued when transaction is committed
+    """
+    permitted_statuses = [models.ApplicationStatus.ACCEPTED.value, models.ApplicationStatus.DECLINED.value]
+    declined_ids = []
+
+    with transaction.atomic():
+        # concurrent accepts of the same order wait here and see contractor set by the first one
+        order = get_object_or_404(Order.objects.select_for_update(), id=order_id)
+        if order.customer_id != customer_id \
+                or application_status not in permitted_statuses \
+                or order.contractor_id is not None:
+            raise PermissionDenied
+
+        application = get_object_or_404(OrderApplication.objects.select_for_update(), id=application_id,
+                                        order_id=order_id)
+        if application.status != models.ApplicationStatus.NEW.value:
+            raise NotAcceptable
+
+        application.set_status(application_status)
+
+        if application_status == models.ApplicationStatus.ACCEPTED.value:
+            order.status = models.OrderStatus.IN_PROCESS.value
+            order.contractor_id = application.applicant_id
+            order.save(update_fields=['status', 'contractor', 'updated_at'])
+
+            order_chat = OrderChat.objects.create(order_id=order_id)
+            declined_ids = OrderApplication.decline_new(order_id)
+            transaction.on_commit(lambda: warm_chat_participants(order, order_chat))
+
+        if application.status == models.ApplicationStatus.ACCEPTED.value:
+            key = notify_api.ORDER_APPLICATION_APPROVED
+        else:
+            key = notify_api.ORDER_APPLICATION_DECLINED
+
+        serialized = OrderApplicationListSerializer(application).data
+        serialized['order_title'] = order.title
+
+        # notifications are queued only if transaction is committed
+        transaction.on_commit(lambda: send_notification.delay([application.applicant_id], order.id, key, serialized))
+        if declined_ids:
+            transaction.on_commit(lambda: send_notification.delay(
+                declined_ids, order.id, notify_api.ORDER_APPLICATION_DECLINED, {
+                    'order_id': order.id,
+                    'order_title': order.title,
+                    'status': models.ApplicationStatus.DECLINED.value
+                }))
+
+    return serialized
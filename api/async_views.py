@@ -0,0 +1,74 @@
+"""
+Async versions of the endpoints which wait on external I/O, served by anon_fl/asgi.py.
+Responses are the same as of api/views.py, database work is shared with them through api/actions.py
+"""
+from rest_framework.exceptions import NotAuthenticated, NotFound, PermissionDenied
+
+from anon_fl import notify_api
+from anon_fl.aio import JSONResponse, database_sync_to_async
+from api.actions import save_chat_message, apply_to_order, change_application_status
+from api.authentication import CachedTokenAuthentication, JWTAuthentication
+from api.participants import get_chat_participants
+from api.serializers import OrderChatMessageListSerializer
+
+
+async def authenticate(request):
+    # access token is verified without I/O, token authentication may go to redis and database
+    result = JWTAuthentication().authenticate(request)
+    if result is None:
+        result = await database_sync_to_async(CachedTokenAuthentication().authenticate)(request)
+    if result is None:
+        raise NotAuthenticated
+
+    request.user, request.auth = result
+
+
+async def chat_message_create(request, order_id):
+    await authenticate(request)
+
+    participants = await database_sync_to_async(get_chat_participants)(order_id)
+    if participants is None:
+        raise NotFound
+    if request.user.id not in [participants.customer_id, participants.contractor_id]:
+        raise PermissionDenied
+
+    serializer = OrderChatMessageListSerializer(data=request.data, context={'order_id': participants.order_id})
+    serializer.is_valid(raise_exception=True)
+    data, receivers = await database_sync_to_async(save_chat_message)(serializer, participants, request.user.id)
+
+    await notify_api.notify_async(receivers, participants.chat_id, notify_api.ORDER_CHAT_NEW_MESSAGE, data)
+    return JSONResponse(serializer.data, 201)
+
+
+async def order_application_create(request, order_id):
+    await authenticate(request)
+
+    order, serialized = await database_sync_to_async(apply_to_order)(order_id, request.user.id)
+
+    await notify_api.notify_async([order.customer_id], order.id, notify_api.ORDER_APPLICATION_REQUEST_RECEIVED,
+                                  serialized)
+    return JSONResponse(serialized)
+
+
+async def order_application_status_update(request, order_id, pk):
+    await authenticate(request)
+
+    # notifications are queued to celery on commit, as sync view does
+    serialized = await database_sync_to_async(change_application_status)(request.user.pk, order_id, pk,
+                                                                          request.data.get('status'))
+    return JSONResponse(serialized)
+
+
+async def notifications_mark_as_read(request):
+    await authenticate(request)
+
+    await notify_api.read_notifications_async(request.user.id)
+    return JSONResponse({'status': 'ok'})
+
+
+routes = [
+    ('POST', r'^/orders/(?P<order_id>[0-9]+)/chat/messages/$', chat_message_create),
+    ('POST', r'^/orders/(?P<order_id>[0-9]+)/applications/$', order_application_create),
+    ('PUT', r'^/orders/(?P<order_id>[0-9]+)/applications/(?P<pk>[0-9]+)/status/$', order_application_status_update),
+    ('POST', r'^/notifications/mark_as_read', notifications_mark_as_read),
+]
@@ -0,0 +1,146 @@
+import datetime
+
+import jwt
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from api.cache import LRUCache
+from api.models import CachedUser
+
+USER_FIELDS = ('id', 'username', 'email', 'is_active', 'is_staff', 'is_superuser')
+
+JWT_ALGORITHM = 'HS256'
+JWT_ACCESS = 'access'
+JWT_REFRESH = 'refresh'
+
+local_cache = LRUCache(settings.AUTH_TOKEN_LOCAL_CACHE_SIZE, settings.AUTH_TOKEN_LOCAL_CACHE_TTL)
+
+
+def token_cache_key(key):
+    return 'auth:token:' + key
+
+
+def invalidate_token(key):
+    local_cache.delete(key)
+    cache.delete(token_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement of TokenAuthentication. Resolves token key to minimal user record through in-process LRU,
+    then redis, and only then database. request.user is read-only CachedUser built from the record:
+    it has id, username, email and flags. request.auth is the token key
+    """
+    def authenticate_credentials(self, key):
+        record = local_cache.get(key)
+
+        if record is None:
+            record = cache.get(token_cache_key(key))
+            if record is None:
+                record = self.fetch_record(key)
+                cache.set(token_cache_key(key), record, settings.AUTH_TOKEN_CACHE_TTL)
+            local_cache.set(key, record)
+
+        if not record['is_active']:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return CachedUser(**record), key
+
+    def fetch_record(self, key):
+        try:
+            row = Token.objects.filter(key=key).values(*['user__' + field for field in USER_FIELDS]).get()
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        return {field: row['user__' + field] for field in USER_FIELDS}
+
+
+def encode_jwt(user, token_type):
+    now = datetime.datetime.utcnow()
+    lifetime = settings.JWT_ACCESS_TTL if token_type == JWT_ACCESS else settings.JWT_REFRESH_TTL
+    payload = {
+        'user_id': user.id,
+        'type': token_type,
+        'iat': now,
+        'exp': now + datetime.timedelta(seconds=lifetime)
+    }
+
+    # access token carries everything request.user needs, so it is verified without database
+    if token_type == JWT_ACCESS:
+        payload.update({
+            'username': user.username,
+            'email': user.email,
+            'is_staff': user.is_staff,
+            'is_superuser': user.is_superuser
+        })
+
+    token = jwt.encode(payload, settings.JWT_USER_SECRET, algorithm=JWT_ALGORITHM)
+    # PyJWT < 2 returns bytes
+    return token.decode('utf-8') if isinstance(token, bytes) else token
+
+
+def issue_jwt(user):
+    return {
+        'jwt': encode_jwt(user, JWT_ACCESS),
+        'jwt_refresh': encode_jwt(user, JWT_REFRESH)
+    }
+
+
+def decode_jwt(token, token_type):
+    try:
+        payload = jwt.decode(token, settings.JWT_USER_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    except jwt.InvalidTokenError:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    if payload.get('type') != token_type:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    return payload
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    Stateless authentication with short-lived access tokens: `Authorization: Bearer <jwt>`.
+    Signature and expiration are checked, database is not touched. Notify service can verify the same tokens
+    with JWT_USER_SECRET
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        payload = decode_jwt(token, JWT_ACCESS)
+        user = CachedUser(
+            id=payload['user_id'],
+            username=payload['username'],
+            email=payload['email'],
+            is_active=True,
+            is_staff=payload['is_staff'],
+            is_superuser=payload['is_superuser']
+        )
+        return user, payload
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,103 @@
+"""
+Batched celery tasks. Small invocations are buffered in a redis list and processed together by a single task run:
+the first buffered item schedules the flush task `delay` seconds later, the flush takes up to `size` items and
+schedules itself again while items are pending. Many calls cost one message and one task run per batch
+
+    @batch_task(key='email:registration', size=100, delay=5)
+    def flush_registration_emails(recipients):
+        ...
+
+    flush_registration_emails.add(['alice', 'alice@example.com'])
+
+Items are JSON serializable. If processing raises, the batch is put back to the head of the buffer. Function
+that has already handled some items (e.g. sent some of the emails) raises PartiallyProcessed, so only the rest
+is put back
+"""
+import json
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+from api.celeryconf import app
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    # one client per process, its connection pool is shared by threads and reset after fork
+    return redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+
+
+class PartiallyProcessed(Exception):
+    """
+    Processing failed after the first `done` items of the batch were handled
+    """
+    def __init__(self, done):
+        super().__init__(done)
+        self.done = done
+
+
+class Batch:
+    def __init__(self, key, size, delay, client=get_redis):
+        self.pending_key = key + ':pending'
+        self.scheduled_key = key + ':scheduled'
+        self.size = size
+        self.delay = delay
+        self.client = client
+        self.task = None
+
+    def schedule(self, client):
+        # flag expires, so a lost flush message does not stop the batch forever
+        if client.set(self.scheduled_key, 1, nx=True, ex=max(self.delay * 10, 10)):
+            self.task.apply_async(countdown=self.delay)
+
+    def add(self, *items):
+        client = self.client()
+        client.rpush(self.pending_key, *[json.dumps(item) for item in items])
+        self.schedule(client)
+
+    def take(self):
+        client = self.client()
+        client.delete(self.scheduled_key)
+
+        pipe = client.pipeline()
+        pipe.lrange(self.pending_key, 0, self.size - 1)
+        pipe.ltrim(self.pending_key, self.size, -1)
+        pending, _ = pipe.execute()
+        return pending
+
+    def flush(self, process):
+        pending = self.take()
+        if not pending:
+            return 0
+
+        try:
+            return process([json.loads(item.decode('utf-8')) for item in pending])
+        except Exception as e:
+            unprocessed = pending[e.done:] if isinstance(e, PartiallyProcessed) else pending
+            if unprocessed:
+                self.client().lpush(self.pending_key, *reversed(unprocessed))
+            raise
+        finally:
+            client = self.client()
+            if client.llen(self.pending_key):
+                self.schedule(client)
+
+
+def batch_task(key, size, delay, client=get_redis, **options):
+    """
+    Makes celery task of function that processes a list of items. The task gets `add(*items)`
+    and its `batch`
+    """
+    def decorator(func):
+        batch = Batch(key, size, delay, client)
+
+        @app.task(name='{0}.{1}'.format(func.__module__, func.__name__), **options)
+        def flush():
+            return batch.flush(func)
+
+        batch.task = flush
+        flush.batch = batch
+        flush.add = batch.add
+        return flush
+    return decorator
@@ -1,6 +1,8 @@
 import os
+import time
 
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_ready, worker_process_shutdown
 from django.conf import settings
 
 
@@ -13,3 +15,49 @@ CELERY_TIMEZONE = 'UTC'
 
 app.config_from_object('django.conf.settings')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+# metrics: task run time and time spent in queue
+started_at = {}
+
+
+@before_task_publish.connect
+def set_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def task_started(task_id=None, task=None, **kwargs):
+    from anon_fl import metrics
+
+    started_at[task_id] = time.perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        queue = (task.request.delivery_info or {}).get('routing_key') or 'default'
+        metrics.celery_queue_lag.labels(queue).observe(max(0, time.time() - published_at))
+
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    from anon_fl import metrics
+
+    started = started_at.pop(task_id, None)
+    if started is not None:
+        metrics.celery_task_duration.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+@worker_ready.connect
+def start_metrics_exporter(**kwargs):
+    from anon_fl import metrics
+
+    port = os.environ.get('METRICS_PORT')
+    if port:
+        metrics.start_exporter(int(port))
+
+
+@worker_process_shutdown.connect
+def worker_process_exited(pid=None, **kwargs):
+    from anon_fl import metrics
+
+    metrics.mark_process_dead(pid or os.getpid())
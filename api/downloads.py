@@ -0,0 +1,151 @@
+"""
+Attachment downloads. Views only check permissions: file is sent by nginx from the internal location
+ATTACHMENTS_ACCEL_PREFIX (X-Accel-Redirect) with sendfile, and nginx serves Range requests too.
+ETag is the content hash, so If-None-Match is answered without touching the file. Previews (api/previews.py)
+are sent the same way.
+
+Without ATTACHMENTS_ACCEL_PREFIX (development, tests) the file is streamed by Django with single range support
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from rest_framework.negotiation import BaseContentNegotiation
+
+from api import storage
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """
+    Downloads are files, not API representations, so Accept header of the client is not checked
+    """
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def parse_range(header, size):
+    """
+    (first, last) byte of a single range, None for absent, malformed or multiple ranges (whole file is sent),
+    ValueError if range is not satisfiable
+    """
+    match = RANGE.match(header or '')
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: last N bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+
+    if first > last or first >= size:
+        raise ValueError('unsatisfiable range')
+    return first, last
+
+
+class RangeFile:
+    """
+    Reads at most `length` bytes of `file` starting at `offset`
+    """
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def content_disposition(filename):
+    fallback = filename.encode('ascii', 'ignore').decode().replace('"', '').replace('\\', '') or 'file'
+    return 'attachment; filename="{0}"; filename*=UTF-8\'\'{1}'.format(fallback, quote(filename))
+
+
+def file_response(request, path, etag, content_type):
+    size = os.path.getsize(path)
+
+    byte_range = None
+    if etag_matches(request.META.get('HTTP_IF_RANGE', etag), etag):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(size)
+            return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+        response['Content-Length'] = str(size)
+        return response
+
+    first, last = byte_range
+    response = FileResponse(RangeFile(file, first, last - first + 1), status=206, content_type=content_type)
+    response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(first, last, size)
+    response['Content-Length'] = str(last - first + 1)
+    return response
+
+
+def stored_file_response(request, name, etag, content_type):
+    """
+    Response with stored file ATTACHMENTS_ROOT/`name`, or 304 if client has it
+    """
+    if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    if settings.ATTACHMENTS_ACCEL_PREFIX:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.ATTACHMENTS_ACCEL_PREFIX + name
+    else:
+        response = file_response(request, os.path.join(settings.ATTACHMENTS_ROOT, name), etag, content_type)
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    # content never changes under its hash; private keeps it out of shared caches and response cache middleware
+    response['Cache-Control'] = 'private, max-age=31536000'
+    return response
+
+
+def attachment_response(request, hash, filename):
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = stored_file_response(request, storage.blob_name(hash), '"{0}"'.format(hash), content_type)
+    if response.status_code != 304:
+        response['Content-Disposition'] = content_disposition(filename)
+    return response
+
+
+def preview_response(request, hash, kind):
+    """
+    Preview is shown inline, 404 until it is generated
+    """
+    if not os.path.exists(storage.preview_path(hash, kind)):
+        raise Http404
+    return stored_file_response(request, storage.preview_name(hash, kind), '"{0}-{1}"'.format(hash, kind),
+                                'image/jpeg')
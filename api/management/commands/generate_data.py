@@ -0,0 +1,326 @@
+import bisect
+import csv
+import datetime
+import io
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import ApplicationStatus, OrderStatus
+
+# seed salts of independent random streams, so every row is reproducible without generating rows before it
+ORDER_STREAM = 1
+CHAT_STREAM = 2
+
+WORDS = ('разработка', 'сайт', 'дизайн', 'логотип', 'текст', 'перевод', 'бот', 'приложение', 'верстка', 'база',
+         'данных', 'интеграция', 'платежи', 'мобильное', 'срочно', 'недорого', 'API', 'парсер', 'видео', 'монтаж')
+
+# chat length is capped, so a single pareto outlier does not take the whole message budget
+MAX_CHAT_LENGTH = 50000
+
+# columns of tables spooled from the single pass over orders
+ORDER_COLUMNS = (
+    ('order', ('id', 'category_id', 'title', 'description', 'price', 'customer_id', 'contractor_id', 'status',
+               'applications_new_count', 'applications_accepted_count', 'applications_declined_count',
+               'applications_withdrawn_count', 'created_at', 'updated_at')),
+    ('order_tag', ('tag_id', 'order_id', 'created_at')),
+    ('order_application', ('order_id', 'applicant_id', 'status', 'created_at', 'updated_at')),
+    ('order_chat', ('id', 'order_id', 'messages_count', 'created_at', 'updated_at')),
+)
+
+TABLES = ('order_chat_message', 'order_chat', 'order_application', 'order_tag', 'order', 'tag', 'order_category',
+          'user_notification_settings', 'auth_user')
+
+
+class IteratorFile(io.TextIOBase):
+    """
+    File-like object over a row generator, COPY reads it chunk by chunk, so memory does not depend on rows count
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        self.pending = ''
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.pending) < size:
+            try:
+                self.writer.writerow(next(self.rows))
+            except StopIteration:
+                break
+            self.count += 1
+            if self.buffer.tell() >= 65536:
+                self.flush_buffer()
+        self.flush_buffer()
+
+        if size < 0:
+            size = len(self.pending)
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+    def flush_buffer(self):
+        self.pending += self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+
+class Spool:
+    """
+    Temporary CSV file of one table's rows, written during the single pass over orders and read by COPY afterwards
+    """
+    def __init__(self):
+        self.file = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        self.count = 0
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.count += 1
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def rewind(self):
+        self.file.seek(0)
+
+    def close(self):
+        self.file.close()
+
+
+class ZipfChoice:
+    """
+    Picks 1-based rank with probability proportional to 1 / rank ** exponent
+    """
+    def __init__(self, n, exponent):
+        self.cumulative = []
+        total = 0
+        for rank in range(1, n + 1):
+            total += 1 / rank ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def __call__(self, rnd):
+        return bisect.bisect_left(self.cumulative, rnd.random() * self.total) + 1
+
+
+def text(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = 'Streams deterministic synthetic users, categories, tags, orders, applications, chats and messages ' \
+           'into PostgreSQL with COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--categories', type=int, default=20, help='root categories, each has 2-10 children')
+        parser.add_argument('--tags', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--messages', type=int, default=10000000, help='approximate total chat messages')
+        parser.add_argument('--contractor-ratio', type=float, default=0.2,
+                            help='share of orders with accepted contractor and chat')
+        parser.add_argument('--tag-exponent', type=float, default=1.1, help='zipf exponent of tag popularity')
+        parser.add_argument('--chat-alpha', type=float, default=1.5, help='pareto shape of chat lengths')
+        parser.add_argument('--truncate', action='store_true', help='truncate generated tables first')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('COPY requires PostgreSQL')
+
+        self.options = options
+        self.seed = options['seed']
+        self.start = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+        self.tag_choice = ZipfChoice(options['tags'], options['tag_exponent'])
+
+        chats = max(1, int(options['orders'] * options['contractor_ratio']))
+        mean_length = options['messages'] / chats
+        # pareto mean is alpha / (alpha - 1) of its minimum
+        self.chat_scale = mean_length * (options['chat_alpha'] - 1) / options['chat_alpha']
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.cursor = cursor
+            if options['truncate']:
+                cursor.execute('TRUNCATE {0} RESTART IDENTITY CASCADE'.format(
+                    ', '.join('"{0}"'.format(table) for table in TABLES + ('authtoken_token',))))
+
+            self.offsets = {table: self.max_id(table) for table in TABLES}
+            self.user_offset = self.offsets['auth_user']
+            self.category_ids = []
+
+            self.copy('auth_user', ('id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                                    'is_staff', 'is_active', 'date_joined'), IteratorFile(self.users()))
+            self.copy('user_notification_settings', ('id', 'user_id', 'categories', 'notify_on_email'),
+                      IteratorFile(self.notification_settings()))
+            self.copy('order_category', ('id', 'parent_id', 'title', 'created_at', 'updated_at'),
+                      IteratorFile(self.categories()))
+            self.copy('tag', ('id', 'tag', 'created_at', 'created_by_id'), IteratorFile(self.tags()))
+
+            spools, chat_rows = self.spool_orders()
+            try:
+                for table, columns in ORDER_COLUMNS:
+                    self.copy(table, columns, spools[table])
+            finally:
+                for spool in spools.values():
+                    spool.close()
+            self.copy('order_chat_message', ('chat_id', 'message', 'sender_id', 'is_read', 'created_at'),
+                      IteratorFile(self.messages(chat_rows)))
+
+            for table in TABLES:
+                cursor.execute("SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), "
+                               "coalesce((SELECT max(id) FROM \"{0}\"), 0) + 1, false)".format(table))
+
+    def max_id(self, table):
+        self.cursor.execute('SELECT coalesce(max(id), 0) FROM "{0}"'.format(table))
+        return self.cursor.fetchone()[0]
+
+    def copy(self, table, columns, stream):
+        """
+        COPY from IteratorFile or Spool, both count their rows
+        """
+        started = time.perf_counter()
+        if isinstance(stream, Spool):
+            stream.rewind()
+        self.cursor.copy_expert('COPY "{0}" ({1}) FROM STDIN WITH (FORMAT csv)'.format(
+            table, ', '.join('"{0}"'.format(column) for column in columns)), stream)
+        elapsed = time.perf_counter() - started
+        self.stdout.write('{0}: {1} rows in {2:.1f}s, {3:.0f} rows/s'.format(
+            table, stream.count, elapsed, stream.count / elapsed if elapsed else 0))
+
+    def rnd(self, stream, entity_id):
+        return random.Random('{0}:{1}:{2}'.format(self.seed, stream, entity_id))
+
+    def timestamp(self, seconds):
+        return (self.start + datetime.timedelta(seconds=seconds)).isoformat()
+
+    def users(self):
+        rnd = random.Random(self.seed)
+        for i in range(1, self.options['users'] + 1):
+            user_id = self.user_offset + i
+            yield (user_id, '!', 'f', 'user{0}'.format(user_id), '', '', 'user{0}@example.com'.format(user_id),
+                   'f', 't', self.timestamp(rnd.randint(0, 365 * 86400)))
+
+    def notification_settings(self):
+        offset = self.offsets['user_notification_settings']
+        for i in range(1, self.options['users'] + 1):
+            yield offset + i, self.user_offset + i, '{}', 'f'
+
+    def categories(self):
+        rnd = random.Random(self.seed)
+        category_id = self.offsets['order_category']
+        created_at = self.timestamp(0)
+        for root in range(self.options['categories']):
+            category_id += 1
+            root_id = category_id
+            yield root_id, None, 'Категория {0}'.format(root + 1), created_at, created_at
+            for child in range(rnd.randint(2, 10)):
+                category_id += 1
+                self.category_ids.append(category_id)
+                yield category_id, root_id, 'Подкатегория {0}.{1}'.format(root + 1, child + 1), created_at, created_at
+
+    def tags(self):
+        offset = self.offsets['tag']
+        for i in range(1, self.options['tags'] + 1):
+            yield offset + i, 'tag{0}'.format(offset + i), self.timestamp(0), self.user_offset + 1
+
+    def order(self, i):
+        """
+        Everything about order i derived from its own random stream: order row fields, tags and applications
+        """
+        rnd = self.rnd(ORDER_STREAM, i)
+        users = self.options['users']
+        customer_id = self.user_offset + rnd.randint(1, users)
+        created = rnd.randint(0, 365 * 86400)
+
+        applicant_ids = set()
+        for _ in range(min(users - 1, int(rnd.paretovariate(1.2)))):
+            applicant_id = self.user_offset + rnd.randint(1, users)
+            if applicant_id != customer_id:
+                applicant_ids.add(applicant_id)
+        applicant_ids = sorted(applicant_ids)
+
+        contractor_id = None
+        if applicant_ids and rnd.random() < self.options['contractor_ratio']:
+            contractor_id = rnd.choice(applicant_ids)
+
+        applications = []
+        for applicant_id in applicant_ids:
+            if contractor_id is not None:
+                status = ApplicationStatus.ACCEPTED if applicant_id == contractor_id else ApplicationStatus.DECLINED
+            else:
+                status = ApplicationStatus.WITHDRAWN if rnd.random() < 0.05 else ApplicationStatus.NEW
+            applications.append((applicant_id, status.value, created + rnd.randint(60, 7 * 86400)))
+
+        return {
+            'id': self.offsets['order'] + i,
+            'customer_id': customer_id,
+            'contractor_id': contractor_id,
+            'category_id': rnd.choice(self.category_ids),
+            'title': text(rnd, rnd.randint(2, 6)).capitalize(),
+            'description': text(rnd, rnd.randint(10, 200)),
+            'price': int(rnd.lognormvariate(8, 1.2)),
+            'status': (OrderStatus.IN_PROCESS if contractor_id else OrderStatus.PUBLISHED).value,
+            'created': created,
+            'tags': sorted(set(self.tag_choice(rnd) for _ in range(rnd.randint(0, 5)))),
+            'applications': applications
+        }
+
+    def chat_length(self, rnd):
+        return min(MAX_CHAT_LENGTH, int(rnd.paretovariate(self.options['chat_alpha']) * self.chat_scale))
+
+    def spool_orders(self):
+        """
+        Generates every order once and fans its rows out to spools of order, order_tag, order_application and
+        order_chat. Returns spools and (chat id, customer id, contractor id, accepted) of every chat, messages are
+        streamed from them afterwards
+        """
+        started = time.perf_counter()
+        spools = {table: Spool() for table, columns in ORDER_COLUMNS}
+        chats = []
+        chat_id = self.offsets['order_chat']
+        tag_offset = self.offsets['tag']
+
+        for i in range(1, self.options['orders'] + 1):
+            order = self.order(i)
+            created = self.timestamp(order['created'])
+
+            counts = [0] * len(ApplicationStatus)
+            for applicant_id, status, applied in order['applications']:
+                counts[status] += 1
+                spools['order_application'].writerow((order['id'], applicant_id, status, self.timestamp(applied),
+                                                      self.timestamp(applied)))
+            spools['order'].writerow((order['id'], order['category_id'], order['title'][:100],
+                                      order['description'], order['price'], order['customer_id'],
+                                      order['contractor_id'], order['status']) + tuple(counts) + (created, created))
+            for rank in order['tags']:
+                spools['order_tag'].writerow((tag_offset + rank, order['id'], created))
+
+            if order['contractor_id'] is not None:
+                chat_id += 1
+                length = self.chat_length(self.rnd(CHAT_STREAM, chat_id))
+                accepted = max(applied for applicant_id, status, applied in order['applications'])
+                spools['order_chat'].writerow((chat_id, order['id'], length, self.timestamp(accepted),
+                                               self.timestamp(accepted)))
+                chats.append((chat_id, order['customer_id'], order['contractor_id'], accepted))
+
+        self.stdout.write('orders generated: {0} in {1:.1f}s'.format(
+            self.options['orders'], time.perf_counter() - started))
+        return spools, chats
+
+    def messages(self, chats):
+        for chat_id, customer_id, contractor_id, sent in chats:
+            # the same stream chat length was drawn from
+            rnd = self.rnd(CHAT_STREAM, chat_id)
+            length = self.chat_length(rnd)
+            participants = (customer_id, contractor_id)
+            for i in range(length):
+                sent += int(rnd.expovariate(1 / 3600)) + 1
+                yield (chat_id, text(rnd, rnd.randint(1, 30)), rnd.choice(participants),
+                       't' if i < length - 3 else 'f', self.timestamp(sent))
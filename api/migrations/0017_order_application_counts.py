@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+STATUSES = ('new', 'accepted', 'declined', 'withdrawn')
+
+
+def fill_application_counts(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    OrderApplication = apps.get_model('api', 'OrderApplication')
+
+    counts = OrderApplication.objects.values('order_id', 'status').annotate(count=Count('id')).order_by()
+    for row in counts.iterator():
+        field = 'applications_{0}_count'.format(STATUSES[row['status']])
+        Order.objects.filter(id=row['order_id']).update(**{field: row['count']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_auto_20170213_2155'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='applications_accepted_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='applications_declined_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='applications_new_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='applications_withdrawn_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='orderapplication',
+            index_together=set([('order', 'status')]),
+        ),
+        migrations.RunPython(fill_application_counts, migrations.RunPython.noop),
+    ]
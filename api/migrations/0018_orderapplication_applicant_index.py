@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0017_order_application_counts'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='orderapplication',
+            index_together=set([('order', 'status'), ('applicant', 'status', 'created_at')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='previews',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), null=True,
+                                                            size=None),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_blob_previews'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='orderapplication',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='StatsOrder',
+            fields=[
+                ('order_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('category_id', models.IntegerField()),
+                ('status', models.IntegerField()),
+                ('price', models.IntegerField()),
+                ('applications', models.IntegerField()),
+                ('acceptance_seconds', models.IntegerField(null=True)),
+            ],
+            options={
+                'db_table': 'stats_order',
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsCategory',
+            fields=[
+                ('category_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('orders', models.IntegerField(default=0)),
+                ('status_counts', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(),
+                                                                           size=None)),
+                ('applications', models.BigIntegerField(default=0)),
+                ('price_histogram', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(),
+                                                                             size=None)),
+                ('acceptance_histogram', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(),
+                                                                                  size=None)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'stats_category',
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'stats_watermark',
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsDeletedOrder',
+            fields=[
+                ('order_id', models.IntegerField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'db_table': 'stats_deleted_order',
+            },
+        ),
+    ]
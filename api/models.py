@@ -1,5 +1,10 @@
+import uuid
+
+from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 from enum import Enum
 
 OrderStatus = Enum('OrderStatus', ('NEW', 'PUBLISHED', 'IN_PROCESS', 'COMPLETED_WITH_SUCCESS', 'COMPLETED_WITH_FAIL'), start=0)
@@ -9,6 +14,13 @@ ApplicationStatus = Enum('Application', ('NEW', 'ACCEPTED', 'DECLINED', 'WITHDRA
 APPLICATION_STATUS_CHOICES = tuple(map(lambda x: (x.value, x.name), ApplicationStatus))
 
 
+def application_count_field(status):
+    return 'applications_{0}_count'.format(ApplicationStatus(status).name.lower())
+
+
+APPLICATION_COUNT_FIELDS = tuple(map(lambda x: application_count_field(x.value), ApplicationStatus))
+
+
 class OrderCategory(models.Model):
     """
     Категория заказа
@@ -42,12 +54,27 @@ class Order(models.Model):
     customer = models.ForeignKey('auth.User', related_name='order_customer', on_delete=models.CASCADE)
     contractor = models.ForeignKey('auth.User', related_name='order_contractor', null=True)
     status = models.IntegerField(choices=ORDER_STATUS_CHOICES, default=0)
+    # denormalized application counts per status, changed only by F() updates in OrderApplication
+    applications_new_count = models.IntegerField(default=0)
+    applications_accepted_count = models.IntegerField(default=0)
+    applications_declined_count = models.IntegerField(default=0)
+    applications_withdrawn_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = 'order'
 
+    def save(self, *args, **kwargs):
+        # full save of already existing order must not overwrite counters changed concurrently
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in APPLICATION_COUNT_FIELDS]
+        super().save(*args, **kwargs)
+
+    def get_applications_count(self):
+        return {status.name.lower(): getattr(self, application_count_field(status.value)) for status in ApplicationStatus}
+
 
 class OrderTag(models.Model):
     tag = models.ForeignKey(Tag, related_name='order_tag_key')
@@ -84,10 +111,62 @@ class OrderApplication(models.Model):
     applicant = models.ForeignKey('auth.User', on_delete=models.CASCADE)
     status = models.IntegerField(choices=APPLICATION_STATUS_CHOICES, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = 'order_application'
+        index_together = (('order', 'status'), ('applicant', 'status', 'created_at'))
+
+    @staticmethod
+    def apply(order_id, applicant_id):
+        """
+        Creates application and increments order counter in one transaction
+        """
+        with transaction.atomic():
+            # serializes with acceptance, which holds the same lock, so nobody applies to an accepted order
+            order = Order.objects.select_for_update().only('id', 'contractor_id').get(id=order_id)
+            if order.contractor_id is not None:
+                return None, False
+
+            application, created = OrderApplication.objects.get_or_create(order_id=order_id, applicant_id=applicant_id)
+            if created:
+                field = application_count_field(application.status)
+                Order.objects.filter(id=order_id).update(**{field: F(field) + 1})
+
+        return application, created
+
+    @staticmethod
+    def decline_new(order_id):
+        """
+        Declines all NEW applications of the order with a single statement, returns their applicant ids.
+        Should be called in transaction holding the order lock
+        """
+        new = OrderApplication.objects.filter(order_id=order_id, status=ApplicationStatus.NEW.value)
+        rows = list(new.select_for_update().values_list('id', 'applicant_id'))
+        if not rows:
+            return []
+
+        declined = OrderApplication.objects.filter(id__in=[row[0] for row in rows])\
+            .update(status=ApplicationStatus.DECLINED.value, updated_at=timezone.now())
+        Order.objects.filter(id=order_id).update(applications_new_count=F('applications_new_count') - declined,
+                                                 applications_declined_count=F('applications_declined_count') + declined)
+        return [row[1] for row in rows]
+
+    def set_status(self, status):
+        """
+        Saves new status and moves order counter from old status to new one in one transaction.
+        The row changes only if it still has the status it was read with, otherwise returns False
+        """
+        old_field, new_field = application_count_field(self.status), application_count_field(status)
+        now = timezone.now()
+
+        with transaction.atomic():
+            if not OrderApplication.objects.filter(id=self.id, status=self.status).update(status=status, updated_at=now):
+                return False
+            self.status, self.updated_at = status, now
+            if old_field != new_field:
+                Order.objects.filter(id=self.order_id).update(**{old_field: F(old_field) - 1, new_field: F(new_field) + 1})
+        return True
 
 
 class OrderChat(models.Model):
@@ -114,6 +193,21 @@ class OrderChatMessage(models.Model):
         db_table = 'order_chat_message'
 
 
+class Blob(models.Model):
+    """
+    Stored attachment content, shared by all attachments with the same sha1 hash (api/storage.py)
+    """
+    hash = models.CharField(max_length=40, primary_key=True)
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=1)
+    # kinds of PREVIEW_SIZES generated for the content (api/previews.py), null until it is processed
+    previews = ArrayField(models.CharField(max_length=20), null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'blob'
+
+
 class OrderChatAttachment(models.Model):
     message = models.ForeignKey(OrderChatMessage, related_name='messages_attachments', on_delete=models.CASCADE)
     filename = models.TextField()
@@ -126,6 +220,49 @@ class OrderChatAttachment(models.Model):
         db_table = 'order_chat_attachment'
 
 
+class UploadSession(models.Model):
+    """
+    Resumable chat attachment upload (api/uploads.py): file of `size` bytes is sent as numbered chunks of
+    `chunk_size` bytes into a preallocated file and verified against sha1 `hash` on commit
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    chat = models.ForeignKey(OrderChat, on_delete=models.CASCADE)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    filename = models.TextField()
+    size = models.BigIntegerField()
+    hash = models.CharField(max_length=40)
+    chunk_size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # touched by every chunk, sessions idle for UPLOAD_SESSION_TTL are removed
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = 'upload_session'
+
+    @property
+    def chunks_count(self):
+        return -(-self.size // self.chunk_size)
+
+    def chunk_range(self, number):
+        """
+        (offset, length) of chunk `number`, the last chunk is shorter
+        """
+        offset = number * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+
+class UploadChunk(models.Model):
+    """
+    Chunk of UploadSession written to disk
+    """
+    session = models.ForeignKey(UploadSession, related_name='chunks', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'upload_chunk'
+        unique_together = ('session', 'number')
+
+
 class UserNotificationsSettings(models.Model):
     user = models.ForeignKey('auth.User', related_name='user')
     categories = ArrayField(models.IntegerField(), default=[])
@@ -133,3 +270,73 @@ class UserNotificationsSettings(models.Model):
 
     class Meta:
         db_table = 'user_notification_settings'
+
+
+class CachedUser(User):
+    """
+    request.user of cached token and JWT authentication. Built from a partial record (id, username, email and
+    flags), so saving it would overwrite the password hash and other columns: it is read-only
+    """
+    class Meta:
+        proxy = True
+
+    def save(self, *args, **kwargs):
+        raise NotImplementedError('CachedUser is read-only, load User from database to change it')
+
+    def delete(self, *args, **kwargs):
+        raise NotImplementedError('CachedUser is read-only, load User from database to change it')
+
+
+class StatsOrder(models.Model):
+    """
+    Contribution of an order to StatsCategory as of the last stats update (api/stats.py)
+    """
+    order_id = models.IntegerField(primary_key=True)
+    category_id = models.IntegerField()
+    status = models.IntegerField()
+    price = models.IntegerField()
+    applications = models.IntegerField()
+    # seconds from order creation to acceptance of contractor application
+    acceptance_seconds = models.IntegerField(null=True)
+
+    class Meta:
+        db_table = 'stats_order'
+
+
+class StatsCategory(models.Model):
+    """
+    Marketplace summary of a category, maintained incrementally from StatsOrder changes (api/stats.py)
+    """
+    category_id = models.IntegerField(primary_key=True)
+    orders = models.IntegerField(default=0)
+    # order counts by OrderStatus value
+    status_counts = ArrayField(models.IntegerField())
+    applications = models.BigIntegerField(default=0)
+    # order counts per bucket of stats.PRICE_BOUNDS and stats.ACCEPTANCE_BOUNDS
+    price_histogram = ArrayField(models.IntegerField())
+    acceptance_histogram = ArrayField(models.IntegerField())
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stats_category'
+
+
+class StatsWatermark(models.Model):
+    """
+    Time of the last stats update, rows changed after it are processed by the next one
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DateTimeField()
+
+    class Meta:
+        db_table = 'stats_watermark'
+
+
+class StatsDeletedOrder(models.Model):
+    """
+    Order deleted since the last stats update
+    """
+    order_id = models.IntegerField(primary_key=True)
+
+    class Meta:
+        db_table = 'stats_deleted_order'
@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.models import OrderChat
+
+ChatParticipants = namedtuple('ChatParticipants', ('chat_id', 'order_id', 'order_title', 'customer_id', 'contractor_id'))
+
+
+def participants_cache_key(order_id):
+    return 'chat:participants:%s' % order_id
+
+
+def get_chat_participants(order_id):
+    """
+    Resolves order chat and its participants without loading the order. Returns None if order has no chat yet
+    """
+    participants = cache.get(participants_cache_key(order_id))
+    if participants is not None:
+        return ChatParticipants(*participants)
+
+    row = OrderChat.objects.filter(order_id=order_id)\
+        .values_list('id', 'order_id', 'order__title', 'order__customer_id', 'order__contractor_id').first()
+    if row is None:
+        return None
+
+    participants = ChatParticipants(*row)
+    cache.set(participants_cache_key(order_id), tuple(participants), settings.CHAT_PARTICIPANTS_CACHE_TTL)
+    return participants
+
+
+def warm_chat_participants(order, chat):
+    participants = ChatParticipants(chat.id, order.id, order.title, order.customer_id, order.contractor_id)
+    cache.set(participants_cache_key(order.id), tuple(participants), settings.CHAT_PARTICIPANTS_CACHE_TTL)
+    return participants
+
+
+def invalidate_chat_participants(order_id):
+    cache.delete(participants_cache_key(order_id))
@@ -1,4 +1,9 @@
 from rest_framework import permissions
+from django.shortcuts import get_object_or_404
+from rest_framework.exceptions import NotFound
+
+from api.models import Order
+from api.participants import get_chat_participants
 
 
 class IsSuperUserOrReadOnly(permissions.BasePermission):
@@ -10,8 +15,30 @@ class IsSuperUserOrReadOnly(permissions.BasePermission):
 
 
 class IsOrderChatParticipant(permissions.BasePermission):
-    def has_object_permission(self, request, view, obj):
-        return request.user in [obj.sender_id, obj.recipient_id]
+    """
+    Checks order_id url kwarg against cached chat participants, resolved participants are stored on the view
+    """
+    def has_permission(self, request, view):
+        participants = get_chat_participants(view.kwargs['order_id'])
+        if participants is None:
+            raise NotFound
+
+        view.participants = participants
+        return request.user.id in [participants.customer_id, participants.contractor_id]
+
+
+class IsOrderAttachmentParticipant(permissions.BasePermission):
+    """
+    Attachments of order_id url kwarg are uploaded and deleted by order customer, and seen by customer and
+    contractor. Loaded order is stored on the view
+    """
+    def has_permission(self, request, view):
+        order = get_object_or_404(Order.objects.only('id', 'customer_id', 'contractor_id'), id=view.kwargs['order_id'])
+        view.order = order
+
+        if request.method in permissions.SAFE_METHODS:
+            return request.user.id in [order.customer_id, order.contractor_id]
+        return request.user.id == order.customer_id
 
 
 class IsOrderOwner(permissions.BasePermission):
@@ -0,0 +1,125 @@
+"""
+Thumbnails and previews of attachments, generated by celery task api.tasks.generate_previews after the attachment
+is committed. Derivatives belong to the content, not to attachments: they are made once per sha1 and recorded
+in Blob.previews.
+
+Images are decoded with Pillow (JPEG at reduced scale with draft mode), the first page of PDF is rendered
+by `pdftoppm` of poppler-utils. Without Pillow no previews are generated, without pdftoppm PDFs are skipped
+"""
+import mimetypes
+import os
+import subprocess
+import tempfile
+
+from django.conf import settings
+
+from api import storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+PDF_MAGIC = b'%PDF-'
+
+
+def is_previewable(filename):
+    content_type = mimetypes.guess_type(filename)[0] or ''
+    return Image is not None and (content_type.startswith('image/') or content_type == 'application/pdf')
+
+
+def with_previews(queryset):
+    """
+    Attachment queryset with `previews` of their content selected in the same query
+    """
+    return queryset.extra(select={
+        'previews': 'SELECT previews FROM blob WHERE blob.hash = {0}.hash'.format(queryset.model._meta.db_table)
+    })
+
+
+def largest_size():
+    return max(settings.PREVIEW_SIZES.values())
+
+
+def render_pdf(path):
+    with tempfile.TemporaryDirectory(dir=storage.temp_dir()) as directory:
+        prefix = os.path.join(directory, 'page')
+        try:
+            subprocess.run(['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+                            '-scale-to', str(max(largest_size())), path, prefix],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           timeout=settings.PREVIEW_TIMEOUT, check=True)
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            # no pdftoppm or PDF it cannot render, timeout and other failures are worth a retry
+            return None
+
+        image = Image.open(prefix + '.jpg')
+        image.load()
+        return image
+
+
+def open_image(path):
+    """
+    Decoded image of the file or its first page, None if it has no preview
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(PDF_MAGIC)) == PDF_MAGIC:
+            return render_pdf(path)
+
+    try:
+        image = Image.open(path)
+        # JPEG is decoded at the smallest scale that is still larger than the largest preview
+        image.draft('RGB', largest_size())
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGBA', 'LA', 'P'):
+            return image.convert('RGB')
+
+        # transparency is flattened on white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+def save(image, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=storage.temp_dir())
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            image.save(file, 'JPEG', quality=settings.PREVIEW_QUALITY, optimize=True, progressive=True)
+        os.rename(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def generate(hash):
+    """
+    Writes derivatives of stored content, returns list of generated kinds, empty if content has no preview.
+    On failure derivatives written so far are removed
+    """
+    image = open_image(storage.blob_path(hash))
+    if image is None:
+        return []
+
+    kinds = []
+    try:
+        # every size is downscaled from the previous larger one
+        for kind, size in sorted(settings.PREVIEW_SIZES.items(), key=lambda item: item[1], reverse=True):
+            image.thumbnail(size, Image.LANCZOS)
+            save(image, storage.preview_path(hash, kind))
+            kinds.append(kind)
+    except BaseException:
+        remove(hash, kinds)
+        raise
+    return kinds
+
+
+def remove(hash, kinds):
+    for kind in kinds:
+        try:
+            os.unlink(storage.preview_path(hash, kind))
+        except FileNotFoundError:
+            pass
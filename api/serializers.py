@@ -1,16 +1,17 @@
+import re
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.urls import reverse
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import NotAcceptable
-from django.conf import settings
-
-import jwt
 
-from api import models
-from api.models import Order, OrderAttachment, OrderCategory, OrderChat, OrderChatMessage, Tag, OrderTag, \
-    OrderApplication, UserNotificationsSettings
-from api.tasks import send_registration_email
+from api.authentication import JWT_ACCESS, JWT_REFRESH, encode_jwt
+from api.models import Order, OrderAttachment, OrderCategory, OrderChat, OrderChatMessage, OrderChatAttachment, \
+    Tag, OrderTag, OrderApplication, UserNotificationsSettings, UploadSession
+from api.tasks import queue_registration_email
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -24,37 +25,39 @@ class UserSerializer(serializers.ModelSerializer):
 class AccountRegisterSerializer(serializers.ModelSerializer):
     token = serializers.SerializerMethodField()
     jwt = serializers.SerializerMethodField()
+    jwt_refresh = serializers.SerializerMethodField()
 
     def create(self, validated_data):
+        user = User(username=validated_data['username'], email=validated_data['email'])
+        # hashing is the slowest part of registration, so it is done before transaction is opened
+        user.set_password(validated_data['password'])
+
         try:
-            user = User.objects.create(
-                username=validated_data['username'],
-                email=validated_data['email']
-            )
+            with transaction.atomic():
+                user.save()
+                # assigning user caches token on user.auth_token, so get_token does not query it again
+                Token.objects.create(user=user)
+                UserNotificationsSettings.objects.create(user_id=user.id)
         except IntegrityError:
             raise NotAcceptable(detail={'email': ['Пользователь с таким email уже существует']})
 
-        user.set_password(validated_data['password'])
-        user.save()
-
-        Token.objects.get_or_create(user=user)
-
         # TODO: move this to signals
-        send_registration_email.delay(validated_data['username'], validated_data['email'])
-        UserNotificationsSettings.objects.create(user_id=user.id)
+        transaction.on_commit(lambda: queue_registration_email(user.username, user.email))
         return user
 
     def get_token(self, instance):
-        token = Token.objects.get(user=instance.id)
-        return token.key
+        return instance.auth_token.key
 
     def get_jwt(self, instance):
-        return jwt.encode({'user_id': instance.id}, settings.JWT_SECRET)
+        return encode_jwt(instance, JWT_ACCESS)
+
+    def get_jwt_refresh(self, instance):
+        return encode_jwt(instance, JWT_REFRESH)
 
     class Meta:
         model = User
         fields = (
-            'email', 'username', 'password', 'token', 'id', 'jwt'
+            'email', 'username', 'password', 'token', 'id', 'jwt', 'jwt_refresh'
         )
         extra_kwargs = {
             'password': {'write_only': True, 'required': True},
@@ -73,12 +76,30 @@ class OrderCategorySerializer(serializers.ModelSerializer):
         )
 
 
+def preview_urls(instance, view_name, order_id):
+    """
+    {kind: url} of generated previews, selected with api.previews.with_previews. Empty while they are generated
+    """
+    return {kind: reverse(view_name, kwargs={'order_id': order_id, 'pk': instance.id, 'kind': kind})
+            for kind in getattr(instance, 'previews', None) or ()}
+
+
 class OrderAttachmentSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    previews = serializers.SerializerMethodField()
+
+    def get_url(self, instance):
+        return reverse('order-attachment-download', kwargs={'order_id': instance.order_id, 'pk': instance.id})
+
+    def get_previews(self, instance):
+        return preview_urls(instance, 'order-attachment-preview', instance.order_id)
+
     class Meta:
         model = OrderAttachment
         fields = (
-            'filename', 'url'
+            'id', 'filename', 'url', 'previews', 'hash', 'created_at'
         )
+        read_only_fields = fields
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -105,6 +126,7 @@ class OrderListSerializer(serializers.ModelSerializer):
     tags = serializers.SerializerMethodField('get_order_tags')
     contractor = serializers.SerializerMethodField('get_contractor_profile')
     customer = serializers.SerializerMethodField('get_customer_profile')
+    applications_count = serializers.ReadOnlyField(source='get_applications_count')
 
     def get_order_tags(self, instance):
         serialized_data = OrderTagSerializer(instance.order_tag.all(), many=True, read_only=True, context=self.context)
@@ -127,7 +149,7 @@ class OrderListSerializer(serializers.ModelSerializer):
         model = Order
         fields = (
             'id', 'title', 'description', 'price', 'created_at', 'updated_at', 'category', 'customer_id', 'tags',
-            'customer', 'contractor'
+            'customer', 'contractor', 'applications_count'
         )
 
 
@@ -160,7 +182,7 @@ class OrderDetailSerializer(serializers.ModelSerializer):
     attachments = OrderAttachmentSerializer(many=True)
     tags = serializers.SerializerMethodField('get_order_tags')
     application = serializers.SerializerMethodField()
-    application_list = serializers.SerializerMethodField()
+    applications_count = serializers.ReadOnlyField(source='get_applications_count')
     contractor = serializers.SerializerMethodField('get_contractor_profile')
     customer = serializers.SerializerMethodField('get_customer_profile')
 
@@ -186,22 +208,11 @@ class OrderDetailSerializer(serializers.ModelSerializer):
         serializer = OrderApplicationListSerializer(application)
         return serializer.data
 
-    def get_application_list(self, instance):
-        if self._context['request'].user.id != instance.customer_id:
-            return []
-
-        application_list = OrderApplication.objects\
-            .filter(order_id=instance.id).exclude(status=models.ApplicationStatus.WITHDRAWN.value)\
-            .select_related('applicant').all()
-
-        serializer = OrderApplicationListSerializer(application_list, many=True)
-        return serializer.data
-
     class Meta:
         model = Order
         fields = (
             'id', 'title', 'description', 'price', 'status', 'created_at', 'updated_at', 'category', 'customer_id',
-            'attachments', 'tags', 'application', 'application_list', 'contractor', 'customer'
+            'attachments', 'tags', 'application', 'applications_count', 'contractor', 'customer'
         )
 
 
@@ -213,17 +224,63 @@ class OrderChatDetailSerializer(serializers.ModelSerializer):
         )
 
 
+class OrderChatAttachmentSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+    previews = serializers.SerializerMethodField()
+
+    def get_url(self, instance):
+        return reverse('order-chat-attachment-download',
+                       kwargs={'order_id': self.context['order_id'], 'pk': instance.id})
+
+    def get_previews(self, instance):
+        return preview_urls(instance, 'order-chat-attachment-preview', self.context['order_id'])
+
+    class Meta:
+        model = OrderChatAttachment
+        fields = (
+            'id', 'filename', 'url', 'previews', 'hash'
+        )
+        read_only_fields = fields
+
+
 class OrderChatMessageListSerializer(serializers.ModelSerializer):
     chat_id = serializers.ReadOnlyField()
     is_read = serializers.ReadOnlyField()
+    attachments = OrderChatAttachmentSerializer(source='messages_attachments', many=True, read_only=True)
 
     class Meta:
         model = OrderChatMessage
         fields = (
-            'id', 'chat_id', 'message', 'is_read', 'sender_id', 'created_at'
+            'id', 'chat_id', 'message', 'is_read', 'sender_id', 'created_at', 'attachments'
         )
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunks_count = serializers.ReadOnlyField()
+    received = serializers.SerializerMethodField()
+
+    def get_received(self, instance):
+        return list(instance.chunks.order_by('number').values_list('number', flat=True))
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('Size must be between 1 and {0} bytes.'.format(settings.UPLOAD_MAX_SIZE))
+        return value
+
+    def validate_hash(self, value):
+        value = value.lower()
+        if not re.match(r'^[0-9a-f]{40}$', value):
+            raise serializers.ValidationError('Expected hex encoded sha1.')
+        return value
+
+    class Meta:
+        model = UploadSession
+        fields = (
+            'id', 'filename', 'size', 'hash', 'chunk_size', 'chunks_count', 'received', 'created_at'
+        )
+        read_only_fields = ('id', 'chunk_size', 'created_at')
+
+
 class OrderApplicationListSerializer(serializers.ModelSerializer):
     applicant = UserSerializer()
 
@@ -234,6 +291,26 @@ class OrderApplicationListSerializer(serializers.ModelSerializer):
         )
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    category = OrderCategorySerializer()
+
+    class Meta:
+        model = Order
+        fields = (
+            'id', 'title', 'price', 'status', 'created_at', 'category', 'customer_id'
+        )
+
+
+class ContractorApplicationListSerializer(serializers.ModelSerializer):
+    order = OrderSummarySerializer()
+
+    class Meta:
+        model = OrderApplication
+        fields = (
+            'id', 'order_id', 'status', 'created_at', 'updated_at', 'order'
+        )
+
+
 class UserNotificationsSettingsDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserNotificationsSettings
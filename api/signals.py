@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from anon_fl.db import check_connections
+from api.authentication import invalidate_token, invalidate_user_tokens
+from api import storage, uploads
+from api.models import Order, OrderAttachment, OrderChatAttachment, StatsDeletedOrder, UploadSession
+from api.participants import invalidate_chat_participants
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # last_login update on login does not affect cached record
+    if created or update_fields == frozenset(['last_login']):
+        return
+
+    # covers deactivation and password change
+    invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    # contractor or title could change
+    if not created:
+        invalidate_chat_participants(instance.pk)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    # deleted orders leave no updated_at behind, the next stats update removes them by this record
+    StatsDeletedOrder.objects.get_or_create(order_id=instance.pk)
+
+
+@receiver(post_delete, sender=OrderAttachment)
+@receiver(post_delete, sender=OrderChatAttachment)
+def attachment_deleted(sender, instance, **kwargs):
+    with transaction.atomic():
+        storage.release(instance.hash)
+
+
+@receiver(post_delete, sender=UploadSession)
+def upload_session_deleted(sender, instance, **kwargs):
+    session_id = instance.id
+    transaction.on_commit(lambda: uploads.remove(session_id))
+
+
+request_started.connect(check_connections)
@@ -0,0 +1,239 @@
+"""
+Marketplace statistics per category: orders by status, price percentiles, applications per order and median time
+to contractor acceptance. Kept in StatsCategory and updated incrementally by api.tasks.update_marketplace_stats:
+
+- orders changed after the watermark (order or any of its applications has newer updated_at) and deleted orders
+  are read in batches of STATS_BATCH_SIZE
+- for every order its previous contribution (StatsOrder) is subtracted from the category and the new one added,
+  so processing the same order twice changes nothing and the watermark can overlap by STATS_WATERMARK_OVERLAP
+- percentiles come from histograms over logarithmic buckets, precise to the bucket width (about 12%).
+  Changing bucket bounds requires update(rebuild=True)
+
+Runs are serialized by a postgres advisory lock
+"""
+import bisect
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import APPLICATION_COUNT_FIELDS, ApplicationStatus, Order, OrderApplication, OrderCategory, \
+    OrderStatus, StatsCategory, StatsDeletedOrder, StatsOrder, StatsWatermark
+
+WATERMARK = 'marketplace'
+# pg_advisory_lock key
+LOCK_KEY = 740050
+
+
+def log_bounds(low, high, per_decade):
+    """
+    Upper bounds of logarithmic buckets from `low` to at least `high`, `per_decade` buckets per power of 10
+    """
+    bounds = [low]
+    while bounds[-1] < high:
+        bounds.append(low * 10 ** (len(bounds) / per_decade))
+    return bounds
+
+
+PRICE_BOUNDS = log_bounds(1, 10 ** 8, 20)
+# a minute to three years
+ACCEPTANCE_BOUNDS = log_bounds(60, 10 ** 8, 20)
+
+
+def bucket(value, bounds):
+    return min(bisect.bisect_left(bounds, value), len(bounds) - 1)
+
+
+def percentile(histogram, bounds, q):
+    """
+    q-th percentile of values counted in histogram, interpolated within its bucket. None for empty histogram
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+
+    rank = total * q / 100
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = bounds[index - 1] if index else 0
+            fraction = (rank - seen) / count
+            if lower:
+                # geometric interpolation, buckets are logarithmic
+                return round(lower * (bounds[index] / lower) ** fraction)
+            return round(bounds[index] * fraction)
+        seen += count
+
+
+def empty_stats(category_id):
+    return StatsCategory(category_id=category_id, orders=0, status_counts=[0] * len(OrderStatus), applications=0,
+                         price_histogram=[0] * len(PRICE_BOUNDS), acceptance_histogram=[0] * len(ACCEPTANCE_BOUNDS))
+
+
+def add_order(stats, order, sign):
+    stats.orders += sign
+    stats.status_counts[order.status] += sign
+    stats.applications += sign * order.applications
+    stats.price_histogram[bucket(order.price, PRICE_BOUNDS)] += sign
+    if order.acceptance_seconds is not None:
+        stats.acceptance_histogram[bucket(order.acceptance_seconds, ACCEPTANCE_BOUNDS)] += sign
+
+
+def merge(stats, other):
+    stats.orders += other.orders
+    stats.applications += other.applications
+    for field in ('status_counts', 'price_histogram', 'acceptance_histogram'):
+        setattr(stats, field, [a + b for a, b in zip(getattr(stats, field), getattr(other, field))])
+
+
+def contribution(order_id, category_id, status, price, created_at, accepted_at, *counts):
+    acceptance_seconds = None
+    if accepted_at is not None:
+        acceptance_seconds = max(int((accepted_at - created_at).total_seconds()), 0)
+    return StatsOrder(order_id=order_id, category_id=category_id, status=status, price=price,
+                      applications=sum(counts), acceptance_seconds=acceptance_seconds)
+
+
+def same_contribution(old, new):
+    return all(getattr(old, field) == getattr(new, field)
+               for field in ('category_id', 'status', 'price', 'applications', 'acceptance_seconds'))
+
+
+def apply_orders(order_ids):
+    """
+    Replaces contributions of orders with their current state, orders that no longer exist are removed
+    """
+    accepted = dict(OrderApplication.objects.filter(order_id__in=order_ids, status=ApplicationStatus.ACCEPTED.value)
+                    .values_list('order_id', 'updated_at'))
+    rows = Order.objects.filter(id__in=order_ids)\
+        .values_list('id', 'category_id', 'status', 'price', 'created_at', *APPLICATION_COUNT_FIELDS)
+    current = {row[0]: contribution(*(row[:5] + (accepted.get(row[0]),) + row[5:])) for row in rows}
+
+    with transaction.atomic():
+        previous = {order.order_id: order for order in StatsOrder.objects.filter(order_id__in=order_ids)}
+
+        deltas = {}
+        for order_id in order_ids:
+            old, new = previous.get(order_id), current.get(order_id)
+            if old is not None and new is not None and same_contribution(old, new):
+                continue
+            if old is not None:
+                add_order(deltas.setdefault(old.category_id, empty_stats(old.category_id)), old, -1)
+            if new is not None:
+                add_order(deltas.setdefault(new.category_id, empty_stats(new.category_id)), new, 1)
+
+        stored = {stats.category_id: stats for stats in
+                  StatsCategory.objects.select_for_update().filter(category_id__in=deltas)}
+        for category_id, delta in deltas.items():
+            stats = stored.get(category_id) or empty_stats(category_id)
+            merge(stats, delta)
+            stats.save()
+
+        StatsOrder.objects.filter(order_id__in=order_ids).delete()
+        StatsOrder.objects.bulk_create(current.values())
+
+    return len(deltas)
+
+
+def chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def all_order_ids(size):
+    last = 0
+    while True:
+        ids = list(Order.objects.filter(id__gt=last).order_by('id').values_list('id', flat=True)[:size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def changed_order_ids(since):
+    changed = set(Order.objects.filter(updated_at__gt=since).values_list('id', flat=True))
+    changed.update(OrderApplication.objects.filter(updated_at__gt=since).values_list('order_id', flat=True))
+    return sorted(changed)
+
+
+@contextmanager
+def advisory_lock(key):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+
+
+def update(rebuild=False):
+    """
+    Processes orders changed since the last update, all orders on the first run or with `rebuild`.
+    Returns number of processed orders, None if another update is running
+    """
+    with advisory_lock(LOCK_KEY) as acquired:
+        if not acquired:
+            return None
+
+        if rebuild:
+            with transaction.atomic():
+                StatsWatermark.objects.filter(name=WATERMARK).delete()
+                StatsCategory.objects.all().delete()
+                StatsOrder.objects.all().delete()
+
+        started = timezone.now()
+        watermark = StatsWatermark.objects.filter(name=WATERMARK).first()
+        size = settings.STATS_BATCH_SIZE
+        if watermark is None:
+            batches = all_order_ids(size)
+        else:
+            since = watermark.value - timedelta(seconds=settings.STATS_WATERMARK_OVERLAP)
+            batches = chunks(changed_order_ids(since), size)
+
+        processed = 0
+        for order_ids in batches:
+            apply_orders(order_ids)
+            processed += len(order_ids)
+
+        deleted = list(StatsDeletedOrder.objects.values_list('order_id', flat=True))
+        for order_ids in chunks(deleted, size):
+            apply_orders(order_ids)
+            StatsDeletedOrder.objects.filter(order_id__in=order_ids).delete()
+
+        StatsWatermark.objects.update_or_create(name=WATERMARK, defaults={'value': started})
+        return processed
+
+
+def describe(stats):
+    return {
+        'orders': stats.orders,
+        'orders_by_status': {status.name.lower(): stats.status_counts[status.value] for status in OrderStatus},
+        'price_percentiles': {'p{0}'.format(q): percentile(stats.price_histogram, PRICE_BOUNDS, q)
+                              for q in settings.STATS_PRICE_PERCENTILES},
+        'applications_per_order': round(stats.applications / stats.orders, 2) if stats.orders else None,
+        'acceptance_median_seconds': percentile(stats.acceptance_histogram, ACCEPTANCE_BOUNDS, 50),
+    }
+
+
+def summary():
+    """
+    Stats of every category with orders and of the whole marketplace, from StatsCategory only
+    """
+    watermark = StatsWatermark.objects.filter(name=WATERMARK).values_list('value', flat=True).first()
+    rows = [stats for stats in StatsCategory.objects.order_by('category_id') if stats.orders]
+    titles = dict(OrderCategory.objects.filter(id__in=[stats.category_id for stats in rows])
+                  .values_list('id', 'title'))
+
+    total = empty_stats(None)
+    categories = []
+    for stats in rows:
+        merge(total, stats)
+        categories.append(dict(describe(stats), category_id=stats.category_id,
+                               title=titles.get(stats.category_id)))
+
+    return {'updated_at': watermark, 'total': describe(total), 'categories': categories}
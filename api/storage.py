@@ -0,0 +1,157 @@
+"""
+Content-addressed attachment storage on local filesystem. Content with sha1 `abcdef...` is stored once at
+ATTACHMENTS_ROOT/ab/cd/abcdef..., attachments referencing it are counted in Blob.refcount.
+Previews generated from the content are kept at ATTACHMENTS_ROOT/previews/ab/cd/abcdef...-<kind>.jpg until it is removed.
+
+Uploads are streamed to a temporary file in chunks while sha1 is computed, so memory per upload does not depend
+on file size. The temporary file is moved to its address with rename, which is atomic within one filesystem
+"""
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from api.models import Blob
+
+TempBlob = namedtuple('TempBlob', ('path', 'hash', 'size'))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def blob_name(hash):
+    return '/'.join((hash[:2], hash[2:4], hash))
+
+
+def blob_path(hash):
+    return os.path.join(settings.ATTACHMENTS_ROOT, blob_name(hash))
+
+
+def blob_url(hash):
+    return settings.ATTACHMENTS_URL + blob_name(hash)
+
+
+def preview_name(hash, kind):
+    return 'previews/{0}-{1}.jpg'.format(blob_name(hash), kind)
+
+
+def preview_path(hash, kind):
+    return os.path.join(settings.ATTACHMENTS_ROOT, preview_name(hash, kind))
+
+
+def read_chunks(stream, chunk_size=None):
+    chunk_size = chunk_size or settings.ATTACHMENT_CHUNK_SIZE
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def temp_dir():
+    # temporary files live on the same filesystem as blobs, so they can be renamed into place
+    path = os.path.join(settings.ATTACHMENTS_ROOT, 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_temp(chunks, max_size=None):
+    fd, path = tempfile.mkstemp(dir=temp_dir())
+    sha1 = hashlib.sha1()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise UploadTooLarge
+                sha1.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    return TempBlob(path, sha1.hexdigest(), size)
+
+
+@contextmanager
+def upload(chunks, max_size=None):
+    """
+    Streams chunks to a temporary file and yields TempBlob. Unless it is stored within the block,
+    the file is removed on exit
+    """
+    blob = write_temp(chunks, max_size)
+    try:
+        yield blob
+    finally:
+        if os.path.exists(blob.path):
+            os.unlink(blob.path)
+
+
+def lock_content(hash):
+    """
+    Transaction-level lock of the content address: serializes store() with removal of the released file
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [hash])
+
+
+def store(blob):
+    """
+    Takes reference to the content of uploaded TempBlob, moving it into place if it is new. Must be called
+    in transaction: row lock of the hash serializes it with release() of the same content
+    """
+    lock_content(blob.hash)
+    stored, created = Blob.objects.select_for_update().get_or_create(hash=blob.hash, defaults={'size': blob.size})
+    if not created:
+        Blob.objects.filter(hash=blob.hash).update(refcount=F('refcount') + 1)
+
+    path = blob_path(blob.hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.rename(blob.path, path)
+
+    return stored
+
+
+def release(hash):
+    """
+    Drops reference, the last one deletes the row. Must be called in transaction. The file is removed only after
+    the transaction commits: rolled back deletion keeps a row that points at existing content
+    """
+    blob = Blob.objects.select_for_update().filter(hash=hash).first()
+    if blob is None:
+        return
+
+    if blob.refcount > 1:
+        Blob.objects.filter(hash=hash).update(refcount=F('refcount') - 1)
+        return
+
+    blob.delete()
+    kinds = blob.previews or ()
+    transaction.on_commit(lambda: remove_unreferenced(hash, kinds))
+
+
+def remove_unreferenced(hash, kinds):
+    """
+    Removes content and its previews unless it was stored again after its row was deleted. A crash before this
+    leaves files that no row references, they are harmless and reused by the next store() of the same content
+    """
+    with transaction.atomic():
+        # store() in progress keeps the file it found in place, it holds the lock until it commits
+        lock_content(hash)
+        if Blob.objects.filter(hash=hash).exists():
+            return False
+
+        for path in [blob_path(hash)] + [preview_path(hash, kind) for kind in kinds]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    return True
@@ -1,16 +1,131 @@
-from django.core.mail import send_mail
+from datetime import timedelta
+from functools import lru_cache
 
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils import timezone
+
+from anon_fl import notify_api
+from api import previews, stats, uploads
+from api.batching import PartiallyProcessed, batch_task
 from api.celeryconf import app
+from api.models import Blob, UploadSession
+
+REGISTRATION_EMAIL_SUBJECT = 'Регистрация на Anon FL'
+
+
+@lru_cache(maxsize=None)
+def get_email_template(name):
+    """
+    Compiled email templates are kept per worker process, so batches skip template lookup and parsing
+    """
+    return get_template(name)
+
+
+def render_registration_email(username, email):
+    body = get_email_template('email/registration.txt').render({'username': username})
+    return REGISTRATION_EMAIL_SUBJECT, body, settings.DEFAULT_FROM_EMAIL, [email]
+
 
+def send_registration_emails(recipients):
+    """
+    Sends all messages over a single SMTP connection. recipients is a list of (username, email) pairs.
+    Messages are sent one by one, a failure raises PartiallyProcessed with the number of already sent ones
+    """
+    connection = get_connection(fail_silently=False)
+    sent = 0
+    with connection:
+        for done, (username, email) in enumerate(recipients):
+            subject, body, from_email, to = render_registration_email(username, email)
+            try:
+                sent += connection.send_messages([EmailMessage(subject, body, from_email, to, connection=connection)])
+            except Exception as e:
+                raise PartiallyProcessed(done) from e
+    return sent
 
-@app.task(queue='registration_email')
+
+@batch_task(key='email:registration', size=settings.EMAIL_BATCH_SIZE, delay=settings.EMAIL_BATCH_DELAY)
+def flush_registration_emails(recipients):
+    flush_registration_emails.get_logger().info('sending %d registration emails', len(recipients))
+    return send_registration_emails(recipients)
+
+
+def queue_registration_email(username, email):
+    """
+    Buffers registration email, the whole pending batch is sent by a single flush task
+    """
+    flush_registration_emails.add([username, email])
+
+
+@app.task
 def send_registration_email(username, email):
     logger = send_registration_email.get_logger()
     logger.info(username)
 
-    # TODO: вынести в шаблон
-    return send_mail('Регистрация на Anon FL',
-                     '{0}, добро пожаловать на сайт Anon FL'.format(username),
-                     'autechregescom@gmail.com',
-                     [email],
-                     fail_silently=False)
+    return send_registration_emails([(username, email)])
+
+
+@app.task
+def send_notification(user_ids, entity_id, key, data):
+    """
+    Delivers notification to any number of users with a single notify service call
+    """
+    return notify_api.notify(user_ids, entity_id, key, data) is not None
+
+
+@app.task
+def gc_upload_sessions():
+    """
+    Removes upload sessions that got no chunk for UPLOAD_SESSION_TTL, files are removed by post_delete signal.
+    Files left without a session are swept too
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    _, counts = UploadSession.objects.filter(updated_at__lt=deadline).delete()
+    deleted = counts.get(UploadSession._meta.label, 0)
+
+    session_ids = {str(session_id) for session_id in UploadSession.objects.values_list('id', flat=True)}
+    orphans = uploads.remove_orphans(session_ids, settings.UPLOAD_SESSION_TTL)
+
+    gc_upload_sessions.get_logger().info('removed %d expired upload sessions, %d orphan files', deleted, orphans)
+    return deleted
+
+
+def queue_previews(blob, filename):
+    """
+    Schedules preview generation of stored blob once the transaction that stored it commits,
+    content that is already processed is skipped
+    """
+    if blob.previews is None and previews.is_previewable(filename):
+        transaction.on_commit(lambda: generate_previews.delay(blob.hash))
+
+
+@app.task(max_retries=settings.PREVIEW_MAX_RETRIES, default_retry_delay=settings.PREVIEW_RETRY_DELAY)
+def generate_previews(hash):
+    if not Blob.objects.filter(hash=hash, previews__isnull=True).exists():
+        return []
+
+    try:
+        kinds = previews.generate(hash)
+    except Exception as e:
+        # previews stay NULL, so the content is processed again instead of being recorded as having none
+        generate_previews.get_logger().exception('previews of %s failed', hash)
+        raise generate_previews.retry(exc=e)
+
+    # content could be released while it was processed, its files are removed with the row
+    if not Blob.objects.filter(hash=hash, previews__isnull=True).update(previews=kinds):
+        if not Blob.objects.filter(hash=hash).exists():
+            previews.remove(hash, kinds)
+    return kinds
+
+
+@app.task
+def update_marketplace_stats(rebuild=False):
+    """
+    Applies orders changed since the previous run to marketplace statistics, see api/stats.py
+    """
+    processed = stats.update(rebuild=rebuild)
+    if processed is None:
+        update_marketplace_stats.get_logger().info('marketplace stats update is already running')
+    return processed
@@ -1,12 +1,53 @@
+import asyncio
+import gzip
+import hashlib
+import io
 import json
+import os
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import quote
 
 from django.contrib.auth.models import User
-from rest_framework import status
-from rest_framework.test import APITestCase, force_authenticate
+from django.core import mail
+from django.core.cache import cache
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework import status, viewsets
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory, force_authenticate
 from rest_framework.authtoken.models import Token
+from psycopg2 import extensions
 
-from api import models
-from api.models import OrderCategory, Tag, Order, OrderApplication
+from anon_fl import aio, compression, notify_api
+from anon_fl.db import router
+from anon_fl.db.pooled.base import ConnectionPool
+from anon_fl.notify_api import CircuitBreaker
+from anon_fl.paginators import ResultsSetPagination
+from anon_fl.profiling import route_stats
+
+from api import models, previews, stats, storage, uploads
+from api.batching import Batch, PartiallyProcessed
+from api.authentication import CachedTokenAuthentication, JWTAuthentication, JWT_ACCESS, encode_jwt, issue_jwt, \
+    local_cache
+from api.models import OrderCategory, Tag, Order, OrderApplication, OrderChat, OrderTag, OrderAttachment, Blob, \
+    UploadChunk, UploadSession, ApplicationStatus, OrderStatus, StatsCategory, StatsDeletedOrder
+from api.tasks import gc_upload_sessions, generate_previews, send_registration_emails
+from api.workers import worker_arguments
+from benchmarks.celery_throughput import MemoryRedis
 
 
 class Helpers:
@@ -62,6 +103,25 @@ class Helpers:
         client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
         return client
 
+    @staticmethod
+    def use_temporary_attachments_root(test):
+        """
+        Points ATTACHMENTS_ROOT to an empty directory removed after the test
+        """
+        root = tempfile.mkdtemp()
+        test.addCleanup(shutil.rmtree, root)
+        settings = test.settings(ATTACHMENTS_ROOT=root)
+        settings.enable()
+        test.addCleanup(settings.disable)
+        return root
+
+
+def run_on_commit():
+    """
+    Runs transaction.on_commit callbacks at once: TestCase transaction is never committed
+    """
+    return mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func())
+
 
 class AccountTests(APITestCase):
     def setUp(self):
@@ -80,6 +140,14 @@ class AccountTests(APITestCase):
             'username': data['username']
         })
 
+    def test_registration_returns_created_token(self):
+        response = self.client.post('/account/register', self.user_data)
+        user = User.objects.get(username=self.user_data['username'])
+
+        self.assertEqual(response.data['token'], Token.objects.get(user=user).key)
+        self.assertTrue(user.check_password(self.user_data['password']))
+        self.assertTrue(models.UserNotificationsSettings.objects.filter(user=user).exists())
+
     def test_can_login(self):
         Helpers.create_user(self.user_data['username'], self.user_data['password'])
 
@@ -91,8 +159,76 @@ class AccountTests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_200_OK)
         self.assertTrue('token' in response.data.keys())
 
+    def test_can_authenticate_with_jwt(self):
+        Helpers.create_user(self.user_data['username'], self.user_data['password'])
+        response = self.client.post('/account/login', {
+            'username': self.user_data['username'],
+            'password': self.user_data['password']
+        })
+
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer ' + response.data['jwt'])
+        with self.assertNumQueries(0):
+            user, payload = JWTAuthentication().authenticate(request)
+        self.assertEqual(user.username, self.user_data['username'])
+
+    def test_can_refresh_jwt(self):
+        Helpers.create_user(self.user_data['username'], self.user_data['password'])
+        response = self.client.post('/account/login', {
+            'username': self.user_data['username'],
+            'password': self.user_data['password']
+        })
+
+        response = self.client.post('/account/token/refresh', {'jwt_refresh': response.data['jwt_refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue('jwt' in response.data.keys())
+
+        response = self.client.post('/account/token/refresh', {'jwt_refresh': response.data['jwt']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_can_refresh_jwt_with_expired_access_token(self):
+        user = Helpers.create_user(self.user_data['username'], self.user_data['password'])
+        tokens = issue_jwt(user)
+        with self.settings(JWT_ACCESS_TTL=-60):
+            expired = encode_jwt(user, JWT_ACCESS)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + expired)
+        response = self.client.post('/account/token/refresh', {'jwt_refresh': tokens['jwt_refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(JWTAuthentication().authenticate(
+            APIRequestFactory().get('/', HTTP_AUTHORIZATION='Bearer ' + response.data['jwt']))[0].id, user.id)
+
 
 class OrderCategoriesTests(APITestCase):
+    def test_request_is_profiled(self):
+        Helpers.create_categories()
+        requests_before = route_stats.snapshot().get('GET order-category-list', {}).get('requests', 0)
+
+        response = self.client.get('/orders/categories/')
+
+        stats = route_stats.snapshot()['GET order-category-list']
+        self.assertTrue(response['Server-Timing'].startswith('total;dur='))
+        self.assertEqual(stats['requests'], requests_before + 1)
+        self.assertGreater(stats['sql_count'], 0)
+
+    def test_metrics_are_exported(self):
+        self.client.get('/orders/categories/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'http_request_duration_seconds_bucket{route="GET order-category-list"', response.content)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_metrics_are_not_cached(self):
+        def scrape():
+            content = self.client.get('/metrics').content.decode()
+            return float(re.search(r'^http_request_duration_seconds_count\{route="GET order-category-list",'
+                                   r'status="2xx"\} (\S+)$', content, re.M).group(1))
+
+        self.client.get('/orders/categories/')
+        first = scrape()
+        self.client.get('/orders/categories/?page=1')
+        self.assertEqual(scrape(), first + 1)
+
     def test_can_list_categories(self):
         Helpers.create_categories()
         categories = Helpers.categories
@@ -122,6 +258,91 @@ class OrderTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   STREAMING_CHUNK_SIZE=2, STREAMING_BUFFER_SIZE=64)
+class StreamingListTests(APITestCase):
+    def setUp(self):
+        Helpers.create_categories()
+        Helpers.create_tags()
+        customer = Helpers.create_user()
+        for i in range(7):
+            order = Order.objects.create(title='Заказ {0}'.format(i), description='Описание', price=10,
+                                         category_id=1, customer=customer)
+            OrderTag.objects.create(order=order, tag_id=i % 2 + 1)
+
+    def test_streamed_page_matches_rendered_page(self):
+        with self.settings(STREAMING_MIN_PAGE_SIZE=1):
+            streamed = self.client.get('/orders/', {'page_size': 5, 'page': 1})
+        rendered = self.client.get('/orders/', {'page_size': 5, 'page': 1})
+
+        self.assertTrue(streamed.streaming)
+        self.assertFalse(rendered.streaming)
+        self.assertEqual(b''.join(streamed.streaming_content), rendered.content)
+
+    def test_list_queries_do_not_grow_with_page(self):
+        # count, orders with category and users, order tags, tags
+        with self.assertNumQueries(4):
+            response = self.client.get('/orders/', {'page_size': 7})
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_page_size_is_capped_for_non_staff(self):
+        pagination = ResultsSetPagination()
+        request = APIRequestFactory().get('/orders/', {'page_size': 5000})
+        force_authenticate(request, Helpers.create_user('alice1234', '1234alice'))
+        self.assertEqual(pagination.get_page_size(Request(request)), pagination.public_max_page_size)
+
+        staff = User.objects.create_user('admin', password='admin1234', is_staff=True)
+        request = APIRequestFactory().get('/orders/', {'page_size': 5000})
+        force_authenticate(request, staff)
+        self.assertEqual(pagination.get_page_size(Request(request)), 5000)
+
+    def test_last_page_is_streamed(self):
+        with self.settings(STREAMING_MIN_PAGE_SIZE=1):
+            response = self.client.get('/orders/', {'page_size': 5, 'page': 'last'})
+
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNone(data['next'])
+
+
+class CompressionTests(SimpleTestCase):
+    def test_choose_encoding(self):
+        self.assertEqual(compression.choose_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.choose_encoding('gzip;q=0, deflate'), 'identity')
+        self.assertEqual(compression.choose_encoding(''), 'identity')
+        self.assertEqual(compression.choose_encoding('*'), 'br' if compression.brotli else 'gzip')
+
+    @override_settings(COMPRESSION_MIN_SIZE=100)
+    def test_compresses_large_responses_only(self):
+        factory = RequestFactory()
+        for body, encoding in ((b'{"a":1}', None), (json.dumps({'description': 'Описание ' * 50}).encode(), 'gzip')):
+            middleware = compression.CompressionMiddleware(
+                lambda request: HttpResponse(body, content_type='application/json'))
+            response = middleware(factory.get('/', HTTP_ACCEPT_ENCODING='gzip'))
+
+            self.assertEqual(response.get('Content-Encoding'), encoding)
+            content = gzip.decompress(response.content) if encoding else response.content
+            self.assertEqual(content, body)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   COMPRESSION_MIN_SIZE=1)
+class CompressedResponseCacheTests(APITestCase):
+    def setUp(self):
+        Helpers.create_categories([{'title': 'Категория {0} '.format(i) * 20, 'parent_id': None} for i in range(2)])
+
+    def test_cache_hit_is_served_compressed_without_recompression(self):
+        with mock.patch('anon_fl.compression.compress', wraps=compression.compress) as compress:
+            first = self.client.get('/orders/categories/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            second = self.client.get('/orders/categories/', HTTP_ACCEPT_ENCODING='deflate, gzip')
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(second['Content-Encoding'], 'gzip')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(json.loads(gzip.decompress(second.content).decode())['results']), 2)
+
+
 class OrderApplicationTests(APITestCase):
     def setUp(self):
         Helpers.create_categories()
@@ -203,6 +424,118 @@ class OrderApplicationStatusTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(self.order.status, models.OrderStatus.NEW.value)
 
+    def test_application_counts_follow_status(self):
+        contractor = Helpers.create_user('alice1234', '1234alice')
+        application, created = OrderApplication.apply(self.order.id, contractor.id)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.applications_new_count, 1)
+
+        self.client.put('/orders/{0}/applications/{1}/status/'.format(self.order.id, application.id),
+                        data=json.dumps({'status': models.ApplicationStatus.DECLINED.value}),
+                        content_type='application/json')
+
+        response = self.client.get('/orders/{0}/'.format(self.order.id))
+        self.assertEqual(response.data['applications_count'],
+                         {'new': 0, 'accepted': 0, 'declined': 1, 'withdrawn': 0})
+
+    def test_applicant_can_withdraw_application(self):
+        contractor = Helpers.create_user('alice1234', '1234alice')
+        OrderApplication.apply(self.order.id, contractor.id)
+
+        self.client = Helpers.authorize_client(self.client, contractor)
+        response = self.client.delete('/orders/{0}/applications/'.format(self.order.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], models.ApplicationStatus.WITHDRAWN.value)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.get_applications_count(), {'new': 0, 'accepted': 0, 'declined': 0, 'withdrawn': 1})
+
+    def test_stale_status_change_is_rejected(self):
+        contractor = Helpers.create_user('alice1234', '1234alice')
+        application, created = OrderApplication.apply(self.order.id, contractor.id)
+        # accepted by the customer after the applicant read it
+        OrderApplication.objects.get(id=application.id).set_status(models.ApplicationStatus.ACCEPTED.value)
+
+        self.assertFalse(application.set_status(models.ApplicationStatus.WITHDRAWN.value))
+        self.assertEqual(OrderApplication.objects.get(id=application.id).status,
+                         models.ApplicationStatus.ACCEPTED.value)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.get_applications_count(), {'new': 0, 'accepted': 1, 'declined': 0, 'withdrawn': 0})
+
+        with mock.patch('api.actions.OrderApplication.set_status', return_value=False):
+            OrderApplication.objects.filter(id=application.id).update(status=models.ApplicationStatus.NEW.value)
+            self.client = Helpers.authorize_client(self.client, contractor)
+            response = self.client.delete('/orders/{0}/applications/'.format(self.order.id))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_customer_can_filter_applications_by_status(self):
+        alice = Helpers.create_user('alice1234', '1234alice')
+        bob = Helpers.create_user('bob123456', '123456bob')
+        OrderApplication.apply(self.order.id, alice.id)
+        application, created = OrderApplication.apply(self.order.id, bob.id)
+        application.set_status(models.ApplicationStatus.DECLINED.value)
+
+        response = self.client.get('/orders/{0}/applications/'.format(self.order.id),
+                                   {'status': models.ApplicationStatus.NEW.value})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['applicant_id'], alice.id)
+
+    def test_contractor_can_list_own_applications(self):
+        contractor = Helpers.create_user('alice1234', '1234alice')
+        OrderApplication.apply(self.order.id, contractor.id)
+        other_order = Order.objects.create(title='Other', description='Description', price=10, category_id=1,
+                                           customer=self.customer)
+        application, created = OrderApplication.apply(other_order.id, contractor.id)
+        application.set_status(models.ApplicationStatus.DECLINED.value)
+
+        self.client = Helpers.authorize_client(self.client, contractor)
+        response = self.client.get('/orders/applications/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['order']['title'] for item in response.data['results']], ['Other', 'Title'])
+
+        response = self.client.get('/orders/applications/', {'status': models.ApplicationStatus.DECLINED.value})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['order_id'], other_order.id)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_application_list_is_not_cached(self):
+        contractor = Helpers.create_user('alice1234', '1234alice')
+        application, created = OrderApplication.apply(self.order.id, contractor.id)
+        path = '/orders/{0}/applications/'.format(self.order.id)
+
+        response = self.client.get(path, {'status': models.ApplicationStatus.NEW.value})
+        self.assertEqual(response.data['count'], 1)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        self.client.put('/orders/{0}/applications/{1}/status/'.format(self.order.id, application.id),
+                        data=json.dumps({'status': models.ApplicationStatus.DECLINED.value}),
+                        content_type='application/json')
+        response = self.client.get(path, {'status': models.ApplicationStatus.NEW.value})
+        self.assertEqual(response.data['count'], 0)
+
+        response = Helpers.authorize_client(APIClient(), contractor).get(path)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = APIClient().get(path)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_contractor_applications_are_not_cached(self):
+        alice = Helpers.create_user('alice1234', '1234alice')
+        bob = Helpers.create_user('bob123456', '123456bob')
+        OrderApplication.apply(self.order.id, alice.id)
+
+        self.client = Helpers.authorize_client(self.client, alice)
+        response = self.client.get('/orders/applications/')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        self.client = Helpers.authorize_client(APIClient(), bob)
+        response = self.client.get('/orders/applications/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
     def test_customer_do_not_have_permission(self):
         contractor = Helpers.create_user('alice1234', '1234alice')
         application = OrderApplication.objects.create(applicant_id=contractor.id, order_id=self.order.id)
@@ -215,3 +548,958 @@ class OrderApplicationStatusTests(APITestCase):
                                    content_type='application/json')
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class RegistrationEmailTests(TestCase):
+    def test_sends_batch_over_single_connection(self):
+        sent = send_registration_emails([('alice', 'alice@example.com'), ('bob', 'bob@example.com')])
+
+        self.assertEqual(sent, 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+        self.assertEqual(mail.outbox[1].body.strip(), 'bob, добро пожаловать на сайт Anon FL')
+
+    def test_failure_reports_sent_messages(self):
+        recipients = [('alice', 'alice@example.com'), ('bob', 'bob@example.com'), ('carol', 'carol@example.com')]
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=[1, smtplib.SMTPServerDisconnected]):
+            with self.assertRaises(PartiallyProcessed) as raised:
+                send_registration_emails(recipients)
+
+        self.assertEqual(raised.exception.done, 1)
+
+
+class BatchTaskTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = MemoryRedis()
+        self.processed = []
+        self.batch = Batch('test', size=2, delay=1, client=lambda: self.redis)
+        self.batch.task = mock.Mock()
+
+    def test_first_item_schedules_single_flush(self):
+        self.batch.add(1)
+        self.batch.add(2, 3)
+
+        self.assertEqual(self.batch.task.apply_async.call_count, 1)
+        self.batch.flush(self.processed.append)
+        self.assertEqual(self.processed, [[1, 2]])
+        # the rest is flushed by the next run
+        self.assertEqual(self.batch.task.apply_async.call_count, 2)
+
+    def test_failed_batch_is_put_back(self):
+        self.batch.add(1, 2, 3)
+
+        def fail(items):
+            raise ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            self.batch.flush(fail)
+        self.batch.flush(self.processed.append)
+        self.assertEqual(self.processed, [[1, 2]])
+
+    def test_processed_items_are_not_put_back(self):
+        self.batch.add(1, 2, 3)
+
+        def fail_second(items):
+            raise PartiallyProcessed(1)
+
+        with self.assertRaises(PartiallyProcessed):
+            self.batch.flush(fail_second)
+        self.batch.flush(self.processed.append)
+        self.assertEqual(self.processed, [[2, 3]])
+
+    def test_tasks_are_routed_by_name(self):
+        from api.celeryconf import app
+
+        routes = {name: app.amqp.router.route({}, name)['queue'].name
+                  for name in ('api.tasks.send_notification', 'api.tasks.notify_order_followers',
+                               'api.tasks.fanout_order_published', 'api.tasks.flush_registration_emails',
+                               'api.tasks.gc_upload_sessions')}
+        self.assertEqual(routes, {'api.tasks.send_notification': 'notifications',
+                                  'api.tasks.notify_order_followers': 'notifications',
+                                  'api.tasks.fanout_order_published': 'fanout',
+                                  'api.tasks.flush_registration_emails': 'registration_email',
+                                  'api.tasks.gc_upload_sessions': 'default'})
+
+    def test_worker_profile_arguments(self):
+        arguments = worker_arguments('previews', {'queues': ['previews'], 'concurrency': 4, 'prefetch_multiplier': 1,
+                                                  'fair': True})
+        self.assertEqual(' '.join(arguments),
+                         '-Q previews -n previews@%h --concurrency 4 --prefetch-multiplier 1 -O fair')
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: self.now)
+
+    def test_opens_after_threshold(self):
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.trips, 1)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_single_probe(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.now = 10
+
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.now = 10
+        self.breaker.allow()
+        self.breaker.failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.trips, 2)
+        self.assertFalse(self.breaker.allow())
+
+    def test_unexpected_error_of_probe_reopens(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.now = 10
+
+        with self.assertRaises(KeyError):
+            self.breaker.call(mock.Mock(side_effect=KeyError))
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+
+
+class NotifyRedeliveryTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(notify_api, 'parked', deque())
+        self.parked = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.posted = []
+        self.release = threading.Event()
+
+        def post(path, payload, timeout=None):
+            # parked notifications wait until the test lets them through
+            if payload.get('parked'):
+                self.release.wait(5)
+            self.posted.append(payload)
+
+        patcher = mock.patch.object(notify_api, 'post', post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parked_notifications_are_redelivered_in_background(self):
+        self.parked.extend([('/notify', {'parked': 1}), ('/notify', {'parked': 2})])
+
+        notify_api.notify([1], 1, notify_api.ORDER_CHAT_NEW_MESSAGE, {})
+        self.assertEqual(len(self.posted), 1)
+
+        self.release.set()
+        notify_api.redelivery.join(5)
+        self.assertEqual([payload.get('parked') for payload in self.posted], [None, 1, 2])
+        self.assertEqual(len(self.parked), 0)
+        self.assertIsNone(notify_api.schedule_redelivery())
+
+
+class FakeConnection:
+    """
+    Stands in for psycopg2 connection in pool tests
+    """
+    def __init__(self):
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(size=2, timeout=0.05, health_check_interval=60)
+        self.connected = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.connected.append(connection)
+        return connection
+
+    def test_released_connection_is_reused(self):
+        connection = self.pool.acquire(self.connect)
+        connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.release(connection)
+
+        self.assertIs(self.pool.acquire(self.connect), connection)
+        self.assertEqual(connection.rollbacks, 1)
+        self.assertEqual(len(self.connected), 1)
+
+    def test_overflow_waits_for_release(self):
+        first = self.pool.acquire(self.connect)
+        self.pool.acquire(self.connect)
+        with self.assertRaises(OperationalError):
+            self.pool.acquire(self.connect)
+
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(self.connect), first)
+
+    def test_failed_connect_frees_slot(self):
+        for _ in range(3):
+            with self.assertRaises(OperationalError):
+                self.pool.acquire(mock.Mock(side_effect=OperationalError))
+        self.assertIsNotNone(self.pool.acquire(self.connect))
+
+    def test_connection_with_errors_is_discarded(self):
+        connection = self.pool.acquire(self.connect)
+        self.pool.release(connection, errors_occurred=True)
+
+        self.assertTrue(connection.closed)
+        self.assertIsNot(self.pool.acquire(self.connect), connection)
+
+    def test_broken_connection_is_discarded(self):
+        closed = self.pool.acquire(self.connect)
+        lost = self.pool.acquire(self.connect)
+        closed.closed = 2
+        lost.status = extensions.TRANSACTION_STATUS_UNKNOWN
+        self.pool.release(closed)
+        self.pool.release(lost)
+
+        self.assertTrue(lost.closed)
+        self.assertEqual(len(self.pool.idle), 0)
+        self.assertNotIn(self.pool.acquire(self.connect), (closed, lost))
+
+    def test_concurrent_checkout_never_exceeds_size(self):
+        self.pool.timeout = 5
+        lock = threading.Lock()
+        in_use, peak = set(), [0]
+
+        def work(i):
+            connection = self.pool.acquire(self.connect)
+            with lock:
+                self.assertNotIn(connection, in_use)
+                in_use.add(connection)
+                peak[0] = max(peak[0], len(in_use))
+            time.sleep(0.001)
+            with lock:
+                in_use.discard(connection)
+            # every seventh checkout ends with a database error
+            self.pool.release(connection, errors_occurred=i % 7 == 0)
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(work, range(200)))
+
+        idle = [connection for connection, released_at in self.pool.idle]
+        self.assertEqual(peak[0], 2)
+        self.assertLessEqual(len(idle), 2)
+        self.assertFalse(any(connection.closed for connection in idle))
+        self.assertTrue(all(connection.closed for connection in self.connected if connection not in idle))
+
+
+class RoutedViewSet(router.ReplicaReadsMixin, viewsets.ViewSet):
+    authentication_classes = ()
+    permission_classes = ()
+
+    def read_db(self, status_code):
+        return Response({'db': router.ReplicaRouter().db_for_read(Order)}, status=status_code)
+
+    def list(self, request):
+        return self.read_db(status.HTTP_200_OK)
+
+    def create(self, request):
+        return self.read_db(status.HTTP_201_CREATED)
+
+    def history(self, request):
+        return self.read_db(status.HTTP_200_OK)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   DATABASE_REPLICAS=['replica1'], REPLICA_MAX_LAG=5, REPLICA_LAG_CHECK_INTERVAL=5)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.lag = 0
+        self.now = 0
+        self.health = router.ReplicaHealth(measure=lambda alias: self.lag, clock=lambda: self.now)
+        patcher = mock.patch.object(router, 'health', self.health)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def request(self, method, user_id=None, action=None):
+        view = RoutedViewSet.as_view({method: action or ('list' if method == 'get' else 'create')})
+        request = getattr(self.factory, method)('/orders/')
+        if user_id is not None:
+            force_authenticate(request, User(id=user_id, username='user{0}'.format(user_id)))
+        return router.ReplicaRoutingMiddleware(view)(request).data['db']
+
+    def test_list_reads_from_replica(self):
+        self.assertEqual(self.request('get'), 'replica1')
+
+    def test_other_reads_use_primary(self):
+        self.assertEqual(self.request('get', action='history'), 'default')
+        self.assertEqual(self.request('post', user_id=1), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.request('post', user_id=1)
+
+        self.assertEqual(self.request('get', user_id=1), 'default')
+        self.assertEqual(self.request('get', user_id=2), 'replica1')
+
+    def test_reads_stick_to_primary_after_login(self):
+        router.stick_to_primary(3)
+        self.assertEqual(self.request('get', user_id=3), 'default')
+
+    def test_lagging_replica_is_skipped_until_next_check(self):
+        self.lag = 10
+        self.assertEqual(self.request('get'), 'default')
+
+        self.lag = 0
+        self.assertEqual(self.request('get'), 'default')
+
+        self.now = 6
+        self.assertEqual(self.request('get'), 'replica1')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        local_cache.clear()
+        self.user = Helpers.create_user()
+        self.token = Token.objects.get(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+
+    def test_second_authentication_skips_database(self):
+        self.authentication.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(0):
+            user, key = self.authentication.authenticate_credentials(self.token.key)
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.username, self.user.username)
+
+    def test_cached_user_is_read_only(self):
+        user, key = self.authentication.authenticate_credentials(self.token.key)
+        user.first_name = 'Alice'
+
+        with self.assertRaises(NotImplementedError):
+            user.save()
+        self.assertTrue(User.objects.get(id=self.user.id).check_password(Helpers.user['password']))
+
+    def test_token_deletion_invalidates_cache(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_deactivation_invalidates_cache(self):
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class OrderChatTests(APITestCase):
+    def setUp(self):
+        Helpers.create_categories()
+        Helpers.create_tags()
+
+        self.customer = Helpers.create_user()
+        self.contractor = Helpers.create_user('alice1234', '1234alice')
+        self.client = Helpers.authorize_client(self.client, self.customer)
+        self.client.post('/orders/', data=json.dumps(Helpers.order), content_type='application/json')
+        self.order = Order.objects.get(id=1)
+
+        application = OrderApplication.objects.create(applicant_id=self.contractor.id, order_id=self.order.id)
+        self.client.put('/orders/{0}/applications/{1}/status/'.format(self.order.id, application.id),
+                        data=json.dumps({'status': models.ApplicationStatus.ACCEPTED.value}),
+                        content_type='application/json')
+
+    def test_participant_can_send_message(self):
+        self.client = Helpers.authorize_client(self.client, self.contractor)
+        response = self.client.post('/orders/{0}/chat/messages/'.format(self.order.id), data={'message': 'Hi'})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(OrderChat.objects.get(order_id=self.order.id).messages_count, 1)
+
+    def test_other_user_cannot_read_messages(self):
+        other = Helpers.create_user('bob123456', '123456bob')
+        self.client = Helpers.authorize_client(self.client, other)
+        response = self.client.get('/orders/{0}/chat/messages/'.format(self.order.id))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_messages_list_does_not_load_order(self):
+        self.client.get('/orders/{0}/chat/messages/'.format(self.order.id))
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/orders/{0}/chat/messages/'.format(self.order.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class OrderApplicationAcceptanceConcurrencyTests(TransactionTestCase):
+    applicants_count = 8
+
+    def setUp(self):
+        Helpers.create_categories()
+        self.customer = Helpers.create_user()
+        self.order = Order.objects.create(title='Title', description='Description', price=10, category_id=1,
+                                          customer=self.customer)
+        self.applications = [
+            OrderApplication.apply(self.order.id, Helpers.create_user('user{0}'.format(i), 'password{0}'.format(i)).id)[0]
+            for i in range(self.applicants_count)
+        ]
+
+    @mock.patch('api.actions.send_notification')
+    def test_parallel_accepts_choose_single_contractor(self, send_notification):
+        token = Token.objects.get(user=self.customer).key
+        barrier = threading.Barrier(self.applicants_count)
+        statuses = []
+
+        def accept(application):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+            barrier.wait()
+            try:
+                response = client.put('/orders/{0}/applications/{1}/status/'.format(self.order.id, application.id),
+                                      data=json.dumps({'status': models.ApplicationStatus.ACCEPTED.value}),
+                                      content_type='application/json')
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=accept, args=(application,)) for application in self.applications]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.order.refresh_from_db()
+        self.assertEqual(statuses.count(status.HTTP_200_OK), 1)
+        self.assertEqual(OrderChat.objects.filter(order_id=self.order.id).count(), 1)
+        self.assertEqual(OrderApplication.objects.filter(status=models.ApplicationStatus.DECLINED.value).count(),
+                         self.applicants_count - 1)
+        self.assertEqual(self.order.applications_accepted_count, 1)
+        self.assertEqual(self.order.applications_declined_count, self.applicants_count - 1)
+        self.assertEqual(self.order.applications_new_count, 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AsyncViewsTests(TransactionTestCase):
+    def setUp(self):
+        from anon_fl.asgi import application
+        self.application = application
+
+        # single database thread, so its connection can be closed before test database is flushed
+        self.executor = ThreadPoolExecutor(1)
+        for name in ('database_executor', 'wsgi_executor'):
+            patcher = mock.patch.object(aio, name, self.executor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: self.executor.submit(connection.close).result())
+
+        Helpers.create_categories()
+        self.customer = Helpers.create_user()
+        self.contractor = Helpers.create_user('alice1234', '1234alice')
+        self.order = Order.objects.create(title='Title', description='Description', price=10, category_id=1,
+                                          customer=self.customer, contractor=self.contractor)
+        self.chat = OrderChat.objects.create(order=self.order)
+
+        self.notifications = []
+
+        async def notify_async(*args):
+            self.notifications.append(args)
+
+        patcher = mock.patch('anon_fl.notify_api.notify_async', notify_async)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method, path, data=None, user=None):
+        headers = [(b'content-type', b'application/json')]
+        if user is not None:
+            headers.append((b'authorization', 'Token {0}'.format(Token.objects.get(user=user).key).encode()))
+        body = json.dumps(data).encode() if data is not None else b''
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': headers}
+        asyncio.get_event_loop().run_until_complete(self.application(scope, receive, send))
+        content = b''.join(message.get('body', b'') for message in messages[1:])
+        self.headers = {name.decode(): value.decode() for name, value in messages[0]['headers']}
+        return messages[0]['status'], json.loads(content.decode())
+
+    def test_participant_sends_message(self):
+        status_code, data = self.request('POST', '/orders/{0}/chat/messages/'.format(self.order.id),
+                                         {'message': 'Hi'}, self.contractor)
+
+        self.assertEqual(status_code, status.HTTP_201_CREATED)
+        self.assertEqual(data['message'], 'Hi')
+        self.assertEqual(OrderChat.objects.get(id=self.chat.id).messages_count, 1)
+        self.assertEqual(self.notifications[0][:3],
+                         ([self.customer.id], self.chat.id, 'ORDER_CHAT_NEW_MESSAGE'))
+
+    def test_write_is_profiled_and_sticks_to_primary(self):
+        route = 'POST async chat_message_create'
+        requests_before = route_stats.snapshot().get(route, {}).get('requests', 0)
+
+        self.request('POST', '/orders/{0}/chat/messages/'.format(self.order.id), {'message': 'Hi'}, self.contractor)
+
+        self.assertTrue(self.headers['server-timing'].startswith('total;dur='))
+        self.assertEqual(route_stats.snapshot()[route]['requests'], requests_before + 1)
+        self.assertGreater(route_stats.snapshot()[route]['sql_count'], 0)
+        self.assertIsNotNone(cache.get(router.sticky_key(self.contractor.id)))
+        self.assertIsNone(cache.get(router.sticky_key(self.customer.id)))
+
+    def test_anonymous_user_is_rejected(self):
+        status_code, data = self.request('POST', '/orders/{0}/chat/messages/'.format(self.order.id),
+                                         {'message': 'Hi'})
+
+        self.assertEqual(status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.notifications, [])
+
+    def test_other_routes_are_served_by_wsgi_application(self):
+        status_code, data = self.request('GET', '/orders/categories/')
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(len(data['results']), 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ATTACHMENTS_ACCEL_PREFIX='/protected-attachments/')
+class AttachmentStorageTests(APITestCase):
+    def setUp(self):
+        Helpers.use_temporary_attachments_root(self)
+
+        Helpers.create_categories()
+        self.customer = Helpers.create_user()
+        self.client = Helpers.authorize_client(self.client, self.customer)
+        self.order = Order.objects.create(title='Title', description='Description', price=10, category_id=1,
+                                          customer=self.customer)
+
+    def upload(self, content, filename='file.pdf'):
+        return self.client.post('/orders/{0}/attachments/?filename={1}'.format(self.order.id, quote(filename)),
+                                data=content, content_type='application/octet-stream')
+
+    def test_identical_uploads_are_stored_once(self):
+        content = os.urandom(200 * 1024)
+        first = self.upload(content, 'first.pdf')
+        second = self.upload(content, 'second.pdf')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data['hash'], second.data['hash'])
+        self.assertEqual(Blob.objects.get(hash=first.data['hash']).refcount, 2)
+        with open(storage.blob_path(first.data['hash']), 'rb') as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(os.listdir(storage.temp_dir()), [])
+
+    def test_last_reference_removes_file(self):
+        hash = self.upload(b'content').data['hash']
+        self.upload(b'content')
+
+        OrderAttachment.objects.first().delete()
+        self.assertTrue(os.path.exists(storage.blob_path(hash)))
+
+        with run_on_commit():
+            OrderAttachment.objects.first().delete()
+        self.assertFalse(os.path.exists(storage.blob_path(hash)))
+        self.assertFalse(Blob.objects.filter(hash=hash).exists())
+
+    def test_rolled_back_deletion_keeps_file(self):
+        hash = self.upload(b'content').data['hash']
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.order.delete()
+            raise RuntimeError
+        self.assertTrue(Blob.objects.filter(hash=hash).exists())
+        self.assertTrue(os.path.exists(storage.blob_path(hash)))
+
+    def test_content_stored_again_is_not_removed(self):
+        hash = self.upload(b'content').data['hash']
+        OrderAttachment.objects.first().delete()
+        self.upload(b'content')
+
+        self.assertFalse(storage.remove_unreferenced(hash, ()))
+        self.assertTrue(os.path.exists(storage.blob_path(hash)))
+
+    def test_list_is_not_cached(self):
+        self.upload(b'content')
+        response = self.client.get('/orders/{0}/attachments/'.format(self.order.id))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        self.client = APIClient()
+        response = self.client.get('/orders/{0}/attachments/'.format(self.order.id))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_too_large_upload_is_rejected(self):
+        with self.settings(ATTACHMENT_MAX_SIZE=1024):
+            response = self.upload(b'x' * 2048)
+
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(Blob.objects.count(), 0)
+        self.assertEqual(os.listdir(storage.temp_dir()), [])
+
+    def test_only_customer_uploads(self):
+        other = Helpers.create_user('bob123456', '123456bob')
+        self.client = Helpers.authorize_client(self.client, other)
+
+        self.assertEqual(self.upload(b'content').status_code, status.HTTP_403_FORBIDDEN)
+
+    def download(self, attachment_id, **headers):
+        return self.client.get('/orders/{0}/attachments/{1}/download'.format(self.order.id, attachment_id),
+                               **headers)
+
+    def test_download_is_handed_off_to_nginx(self):
+        attachment = self.upload(b'content', 'Договор.pdf').data
+
+        response = self.download(attachment['id'], HTTP_ACCEPT='application/pdf')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-attachments/' + storage.blob_name(attachment['hash']))
+        self.assertEqual(response['ETag'], '"{0}"'.format(attachment['hash']))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn("filename*=UTF-8''%D0%94", response['Content-Disposition'])
+
+        response = self.download(attachment['id'], HTTP_IF_NONE_MATCH='"{0}"'.format(attachment['hash']))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_download_range_without_nginx(self):
+        attachment = self.upload(b'0123456789').data
+
+        with self.settings(ATTACHMENTS_ACCEL_PREFIX=''):
+            response = self.download(attachment['id'], HTTP_RANGE='bytes=2-5')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(b''.join(response.streaming_content), b'2345')
+            self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+            response = self.download(attachment['id'], HTTP_RANGE='bytes=20-')
+            self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_download_is_forbidden_to_other_users(self):
+        attachment = self.upload(b'content').data
+        self.client = Helpers.authorize_client(self.client, Helpers.create_user('bob123456', '123456bob'))
+
+        self.assertEqual(self.download(attachment['id']).status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ATTACHMENTS_ACCEL_PREFIX='/protected-attachments/')
+class AttachmentPreviewTests(APITestCase):
+    def setUp(self):
+        Helpers.use_temporary_attachments_root(self)
+
+        Helpers.create_categories()
+        self.customer = Helpers.create_user()
+        self.client = Helpers.authorize_client(self.client, self.customer)
+        self.order = Order.objects.create(title='Title', description='Description', price=10, category_id=1,
+                                          customer=self.customer)
+        self.base = '/orders/{0}/attachments/'.format(self.order.id)
+
+    def upload(self, content, filename):
+        response = self.client.post('{0}?filename={1}'.format(self.base, filename), data=content,
+                                    content_type='application/octet-stream')
+        return response.data
+
+    def image(self, size, mode='RGB', format='PNG'):
+        buffer = io.BytesIO()
+        previews.Image.new(mode, size).save(buffer, format)
+        return buffer.getvalue()
+
+    def test_previews_are_generated_once_per_content(self):
+        attachment = self.upload(self.image((2000, 1000)), 'photo.png')
+        self.assertEqual(attachment['previews'], {})
+
+        self.assertEqual(sorted(generate_previews(attachment['hash'])), ['preview', 'thumbnail'])
+        self.assertEqual(generate_previews(attachment['hash']), [])
+        self.assertEqual(sorted(Blob.objects.get(hash=attachment['hash']).previews), ['preview', 'thumbnail'])
+
+        with previews.Image.open(storage.preview_path(attachment['hash'], 'thumbnail')) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (256, 128)))
+
+        listed = self.client.get(self.base).data['results'][0]
+        thumbnail_url = '{0}{1}/previews/thumbnail'.format(self.base, attachment['id'])
+        self.assertEqual(listed['previews']['thumbnail'], thumbnail_url)
+
+        response = self.client.get(thumbnail_url)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-attachments/' + storage.preview_name(attachment['hash'], 'thumbnail'))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_transparent_image_is_flattened(self):
+        attachment = self.upload(self.image((300, 300), 'RGBA'), 'logo.png')
+        generate_previews(attachment['hash'])
+
+        with previews.Image.open(storage.preview_path(attachment['hash'], 'thumbnail')) as thumbnail:
+            self.assertEqual(thumbnail.getpixel((0, 0)), (255, 255, 255))
+
+    def test_content_without_preview_is_processed_once(self):
+        attachment = self.upload(b'not an image', 'photo.png')
+
+        self.assertEqual(generate_previews(attachment['hash']), [])
+        self.assertEqual(Blob.objects.get(hash=attachment['hash']).previews, [])
+        self.assertEqual(self.client.get('{0}{1}/previews/thumbnail'.format(self.base, attachment['id'])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_failed_generation_is_not_recorded(self):
+        attachment = self.upload(self.image((2000, 1000)), 'photo.png')
+        save, written = previews.save, []
+
+        def save_until_disk_is_full(image, path):
+            if written:
+                raise OSError('No space left on device')
+            save(image, path)
+            written.append(path)
+
+        with mock.patch('api.previews.save', side_effect=save_until_disk_is_full), self.assertRaises(OSError):
+            generate_previews(attachment['hash'])
+
+        self.assertEqual(len(written), 1)
+        self.assertFalse(os.path.exists(written[0]))
+        self.assertIsNone(Blob.objects.get(hash=attachment['hash']).previews)
+
+        self.assertEqual(sorted(generate_previews(attachment['hash'])), ['preview', 'thumbnail'])
+
+    def test_previews_are_removed_with_content(self):
+        attachment = self.upload(self.image((300, 300)), 'photo.png')
+        generate_previews(attachment['hash'])
+
+        with run_on_commit():
+            OrderAttachment.objects.get(id=attachment['id']).delete()
+        self.assertFalse(os.path.exists(storage.preview_path(attachment['hash'], 'thumbnail')))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   UPLOAD_CHUNK_SIZE=4)
+class ChatUploadTests(APITestCase):
+    content = b'0123456789'
+
+    def setUp(self):
+        Helpers.use_temporary_attachments_root(self)
+
+        patcher = mock.patch('anon_fl.notify_api.notify')
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        Helpers.create_categories()
+        self.customer = Helpers.create_user()
+        self.contractor = Helpers.create_user('alice1234', '1234alice')
+        self.order = Order.objects.create(title='Title', description='Description', price=10, category_id=1,
+                                          customer=self.customer, contractor=self.contractor)
+        self.chat = OrderChat.objects.create(order=self.order)
+        self.client = Helpers.authorize_client(self.client, self.contractor)
+        self.base = '/orders/{0}/chat/uploads/'.format(self.order.id)
+
+    def initiate(self, content=None, filename='deliverable.zip'):
+        content = self.content if content is None else content
+        response = self.client.post(self.base, data={'filename': filename, 'size': len(content),
+                                                     'hash': hashlib.sha1(content).hexdigest()})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def put_chunk(self, session, number, data):
+        return self.client.put('{0}{1}/chunks/{2}'.format(self.base, session['id'], number), data=data,
+                               content_type='application/octet-stream')
+
+    def commit(self, session, message=None):
+        data = {'message': message} if message else {}
+        return self.client.post('{0}{1}/commit'.format(self.base, session['id']), data=data)
+
+    def test_chunks_in_any_order_are_assembled(self):
+        session = self.initiate()
+        self.assertEqual((session['chunk_size'], session['chunks_count'], session['received']), (4, 3, []))
+
+        for number in (2, 0):
+            self.assertEqual(self.put_chunk(session, number, self.content[number * 4:number * 4 + 4]).status_code,
+                             status.HTTP_200_OK)
+        # interrupted upload resumes with the missing chunk
+        self.assertEqual(self.client.get('{0}{1}/'.format(self.base, session['id'])).data['received'], [0, 2])
+        self.put_chunk(session, 1, self.content[4:8])
+
+        response = self.commit(session, 'Done')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['message'], 'Done')
+        attachment = response.data['attachments'][0]
+        self.assertEqual(attachment['filename'], 'deliverable.zip')
+        self.assertEqual(attachment['hash'], hashlib.sha1(self.content).hexdigest())
+
+        with open(storage.blob_path(attachment['hash']), 'rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertEqual(OrderChat.objects.get(id=self.chat.id).messages_count, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.notify.call_args[0][0], [self.customer.id])
+
+        messages = self.client.get('/orders/{0}/chat/messages/'.format(self.order.id)).data['results']
+        self.assertEqual(messages[0]['attachments'], [attachment])
+
+    def test_commit_lists_missing_chunks(self):
+        session = self.initiate()
+        self.put_chunk(session, 1, self.content[4:8])
+
+        response = self.commit(session)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['chunks'], [0, 2])
+
+    def test_failed_commit_can_be_retried(self):
+        session = self.initiate()
+        for number, data in enumerate((b'0123', b'4567', b'89')):
+            self.put_chunk(session, number, data)
+
+        with mock.patch('api.views.commit_chat_upload', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.commit(session)
+
+        self.assertEqual(self.commit(session).status_code, status.HTTP_201_CREATED)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_received_chunks_are_not_cached(self):
+        session = self.initiate()
+        self.client.get('{0}{1}/'.format(self.base, session['id']))
+        self.put_chunk(session, 0, b'0123')
+
+        response = self.client.get('{0}{1}/'.format(self.base, session['id']))
+        self.assertEqual(response.data['received'], [0])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_chunk_of_wrong_length_is_not_recorded(self):
+        session = self.initiate()
+
+        self.assertEqual(self.put_chunk(session, 0, b'01234').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(session, 2, b'8').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(session, 3, b'').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadChunk.objects.exists())
+
+    def test_content_not_matching_hash_is_rejected(self):
+        session = self.initiate()
+        for number, data in enumerate((b'0123', b'xxxx', b'89')):
+            self.put_chunk(session, number, data)
+
+        response = self.commit(session)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+    def test_session_is_private_to_uploader(self):
+        session = self.initiate()
+        self.client = Helpers.authorize_client(self.client, self.customer)
+
+        self.assertEqual(self.put_chunk(session, 0, b'0123').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_idle_sessions_are_collected(self):
+        session = self.initiate()
+        UploadSession.objects.filter(id=session['id']).update(updated_at=timezone.now() - timedelta(days=2))
+        orphan = uploads.part_path(uuid.uuid4())
+        open(orphan, 'wb').close()
+        os.utime(orphan, (0, 0))
+
+        self.assertEqual(gc_upload_sessions(), 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(orphan))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   STATS_WATERMARK_OVERLAP=0)
+class MarketplaceStatsTests(APITestCase):
+    def setUp(self):
+        Helpers.create_categories()
+        self.customer = Helpers.create_user()
+        self.contractor = Helpers.create_user('alice1234', '1234alice')
+        self.orders = [Order.objects.create(title='Title', description='Description', price=price, category_id=2,
+                                            customer=self.customer) for price in (100, 1000, 10000)]
+
+    def accept(self, order, seconds):
+        application, _ = OrderApplication.apply(order.id, self.contractor.id)
+        application.set_status(ApplicationStatus.ACCEPTED.value)
+        OrderApplication.objects.filter(id=application.id)\
+            .update(updated_at=order.created_at + timedelta(seconds=seconds))
+
+    def category(self, category_id=2):
+        summary = stats.summary()
+        return next(item for item in summary['categories'] if item['category_id'] == category_id)
+
+    def test_summary_of_orders(self):
+        self.accept(self.orders[0], 3600)
+        self.assertEqual(stats.update(), 3)
+
+        category = self.category()
+        self.assertEqual(category['title'], 'Foo child')
+        self.assertEqual(category['orders'], 3)
+        self.assertEqual(category['orders_by_status']['new'], 3)
+        self.assertEqual(category['applications_per_order'], 0.33)
+        self.assertAlmostEqual(category['acceptance_median_seconds'], 3600, delta=3600 * 0.13)
+        self.assertAlmostEqual(category['price_percentiles']['p50'], 1000, delta=1000 * 0.13)
+        self.assertEqual(stats.summary()['total']['orders'], 3)
+
+    def test_update_is_incremental_and_idempotent(self):
+        stats.update()
+        self.assertEqual(stats.update(), 0)
+
+        order = self.orders[0]
+        order.status = OrderStatus.PUBLISHED.value
+        order.category_id = 3
+        order.save()
+        self.assertEqual(stats.update(), 1)
+        # rereading unchanged orders changes nothing
+        with self.settings(STATS_WATERMARK_OVERLAP=3600):
+            self.assertEqual(stats.update(), 3)
+
+        self.assertEqual(self.category()['orders'], 2)
+        self.assertEqual(self.category(3)['orders_by_status']['published'], 1)
+        self.assertEqual(StatsCategory.objects.get(category_id=2).status_counts[OrderStatus.NEW.value], 2)
+
+    def test_deleted_orders_are_removed(self):
+        stats.update()
+        self.orders[1].delete()
+        self.assertTrue(StatsDeletedOrder.objects.exists())
+
+        stats.update()
+        self.assertEqual(self.category()['orders'], 2)
+        self.assertFalse(StatsDeletedOrder.objects.exists())
+
+    def test_rebuild_matches_incremental_update(self):
+        stats.update()
+        self.accept(self.orders[2], 60 * 60 * 24)
+        stats.update()
+        incremental = self.category()
+
+        stats.update(rebuild=True)
+        self.assertEqual(self.category(), incremental)
+
+    def test_percentile_of_histogram(self):
+        bounds = stats.log_bounds(1, 1000, 10)
+        histogram = [0] * len(bounds)
+        for value in range(1, 1001):
+            histogram[stats.bucket(value, bounds)] += 1
+
+        self.assertAlmostEqual(stats.percentile(histogram, bounds, 50), 500, delta=500 * 0.26)
+        self.assertAlmostEqual(stats.percentile(histogram, bounds, 90), 900, delta=900 * 0.26)
+        self.assertIsNone(stats.percentile([0] * len(bounds), bounds, 50))
+        self.assertEqual(stats.bucket(10 ** 6, bounds), len(bounds) - 1)
+
+    def test_endpoint_is_public_and_cacheable(self):
+        stats.update()
+        response = self.client.get('/stats/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total']['orders'], 3)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=300', response['Cache-Control'])
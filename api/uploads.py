@@ -0,0 +1,147 @@
+"""
+Resumable chat attachment uploads. Initiating a session preallocates a sparse file of the declared size under
+ATTACHMENTS_ROOT/uploads, every chunk is written at its own offset with pwrite, so chunks can arrive in any order
+and in parallel, and a failed chunk is simply sent again. Nothing is buffered beyond ATTACHMENT_CHUNK_SIZE.
+
+On commit the file is taken out of reach of chunk writers, its sha1 is computed by streaming it and the file
+is moved to content-addressed storage (api/storage.py).
+
+Chunk writers hold a shared flock on the file, commit renames the file and then waits for an exclusive one:
+after that no chunk can be written into content whose hash was verified
+"""
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from api import storage
+
+
+class ChunkMismatch(Exception):
+    pass
+
+
+def uploads_dir():
+    # same filesystem as blobs, committed file is renamed into place
+    path = os.path.join(settings.ATTACHMENTS_ROOT, 'uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def part_path(session_id):
+    return os.path.join(uploads_dir(), str(session_id))
+
+
+def taken_path(session_id):
+    return part_path(session_id) + '.commit'
+
+
+def allocate(session):
+    with open(part_path(session.id), 'wb') as file:
+        file.truncate(session.size)
+
+
+@contextmanager
+def open_part(session_id):
+    """
+    Yields descriptor of session file open for writing. FileNotFoundError if the session file is gone or taken
+    by commit
+    """
+    path = part_path(session_id)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        # commit could take the file between open and lock
+        if os.fstat(fd).st_ino != os.stat(path).st_ino:
+            raise FileNotFoundError(path)
+        yield fd
+    finally:
+        # closing releases the lock
+        os.close(fd)
+
+
+def pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+def write_chunk(session, number, chunks, expected_hash=None):
+    """
+    Writes body of chunk `number` at its offset. ChunkMismatch if body length is not the chunk length
+    or its sha1 is not `expected_hash`
+    """
+    offset, length = session.chunk_range(number)
+    sha1 = hashlib.sha1()
+    written = 0
+
+    with open_part(session.id) as fd:
+        for data in chunks:
+            if written + len(data) > length:
+                raise ChunkMismatch('Chunk {0} is longer than {1} bytes'.format(number, length))
+            sha1.update(data)
+            pwrite_all(fd, data, offset + written)
+            written += len(data)
+
+    if written != length:
+        raise ChunkMismatch('Chunk {0} has {1} bytes, {2} expected'.format(number, written, length))
+    if expected_hash is not None and sha1.hexdigest() != expected_hash.lower():
+        raise ChunkMismatch('Chunk {0} does not match its hash'.format(number))
+
+
+def take(session_id):
+    """
+    Moves session file away from chunk writers and waits for writes in progress. Returns path of the taken file.
+    File taken by an earlier commit that failed is taken again, FileNotFoundError if there is neither
+    """
+    path = taken_path(session_id)
+    try:
+        os.rename(part_path(session_id), path)
+    except FileNotFoundError:
+        if not os.path.exists(path):
+            raise
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    finally:
+        os.close(fd)
+    return path
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in storage.read_chunks(file):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def remove(session_id):
+    for path in (part_path(session_id), taken_path(session_id)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_orphans(session_ids, max_age):
+    """
+    Removes files older than `max_age` seconds that belong to no session in `session_ids`:
+    left by a crash between session row deletion and file removal
+    """
+    removed = 0
+    deadline = time.time() - max_age
+    for entry in os.scandir(uploads_dir()):
+        if entry.name.split('.')[0] in session_ids or entry.stat().st_mtime > deadline:
+            continue
+        try:
+            os.unlink(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -2,8 +2,11 @@ from django.conf.urls import url
 
 from api.views import OrderViewSet, OrderAttachmentViewSet, OrderCategoryViewSet, OrderContractorListViewSet, \
     OrderCustomerListViewSet, OrderChatMessageListViewSet, OrderChatDetailViewSet, AccountRegistrationView, \
-    AccountLoginView, OrderApplicationListViewSet, TagViewSet, OrderApplicationStatusDetailView, \
-    UserNotificationsSettingsViewSet, NotificationsMarkAsRead
+    AccountLoginView, AccountTokenRefreshView, OrderApplicationListViewSet, TagViewSet, OrderApplicationStatusDetailView, \
+    UserNotificationsSettingsViewSet, NotificationsMarkAsRead, ContractorApplicationListViewSet, \
+    OrderAttachmentDownloadView, OrderChatAttachmentDownloadView, OrderChatUploadViewSet, MarketplaceStatsView
+
+UPLOAD_ID = r'(?P<pk>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})'
 
 order_list = OrderViewSet.as_view({
     'get': 'list',
@@ -18,14 +21,12 @@ order_detail = OrderViewSet.as_view({
 })
 
 order_attachment_list = OrderAttachmentViewSet.as_view({
-    'get': 'retrieve',
+    'get': 'list',
     'post': 'create'
 })
 
 order_attachment_detail = OrderAttachmentViewSet.as_view({
     'get': 'retrieve',
-    'put': 'update',
-    'patch': 'partial_update',
     'delete': 'destroy'
 })
 
@@ -59,11 +60,33 @@ order_chat_messages_list = OrderChatMessageListViewSet.as_view({
     'put': 'read'
 })
 
+order_chat_upload_list = OrderChatUploadViewSet.as_view({
+    'post': 'create'
+})
+
+order_chat_upload_detail = OrderChatUploadViewSet.as_view({
+    'get': 'retrieve',
+    'delete': 'destroy'
+})
+
+order_chat_upload_chunk = OrderChatUploadViewSet.as_view({
+    'put': 'chunk'
+})
+
+order_chat_upload_commit = OrderChatUploadViewSet.as_view({
+    'post': 'commit'
+})
+
 order_application_list = OrderApplicationListViewSet.as_view({
+    'get': 'list',
     'post': 'create',
     'delete': 'destroy'
 })
 
+contractor_application_list = ContractorApplicationListViewSet.as_view({
+    'get': 'list'
+})
+
 tags_list = TagViewSet.as_view({
     'get': 'list',
     'post': 'create'
@@ -77,6 +100,7 @@ user_notifications_settings_detail = UserNotificationsSettingsViewSet.as_view({
 urlpatterns = [
     url(r'^account/register', AccountRegistrationView.as_view(), name='account-register'),
     url(r'^account/login', AccountLoginView.as_view(), name='account-login'),
+    url(r'^account/token/refresh', AccountTokenRefreshView.as_view(), name='account-token-refresh'),
 
     url(r'^account/settings/notifications', user_notifications_settings_detail, name='account-settings-notifications'),
 
@@ -84,6 +108,9 @@ urlpatterns = [
     url(r'^orders/(?P<pk>[0-9]+)/$', order_detail, name='order-detail'),
     url(r'^orders/contractor/$', order_contractor_list, name='order-contractor-list'),
     url(r'^orders/customer/$', order_customer_list, name='order-customer-list'),
+    url(r'^orders/applications/$', contractor_application_list, name='contractor-application-list'),
+
+    url(r'^stats/$', MarketplaceStatsView.as_view(), name='marketplace-stats'),
 
     url(r'^tags/$', tags_list, name='tag-list'),
     url(r'^tags/search$', tags_list, name='tag-search'),
@@ -91,11 +118,30 @@ urlpatterns = [
     url(r'^orders/categories/$', order_category_list, name='order-category-list'),
     url(r'^orders/categories/(?P<pk>[0-9]+)/$', order_category_detail, name='order-category-detail'),
 
+    url(r'^orders/(?P<order_id>[0-9]+)/attachments/$', order_attachment_list, name='order-attachment-list'),
+    url(r'^orders/(?P<order_id>[0-9]+)/attachments/(?P<pk>[0-9]+)/$', order_attachment_detail,
+        name='order-attachment-detail'),
+    url(r'^orders/(?P<order_id>[0-9]+)/attachments/(?P<pk>[0-9]+)/download$', OrderAttachmentDownloadView.as_view(),
+        name='order-attachment-download'),
+    url(r'^orders/(?P<order_id>[0-9]+)/attachments/(?P<pk>[0-9]+)/previews/(?P<kind>[a-z_]+)$',
+        OrderAttachmentDownloadView.as_view(), name='order-attachment-preview'),
+
     url(r'^orders/(?P<order_id>[0-9]+)/applications/$', order_application_list, name='order-application-list'),
     url(r'^orders/(?P<order_id>[0-9]+)/applications/(?P<pk>[0-9]+)/status/$', OrderApplicationStatusDetailView.as_view(), name='order-application-status-detail'),
 
     url(r'^orders/(?P<order_id>[0-9]+)/chat/$', order_chat_detail, name='order-chat-list'),
     url(r'^orders/(?P<order_id>[0-9]+)/chat/messages/$', order_chat_messages_list, name='order-chat-messages-list'),
+    url(r'^orders/(?P<order_id>[0-9]+)/chat/attachments/(?P<pk>[0-9]+)/download$',
+        OrderChatAttachmentDownloadView.as_view(), name='order-chat-attachment-download'),
+    url(r'^orders/(?P<order_id>[0-9]+)/chat/attachments/(?P<pk>[0-9]+)/previews/(?P<kind>[a-z_]+)$',
+        OrderChatAttachmentDownloadView.as_view(), name='order-chat-attachment-preview'),
+    url(r'^orders/(?P<order_id>[0-9]+)/chat/uploads/$', order_chat_upload_list, name='order-chat-upload-list'),
+    url(r'^orders/(?P<order_id>[0-9]+)/chat/uploads/' + UPLOAD_ID + '/$', order_chat_upload_detail,
+        name='order-chat-upload-detail'),
+    url(r'^orders/(?P<order_id>[0-9]+)/chat/uploads/' + UPLOAD_ID + '/chunks/(?P<number>[0-9]+)$',
+        order_chat_upload_chunk, name='order-chat-upload-chunk'),
+    url(r'^orders/(?P<order_id>[0-9]+)/chat/uploads/' + UPLOAD_ID + '/commit$', order_chat_upload_commit,
+        name='order-chat-upload-commit'),
 
     url(r'notifications/mark_as_read', NotificationsMarkAsRead.as_view(), name='notifications-mark-as-read')
 ]
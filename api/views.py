@@ -1,11 +1,16 @@
-import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.utils import timezone
 from rest_framework import generics
-from rest_framework import permissions
 from rest_framework import status
 from rest_framework import viewsets
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.exceptions import PermissionDenied, NotAcceptable, NotFound, ParseError
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied, NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
@@ -13,21 +18,34 @@ from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.views import APIView
 
 from anon_fl import notify_api
-from anon_fl import settings
-from anon_fl.paginators import EnlargedResultsSetPagination
-from api import models
-from api.permissions import IsSuperUserOrReadOnly, IsOrderChatParticipant, IsOrderOwner
+from anon_fl.db.router import ReplicaReadsMixin, stick_to_primary
+from anon_fl.paginators import EnlargedResultsSetPagination, CreatedAtCursorPagination
+from anon_fl.streaming import StreamingListMixin
+from api.actions import save_chat_message, commit_chat_upload, apply_to_order, change_application_status, \
+    withdraw_application
+from api.authentication import CachedTokenAuthentication, JWTAuthentication, JWT_REFRESH, decode_jwt, issue_jwt
+from api import models, stats, storage, uploads
+from api.downloads import IgnoreClientContentNegotiation, attachment_response, preview_response
+from api.permissions import IsSuperUserOrReadOnly, IsOrderChatParticipant, IsOrderOwner, \
+    IsOrderAttachmentParticipant
+from api.previews import with_previews
 from api.serializers import OrderListSerializer, OrderCreateSerializer, OrderAttachmentSerializer, \
     OrderCategorySerializer, \
     OrderDetailSerializer, OrderChatDetailSerializer, OrderChatMessageListSerializer, \
-    AccountRegisterSerializer, TagSerializer, OrderApplicationListSerializer, UserNotificationsSettingsDetailSerializer
-from api.models import Order, OrderAttachment, OrderCategory, OrderChat, OrderChatMessage, Tag, OrderTag, \
-    OrderApplication, UserNotificationsSettings
+    AccountRegisterSerializer, TagSerializer, OrderApplicationListSerializer, UserNotificationsSettingsDetailSerializer, \
+    ContractorApplicationListSerializer, UploadSessionSerializer
+from api.models import Order, OrderAttachment, OrderCategory, OrderChat, OrderChatMessage, OrderChatAttachment, Tag, \
+    OrderTag, OrderApplication, UserNotificationsSettings, UploadChunk, UploadSession
+from api.tasks import queue_previews
 
 
 class AccountRegistrationView(generics.CreateAPIView):
     serializer_class = AccountRegisterSerializer
 
+    def perform_create(self, serializer):
+        # the new user's first requests read their token and settings
+        stick_to_primary(serializer.save().id)
+
 
 class AccountLoginView(APIView):
     serializer_class = AuthTokenSerializer
@@ -37,23 +55,50 @@ class AccountLoginView(APIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
-        jwt.encode({'user_id': user.id}, settings.JWT_SECRET)
-        return Response({
-            'jwt': '',
+        if created:
+            stick_to_primary(user.id)
+        return Response(dict(issue_jwt(user), **{
             'token': token.key,
             'email': user.email,
             'username': user.username,
             'id': user.id
-        })
+        }))
+
+
+class AccountTokenRefreshView(APIView):
+    # refresh token in the body is the only credential, an expired access token in the header must not fail it
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get_authenticate_header(self, request):
+        # invalid refresh token is 401 with a challenge, not 403
+        return JWTAuthentication().authenticate_header(request)
+
+    def post(self, request):
+        """
+        Exchanges refresh token for new access and refresh tokens
+        """
+        payload = decode_jwt(request.data.get('jwt_refresh', ''), JWT_REFRESH)
+
+        # the only query of jwt flow: deactivated users must not get new access tokens
+        try:
+            user = User.objects.get(id=payload['user_id'], is_active=True)
+        except User.DoesNotExist:
+            raise AuthenticationFailed
 
+        return Response(issue_jwt(user))
 
-class OrderViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+
+class OrderViewSet(ReplicaReadsMixin, StreamingListMixin, viewsets.ModelViewSet):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
 
     def get_queryset(self):
         category = self.request.query_params.get('category', None)
         queryset = Order.objects.order_by('-updated_at') \
-            .select_related('category').prefetch_related('order_tag')
+            .select_related('category', 'customer', 'contractor').prefetch_related('order_tag__tag')
+        if self.action != 'list':
+            queryset = queryset.prefetch_related(Prefetch('attachments',
+                                                          queryset=with_previews(OrderAttachment.objects.all())))
 
         filter = {}
 
@@ -94,10 +139,10 @@ class OrderViewSet(viewsets.ModelViewSet):
         serializer.save(customer=self.request.user)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
 
     def get_permissions(self):
         if self.action == 'create':
@@ -126,13 +171,56 @@ class TagViewSet(viewsets.ModelViewSet):
         })
 
 
+# lists depend on the caller, the site response cache is keyed by URL only
+@method_decorator(never_cache, name='dispatch')
 class OrderAttachmentViewSet(viewsets.ModelViewSet):
-    queryset = OrderAttachment.objects.all()
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     serializer_class = OrderAttachmentSerializer
-    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    permission_classes = (IsAuthenticated, IsOrderAttachmentParticipant)
+
+    def get_queryset(self):
+        return with_previews(OrderAttachment.objects.filter(order_id=self.order.id)).order_by('id')
 
+    def create(self, request, *args, **kwargs):
+        """
+        Customer uploads file as raw request body, file name is passed in `filename` query parameter.
+        Body is streamed to attachment storage, never read into memory as a whole
+        """
+        filename = request.query_params.get('filename')
+        if not filename:
+            raise ValidationError({'filename': 'This field is required.'})
+        if request.stream is None:
+            raise ValidationError({'file': 'Request body is empty.'})
 
-class OrderCategoryViewSet(viewsets.ModelViewSet):
+        try:
+            with storage.upload(storage.read_chunks(request.stream), settings.ATTACHMENT_MAX_SIZE) as blob, \
+                    transaction.atomic():
+                stored = storage.store(blob)
+                attachment = OrderAttachment.objects.create(order_id=self.order.id, customer_id=request.user.id,
+                                                            filename=filename, hash=blob.hash,
+                                                            url=storage.blob_url(blob.hash))
+                queue_previews(stored, filename)
+        except storage.UploadTooLarge:
+            return Response({'file': 'File is larger than {0} bytes.'.format(settings.ATTACHMENT_MAX_SIZE)},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        return Response(self.get_serializer(attachment).data, status=status.HTTP_201_CREATED)
+
+
+class OrderAttachmentDownloadView(APIView):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated, IsOrderAttachmentParticipant)
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+        attachment = get_object_or_404(OrderAttachment.objects.only('hash', 'filename'), id=kwargs['pk'],
+                                       order_id=self.order.id)
+        if 'kind' in kwargs:
+            return preview_response(request, attachment.hash, kwargs['kind'])
+        return attachment_response(request, attachment.hash, attachment.filename)
+
+
+class OrderCategoryViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = OrderCategory.objects.all()
     serializer_class = OrderCategorySerializer
     permission_classes = (IsSuperUserOrReadOnly,)
@@ -156,8 +244,8 @@ class OrderCategoryViewSet(viewsets.ModelViewSet):
         return super().finalize_response(request, response, *args, **kwargs)
 
 
-class OrderCustomerListViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class OrderCustomerListViewSet(ReplicaReadsMixin, StreamingListMixin, viewsets.ModelViewSet):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
     serializer_class = OrderListSerializer
 
@@ -165,9 +253,9 @@ class OrderCustomerListViewSet(viewsets.ModelViewSet):
         return Order.objects.filter(customer=self.request.user)
 
 
-class OrderContractorListViewSet(viewsets.ModelViewSet):
+class OrderContractorListViewSet(ReplicaReadsMixin, StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     serializer_class = OrderListSerializer
 
     def get_queryset(self):
@@ -175,91 +263,169 @@ class OrderContractorListViewSet(viewsets.ModelViewSet):
 
 
 class OrderChatDetailViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     queryset = OrderChat.objects.all()
     serializer_class = OrderChatDetailSerializer
-    permissions_classes = (IsAuthenticated, IsOrderChatParticipant,)
+    permission_classes = (IsAuthenticated, IsOrderChatParticipant,)
 
     def retrieve(self, request, *args, **kwargs):
-        queryset = OrderChat.objects.all()
-        order_chat = get_object_or_404(queryset, order_id=self.kwargs['order_id'])
+        order_chat = get_object_or_404(self.queryset, id=self.participants.chat_id)
         serializer = OrderChatDetailSerializer(order_chat)
         return Response(serializer.data)
 
 
-class OrderChatMessageListViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class OrderChatMessageListViewSet(StreamingListMixin, viewsets.ModelViewSet):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     serializer_class = OrderChatMessageListSerializer
-    permissions_classes = (IsAuthenticated, IsOrderChatParticipant,)
+    permission_classes = (IsAuthenticated, IsOrderChatParticipant,)
     pagination_class = EnlargedResultsSetPagination
 
     def get_queryset(self):
-        order_id = self.kwargs['order_id']
+        attachments = Prefetch('messages_attachments', queryset=with_previews(OrderChatAttachment.objects.all()))
+        return OrderChatMessage.objects.filter(chat_id=self.participants.chat_id)\
+            .prefetch_related(attachments).order_by('-id')
 
-        order = Order.objects.get(id=order_id)
-        if self.request.user.id not in [order.customer_id, order.contractor_id]:
-            raise PermissionDenied
-
-        chat = get_object_or_404(OrderChat.objects.all(), order_id=order_id)
-        return OrderChatMessage.objects.filter(chat_id=chat.id).order_by('-id')
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['order_id'] = self.participants.order_id
+        return context
 
     def perform_create(self, serializer):
-        order_id = self.kwargs['order_id']
-        sender_id = self.request.user.id
+        data, receivers = save_chat_message(serializer, self.participants, self.request.user.id)
+        notify_api.notify(receivers, self.participants.chat_id, notify_api.ORDER_CHAT_NEW_MESSAGE, data)
 
-        order = Order.objects.get(id=order_id)
-        if sender_id not in [order.customer_id, order.contractor_id]:
-            raise PermissionDenied
+    def read(self, request, *args, **kwargs):
+        OrderChatMessage.objects.filter(chat_id=self.participants.chat_id).update(is_read=True)
+        return Response({'status': 'ok'})
 
-        order_chat = OrderChat.objects.get(order=order_id)
-        serializer.save(chat_id=order_chat.id, sender_id=sender_id)
 
-        order_chat.messages_count += 1
-        order_chat.save()
+class OrderChatAttachmentDownloadView(APIView):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated, IsOrderChatParticipant)
+    content_negotiation_class = IgnoreClientContentNegotiation
 
-        data = serializer.data
-        data['order_title'], data['order_id'] = order.title, order.id
-        receiver = list(filter(lambda _id: _id != sender_id, [order.contractor_id, order.customer_id]))
-        notify_api.notify(receiver, order_chat.id, notify_api.ORDER_CHAT_NEW_MESSAGE, data)
+    def get(self, request, *args, **kwargs):
+        attachment = get_object_or_404(OrderChatAttachment.objects.only('hash', 'filename'), id=kwargs['pk'],
+                                       message__chat_id=self.participants.chat_id)
+        if 'kind' in kwargs:
+            return preview_response(request, attachment.hash, kwargs['kind'])
+        return attachment_response(request, attachment.hash, attachment.filename)
 
-    def read(self, request, *args, **kwargs):
-        order_id = kwargs['order_id']
-        order_chat = OrderChat.objects.get(order_id=order_id)
-        OrderChatMessage.objects.filter(chat_id=order_chat.id).update(is_read=True)
-        return Response({'status': 'ok'})
 
+# received chunks must be current, resumed upload sends the missing ones
+@method_decorator(never_cache, name='dispatch')
+class OrderChatUploadViewSet(viewsets.GenericViewSet):
+    """
+    Resumable upload of a chat attachment by a chat participant (api/uploads.py):
+
+    - POST uploads/ with filename, size and sha1 hash starts a session, response gives chunk_size and chunks_count
+    - PUT uploads/<id>/chunks/<number> with raw chunk body, optionally X-Chunk-Hash with its sha1.
+      Chunks are sent in any order and in parallel, a failed one is sent again
+    - GET uploads/<id>/ lists received chunks, so an interrupted upload is resumed with the missing ones
+    - POST uploads/<id>/commit with optional message posts the file to the chat
+    """
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsAuthenticated, IsOrderChatParticipant)
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(chat_id=self.participants.chat_id, user_id=self.request.user.id)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = serializer.save(chat_id=self.participants.chat_id, user_id=request.user.id,
+                                  chunk_size=settings.UPLOAD_CHUNK_SIZE)
+        uploads.allocate(session)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def destroy(self, request, *args, **kwargs):
+        self.get_object().delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def chunk(self, request, *args, **kwargs):
+        session = self.get_object()
+        number = int(kwargs['number'])
+        if number >= session.chunks_count:
+            raise ValidationError({'chunk': 'Session has {0} chunks.'.format(session.chunks_count)})
+        if request.stream is None:
+            raise ValidationError({'chunk': 'Request body is empty.'})
+
+        try:
+            uploads.write_chunk(session, number, storage.read_chunks(request.stream),
+                                request.META.get('HTTP_X_CHUNK_HASH'))
+        except uploads.ChunkMismatch as e:
+            raise ValidationError({'chunk': str(e)})
+        except FileNotFoundError:
+            raise NotFound({'upload': 'Upload session is committed or expired'})
+
+        with transaction.atomic():
+            # row lock orders the chunk with commit and garbage collection of the session
+            if not UploadSession.objects.filter(id=session.id).update(updated_at=timezone.now()):
+                raise NotFound({'upload': 'Upload session is committed or expired'})
+            UploadChunk.objects.get_or_create(session_id=session.id, number=number)
+
+        return Response(self.get_serializer(session).data)
+
+    def commit(self, request, *args, **kwargs):
+        session = self.get_object()
+        serializer = OrderChatMessageListSerializer(data={'message': request.data.get('message') or session.filename},
+                                                    context={'order_id': self.participants.order_id})
+        serializer.is_valid(raise_exception=True)
+
+        missing = set(range(session.chunks_count)) - set(session.chunks.values_list('number', flat=True))
+        if missing:
+            return Response({'chunks': sorted(missing)}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            path = uploads.take(session.id)
+            matches = uploads.file_hash(path) == session.hash
+        except FileNotFoundError:
+            raise NotFound({'upload': 'Upload session is committed or expired'})
+
+        if not matches:
+            session.delete()
+            raise ValidationError({'hash': 'Uploaded file does not match its hash, upload it again.'})
 
-class OrderApplicationListViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+        data, receivers = commit_chat_upload(session, path, serializer, self.participants)
+        notify_api.notify(receivers, self.participants.chat_id, notify_api.ORDER_CHAT_NEW_MESSAGE, data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(never_cache, name='dispatch')
+class OrderApplicationListViewSet(StreamingListMixin, viewsets.ModelViewSet):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     serializer_class = OrderApplicationListSerializer
     queryset = OrderApplication.objects.all()
     permission_classes = (IsAuthenticated, )
+    pagination_class = EnlargedResultsSetPagination
 
-    def create(self, request, *args, **kwargs):
+    def list(self, request, *args, **kwargs):
         """
-        Customer applies for order
+        Customer's inbox of order applications, filtered by comma separated `status` values
         """
-        order_id = kwargs['order_id']
-        applicant_id = self.request.user.id
-        order = Order.objects.filter(id=order_id).get()
-
-        if order.customer_id == applicant_id:
-            return Response({'application': 'Cannot apply to own order'}, status=status.HTTP_409_CONFLICT)
-
-        if not order:
-            return Response({'order': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
+        order = get_object_or_404(Order.objects.only('id', 'customer_id'), id=kwargs['order_id'])
+        if order.customer_id != request.user.id:
+            raise PermissionDenied
 
-        if order.contractor_id is not None:
-            return Response({'order': 'Order already has contractor. Applications are no longer accepted'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        queryset = OrderApplication.objects.filter(order_id=order.id).select_related('applicant').order_by('-id')
 
-        application, created = OrderApplication.objects.get_or_create(order_id=order_id, applicant_id=applicant_id)
+        statuses = request.query_params.get('status', None)
+        if statuses:
+            queryset = queryset.filter(status__in=[value for value in statuses.split(',') if value.isdigit()])
+        else:
+            queryset = queryset.exclude(status=models.ApplicationStatus.WITHDRAWN.value)
 
-        if not application:
-            return ParseError
+        return self.paginated_list(queryset)
 
-        serialized = OrderApplicationListSerializer(application).data
-        serialized['order_title'] = order.title
+    def create(self, request, *args, **kwargs):
+        """
+        Customer applies for order
+        """
+        order, serialized = apply_to_order(kwargs['order_id'], self.request.user.id)
         notify_api.notify([order.customer_id], order.id, notify_api.ORDER_APPLICATION_REQUEST_RECEIVED, serialized)
         return Response(serialized)
 
@@ -267,68 +433,45 @@ class OrderApplicationListViewSet(viewsets.ModelViewSet):
         """
         Customer withdraws application
         """
-        order_id = kwargs['order_id']
-        applicant_id = self.request.user.id
-
-        try:
-            application = OrderApplication.objects.get(applicant_id=applicant_id, order_id=order_id)
-        except models.OrderApplication.DoesNotExist:
-            raise NotFound
-
-        if application.status == models.ApplicationStatus.ACCEPTED.value:
-            raise NotAcceptable
-
-        application.status = models.ApplicationStatus.WITHDRAWN.value
-        application.save()
-
+        application = withdraw_application(kwargs['order_id'], self.request.user.id)
         return Response(OrderApplicationListSerializer(application).data)
 
 
-class OrderApplicationStatusDetailView(generics.UpdateAPIView, generics.DestroyAPIView):
-    authentication_classes = (TokenAuthentication,)
+@method_decorator(never_cache, name='dispatch')
+class ContractorApplicationListViewSet(viewsets.ModelViewSet):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ContractorApplicationListSerializer
+    pagination_class = CreatedAtCursorPagination
 
-    def update(self, request, *args, **kwargs):
+    def get_queryset(self):
         """
-        Customer accepts or declines application
+        Applications of current user with order summaries in a single query,
+        filtered by comma separated `status` values
         """
-        order_id = kwargs['order_id']
-        application_id = kwargs['pk']
-        application_status = request.data.get('status')
-
-        permitted_statuses = [models.ApplicationStatus.ACCEPTED.value, models.ApplicationStatus.DECLINED.value]
-        order = Order.objects.get(id=order_id)
-        if order.customer_id != self.request.user.pk \
-                or application_status not in permitted_statuses \
-                or order.contractor_id is not None:
-            raise PermissionDenied
-
-        application = OrderApplication.objects.get(id=application_id)
-
-        if application_status == models.ApplicationStatus.ACCEPTED.value:
-            order.status = models.OrderStatus.IN_PROCESS.value
-            order.contractor_id = application.applicant_id
-            order.save()
+        queryset = OrderApplication.objects.filter(applicant_id=self.request.user.id)\
+            .select_related('order', 'order__category')
 
-            OrderChat.objects.create(order_id=order_id)
+        statuses = self.request.query_params.get('status', None)
+        if statuses:
+            queryset = queryset.filter(status__in=[value for value in statuses.split(',') if value.isdigit()])
 
-        application.status = application_status
-        application.save()
+        return queryset
 
-        if application.status == models.ApplicationStatus.ACCEPTED.value:
-            key = notify_api.ORDER_APPLICATION_APPROVED
-        else:
-            key = notify_api.ORDER_APPLICATION_DECLINED
-
-        serialized = OrderApplicationListSerializer(application).data
-        serialized['order_title'] = order.title
 
-        notify_api.notify([application.applicant_id], order.id, key, serialized)
+class OrderApplicationStatusDetailView(generics.UpdateAPIView, generics.DestroyAPIView):
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
 
-        return Response(serialized)
+    def update(self, request, *args, **kwargs):
+        """
+        Customer accepts or declines application. Accepting declines all other new applications of the order
+        """
+        return Response(change_application_status(request.user.pk, kwargs['order_id'], kwargs['pk'],
+                                                  request.data.get('status')))
 
 
 class UserNotificationsSettingsViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
     serializer_class = UserNotificationsSettingsDetailSerializer
     queryset = UserNotificationsSettings.objects.all()
 
@@ -347,8 +490,22 @@ class UserNotificationsSettingsViewSet(viewsets.ModelViewSet):
 
 
 class NotificationsMarkAsRead(APIView):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (JWTAuthentication, CachedTokenAuthentication)
 
     def post(self, request):
         notify_api.read_notifications(request.user.id)
         return Response({'status': 'ok'})
+
+
+class MarketplaceStatsView(APIView):
+    """
+    Public marketplace statistics. Read from the summary maintained by api.tasks.update_marketplace_stats,
+    so the response costs a couple of small queries and is cached for STATS_CACHE_SECONDS
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        response = Response(stats.summary())
+        patch_cache_control(response, public=True, max_age=settings.STATS_CACHE_SECONDS)
+        return response
@@ -0,0 +1,37 @@
+"""
+Celery worker profiles (CELERY_WORKER_PROFILES). Prints `celery worker` arguments of a profile,
+run_celery.sh starts the worker with them:
+
+    celery worker -A api.celeryconf $(python -m api.workers previews)
+"""
+import os
+import sys
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "anon_fl.settings")
+
+
+def worker_arguments(name, profile):
+    arguments = ['-Q', ','.join(profile['queues']), '-n', '{0}@%h'.format(name),
+                 '--concurrency', str(profile['concurrency']),
+                 '--prefetch-multiplier', str(profile['prefetch_multiplier'])]
+    if profile.get('fair'):
+        arguments += ['-O', 'fair']
+    if profile.get('max_tasks_per_child'):
+        arguments += ['--max-tasks-per-child', str(profile['max_tasks_per_child'])]
+    return arguments
+
+
+def main(argv=None):
+    from django.conf import settings
+
+    argv = sys.argv[1:] if argv is None else argv
+    name = argv[0] if argv else 'all'
+    if name not in settings.CELERY_WORKER_PROFILES:
+        sys.exit('unknown worker profile {0}, expected one of {1}'.format(
+            name, ', '.join(sorted(settings.CELERY_WORKER_PROFILES))))
+
+    print(' '.join(worker_arguments(name, settings.CELERY_WORKER_PROFILES[name])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Offline benchmarks. Every module is runnable with `python -m benchmarks.<name>` from the project root
+"""
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "anon_fl.settings")
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database(keepdb=False):
+    """
+    Runs benchmark against a separate test database, so configured database is never touched
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+@contextmanager
+def configured_database():
+    """
+    Runs benchmark against configured database as is, e.g. the one filled by `manage.py generate_data`.
+    Scenarios write to it
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    try:
+        yield connection
+    finally:
+        teardown_test_environment()
+
+
+class Timer:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.started
+
+
+def report(name, count, elapsed):
+    print('{0}: {1} in {2:.3f}s, {3:.1f}/s'.format(name, count, elapsed, count / elapsed if elapsed else 0))
@@ -0,0 +1,92 @@
+"""
+Concurrent request capacity of a single process: sync gunicorn worker, threaded gunicorn worker and ASGI
+application under uvicorn, on chat send and notifications mark-as-read with a slow notify service stand-in:
+
+    python -m benchmarks.asgi --concurrency 64 --notify-delay 0.2
+
+uvicorn has to be installed (Python 3.6+)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+from benchmarks import setup_django, test_database
+from benchmarks.workers import NOTIFY_PORT, PORT, load, start_notify
+
+SERVERS = {
+    'sync': ['gunicorn', '-c', 'anon_fl/gunicorn_conf.py', 'anon_fl.wsgi:application'],
+    'gthread': ['gunicorn', '-c', 'anon_fl/gunicorn_conf.py', 'anon_fl.wsgi:application'],
+    'asgi': ['uvicorn', 'anon_fl.asgi:application', '--host', '127.0.0.1', '--port', str(PORT), '--workers', '1',
+             '--no-access-log'],
+}
+
+
+def start_server(name, database):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=name, GUNICORN_WORKERS='1',
+               GUNICORN_BIND='127.0.0.1:{0}'.format(PORT), DB_NAME=database,
+               NOTIFY_SERVICE_HOST='http://127.0.0.1', NOTIFY_SERVICE_PORT=str(NOTIFY_PORT))
+    process = subprocess.Popen(SERVERS[name], env=env)
+
+    for _ in range(100):
+        try:
+            requests.get('http://127.0.0.1:{0}/orders/categories/'.format(PORT), timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError('{0} server did not start'.format(name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', default='sync,gthread,asgi')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--notify-delay', type=float, default=0.2, help='seconds the notify stand-in waits')
+    parser.add_argument('--orders', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from rest_framework.authtoken.models import Token
+    from benchmarks.dataset import seed
+
+    start_notify(args.notify_delay)
+    base = 'http://127.0.0.1:{0}'.format(PORT)
+
+    with test_database() as connection:
+        dataset = seed(orders=args.orders)
+        connection.close()
+
+        headers = {'Authorization': 'Token ' + Token.objects.get(user=dataset.contractor).key}
+        chat_url = '{0}/orders/{1}/chat/messages/'.format(base, dataset.chat_order.id)
+        scenarios = {
+            'chat-send': lambda session: session.post(chat_url, json={'message': 'Benchmark'}, headers=headers),
+            'mark-as-read': lambda session: session.post(base + '/notifications/mark_as_read', json={},
+                                                         headers=headers),
+        }
+
+        print('{0:8} {1:13} {2:>8} {3:>8} {4:>8} {5:>6}'.format('server', 'scenario', 'rps', 'p50 ms', 'p99 ms',
+                                                               'errors'))
+        results = {}
+        for name in args.servers.split(','):
+            process = start_server(name, connection.settings_dict['NAME'])
+            try:
+                for scenario, request in scenarios.items():
+                    result = results.setdefault(name, {})[scenario] = load(request, args.concurrency, args.duration)
+                    print('{0:8} {1:13} {rps:8.1f} {p50:8.1f} {p99:8.1f} {errors:6}'.format(name, scenario,
+                                                                                          **result))
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
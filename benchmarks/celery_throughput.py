@@ -0,0 +1,148 @@
+"""
+Celery task throughput: a task per item versus items buffered by api.batching and processed by one task per batch,
+at several worker prefetch multipliers. kombu in-memory transport stands in for RabbitMQ and a dict stands in for
+redis, and the worker runs in this process, so no broker, redis or database is required:
+
+    python -m benchmarks.celery_throughput --items 20000 --batch-size 100 --prefetch 1,4,16
+
+Without network round trips the numbers show celery's own per-message cost, which is the floor batching removes;
+with a real broker every message also pays publish and ack latency
+"""
+import argparse
+import json
+import sys
+import threading
+from collections import defaultdict
+
+from benchmarks import setup_django, Timer
+
+
+class MemoryRedis:
+    """
+    Commands used by api.batching.Batch, on dicts
+    """
+    def __init__(self):
+        self.lists = defaultdict(list)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def rpush(self, key, *values):
+        with self.lock:
+            self.lists[key].extend(value.encode() if isinstance(value, str) else value for value in values)
+            return len(self.lists[key])
+
+    def lpush(self, key, *values):
+        with self.lock:
+            for value in values:
+                self.lists[key].insert(0, value)
+            return len(self.lists[key])
+
+    def llen(self, key):
+        return len(self.lists[key])
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and key in self.values:
+                return None
+            self.values[key] = value
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+            self.lists.pop(key, None)
+
+    def pipeline(self):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def lrange(self, key, start, end):
+        self.commands.append(lambda items: items[key][start:end + 1 if end != -1 else None])
+
+    def ltrim(self, key, start, end):
+        def ltrim(items):
+            items[key] = items[key][start:end + 1 if end != -1 else None]
+            return True
+        self.commands.append(ltrim)
+
+    def execute(self):
+        with self.redis.lock:
+            return [command(self.redis.lists) for command in self.commands]
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.processed = 0
+        self.done = threading.Event()
+
+    def add(self, count):
+        self.processed += count
+        if self.processed >= self.total:
+            self.done.set()
+
+
+def run(name, publish, progress, app, prefetch_multiplier):
+    from celery.contrib.testing.worker import start_worker
+
+    with start_worker(app, pool='solo', perform_ping_check=False, prefetch_multiplier=prefetch_multiplier):
+        with Timer() as total:
+            with Timer() as published:
+                publish()
+            if not progress.done.wait(600):
+                raise RuntimeError('{0}: processed {1} of {2}'.format(name, progress.processed, progress.total))
+
+    return {'publish_s': published.elapsed, 'total_s': total.elapsed,
+            'items_per_s': progress.total / total.elapsed if total.elapsed else 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--prefetch', default='1,4,16', help='worker prefetch multipliers')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.conf import settings
+    settings.BROKER_URL = 'memory://'
+    settings.CELERY_RESULT_BACKEND = 'cache+memory://'
+
+    from api.batching import batch_task
+    from api.celeryconf import app
+
+    redis = MemoryRedis()
+    state = {}
+
+    @app.task(name='benchmarks.celery_throughput.item')
+    def item(value):
+        state['progress'].add(1)
+
+    @batch_task(key='benchmark', size=args.batch_size, delay=0, client=lambda: redis)
+    def batched(values):
+        state['progress'].add(len(values))
+
+    scenarios = {
+        'task-per-item': lambda: [item.delay(value) for value in range(args.items)],
+        'batched': lambda: [batched.add(value) for value in range(args.items)],
+    }
+
+    print('{0:14} {1:>8} {2:>10} {3:>9} {4:>10}'.format('scenario', 'prefetch', 'publish s', 'total s', 'items/s'))
+    results = {}
+    for prefetch in map(int, args.prefetch.split(',')):
+        for name, publish in scenarios.items():
+            state['progress'] = Progress(args.items)
+            result = results.setdefault(name, {})[prefetch] = run(name, publish, state['progress'], app, prefetch)
+            print('{0:14} {1:8} {publish_s:10.3f} {total_s:9.3f} {items_per_s:10.0f}'.format(name, prefetch,
+                                                                                             **result))
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Response compression: size and CPU time per gzip level and brotli quality on real list and detail bodies,
+then request latency of compressed responses on cache miss and cache hit:
+
+    python -m benchmarks.compression --orders 10000 --repeat 50
+"""
+import argparse
+import json
+import sys
+import zlib
+
+from benchmarks import setup_django, test_database, Timer
+from benchmarks.endpoints import percentile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVELS = (1, 4, 6, 9)
+BROTLI_QUALITIES = (1, 4, 5, 7, 11)
+
+
+def compressors():
+    for level in GZIP_LEVELS:
+        yield 'gzip-{0}'.format(level), lambda data, level=level: zlib.compress(data, level)
+    if brotli is not None:
+        for quality in BROTLI_QUALITIES:
+            yield 'br-{0}'.format(quality), lambda data, quality=quality: brotli.compress(data, quality=quality)
+
+
+def bench_levels(bodies, repeat):
+    print('{0:12} {1:10} {2:>9} {3:>9} {4:>7} {5:>9}'.format('body', 'codec', 'raw KiB', 'out KiB', 'ratio',
+                                                             'cpu ms'))
+    results = {}
+    for name, body in bodies.items():
+        for codec, compress in compressors():
+            with Timer() as timer:
+                for _ in range(repeat):
+                    compressed = compress(body)
+            result = results.setdefault(name, {})[codec] = {
+                'raw': len(body) / 1024,
+                'out': len(compressed) / 1024,
+                'ratio': len(body) / len(compressed),
+                'cpu': timer.elapsed / repeat * 1000,
+            }
+            print('{0:12} {1:10} {raw:9.1f} {out:9.1f} {ratio:7.2f} {cpu:9.3f}'.format(name, codec, **result))
+    return results
+
+
+def bench_requests(client, path, repeat):
+    """
+    p50 latency of the first (cache miss) and following (cache hit) requests for every encoding
+    """
+    from django.core.cache import cache
+
+    print('{0:10} {1:>8} {2:>10} {3:>10}'.format('encoding', 'KiB', 'miss ms', 'hit ms'))
+    results = {}
+    for encoding in ('identity', 'gzip', 'br'):
+        misses, hits = [], []
+        for _ in range(repeat):
+            cache.clear()
+            for latencies in (misses, hits):
+                with Timer() as timer:
+                    response = client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+                latencies.append(timer.elapsed * 1000)
+
+        result = results[encoding] = {
+            'size': len(response.content) / 1024,
+            'miss': percentile(misses, 50),
+            'hit': percentile(hits, 50),
+        }
+        print('{0:10} {size:8.1f} {miss:10.2f} {hit:10.2f}'.format(encoding, **result))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.test import Client, override_settings
+    from benchmarks.dataset import seed
+
+    with test_database(), \
+            override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+        dataset = seed(orders=args.orders)
+        client = Client()
+
+        paths = {
+            'order-list': '/orders/',
+            'order-list-40': '/orders/?page_size=40',
+            'order-detail': '/orders/{0}/'.format(dataset.open_order.id),
+        }
+        bodies = {name: client.get(path, HTTP_ACCEPT_ENCODING='identity').content for name, path in paths.items()}
+
+        results = {'levels': bench_levels(bodies, args.repeat), 'requests': {}}
+        for name, path in paths.items():
+            print(name)
+            results['requests'][name] = bench_requests(client, path, args.repeat)
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
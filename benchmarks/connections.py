@@ -0,0 +1,83 @@
+"""
+Database connection handling: raw connections/sec with and without pool, and latency of a cheap endpoint
+(/orders/categories/) with CONN_MAX_AGE = 0, persistent connections and the pooled backend.
+Every mode runs in its own process, because database engine is chosen at settings import:
+
+    python -m benchmarks.connections --requests 2000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import setup_django, test_database, Timer, report
+from benchmarks.endpoints import percentile
+
+MODES = {
+    'no-persistence': {'DB_CONN_MAX_AGE': '0'},
+    'persistent': {'DB_CONN_MAX_AGE': '300'},
+    'pool': {'DB_POOL': '1'},
+}
+
+
+def bench_connect(count):
+    from django.db import connection
+
+    with Timer() as timer:
+        for _ in range(count):
+            connection.ensure_connection()
+            connection.close()
+    report('connect/close', count, timer.elapsed)
+    return count / timer.elapsed
+
+
+def bench_requests(count):
+    from rest_framework.test import APIClient
+    from api.models import OrderCategory
+
+    OrderCategory.objects.bulk_create([OrderCategory(title='Category {0}'.format(i)) for i in range(10)])
+    client = APIClient()
+    latencies = []
+
+    for _ in range(count):
+        with Timer() as timer:
+            client.get('/orders/categories/')
+        latencies.append(timer.elapsed * 1000)
+
+    return {'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99)}
+
+
+def run_mode(count):
+    setup_django()
+    from django.db import connection
+    from anon_fl.db.pooled.base import close_pools
+
+    with test_database():
+        result = {'connections_per_sec': bench_connect(count)}
+        result.update(bench_requests(count))
+        # test database can't be dropped while pool keeps connections to it
+        connection.close()
+        close_pools()
+    print(json.dumps(result))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--mode', choices=MODES.keys(), help='run single mode in this process')
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        return run_mode(args.requests)
+
+    print('{0:16} {1:>12} {2:>8} {3:>8}'.format('mode', 'connect/s', 'p50 ms', 'p99 ms'))
+    for mode, env in MODES.items():
+        output = subprocess.check_output([sys.executable, '-m', 'benchmarks.connections', '--mode', mode,
+                                          '--requests', str(args.requests)], env=dict(os.environ, **env))
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        print('{0:16} {connections_per_sec:12.1f} {p50:8.2f} {p99:8.2f}'.format(mode, **result))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
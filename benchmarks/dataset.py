@@ -0,0 +1,146 @@
+"""
+Synthetic dataset for endpoint benchmarks. Generation is deterministic for a given seed.
+
+`seed` fills an empty test database at benchmark scale, `load` picks the same handles from a database filled by
+`manage.py generate_data`
+"""
+import itertools
+import random
+import time
+
+BATCH_SIZE = 5000
+
+
+class Dataset:
+    """
+    Handles to rows the benchmark scenarios work with
+    """
+    customer = None
+    contractor = None
+    applicant = None
+    chat_order = None
+    open_order = None
+    category = None
+    tag = None
+    pending_applications = ()
+    login_user = None
+    login_password = 'johdoe123'
+    # prefix of usernames the registration scenario creates
+    username_prefix = 'bench'
+
+
+def bulk(model, rows):
+    """
+    Inserts rows of an iterable BATCH_SIZE at a time, so only one batch is kept in memory
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        model.objects.bulk_create(batch)
+
+
+def seed(users=1000, orders=10000, applications=3, messages=20, tags=200, pending=100, seed=0):
+    from django.contrib.auth.models import User
+    from api.models import OrderCategory, Tag, Order, OrderTag, OrderApplication, OrderChat, OrderChatMessage, \
+        UserNotificationsSettings, OrderStatus
+
+    rnd = random.Random(seed)
+    # every generated user has the same unusable password, hashing is benchmarked separately
+    bulk(User, (User(username='user{0}'.format(i), email='user{0}@example.com'.format(i), password='!')
+                for i in range(users)))
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    bulk(UserNotificationsSettings, (UserNotificationsSettings(user_id=user_id) for user_id in user_ids))
+
+    roots = [OrderCategory.objects.create(title='Category {0}'.format(i)) for i in range(10)]
+    bulk(OrderCategory, (OrderCategory(title='Subcategory {0}.{1}'.format(root.id, i), parent=root)
+                         for root in roots for i in range(5)))
+    category_ids = list(OrderCategory.objects.values_list('id', flat=True))
+
+    bulk(Tag, (Tag(tag='tag{0}'.format(i), created_by_id=user_ids[0]) for i in range(tags)))
+    tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def order(i):
+        customer_id = rnd.choice(user_ids)
+        # every tenth order has contractor and chat
+        contractor_id = None
+        if i % 10 == 0:
+            contractor_id = rnd.choice([user_id for user_id in rnd.sample(user_ids, 2) if user_id != customer_id])
+        return Order(title='Order {0}'.format(i), description='Описание заказа {0}. '.format(i) * 10,
+                     price=rnd.randint(100, 100000), category_id=rnd.choice(category_ids), customer_id=customer_id,
+                     contractor_id=contractor_id, applications_new_count=applications,
+                     status=(OrderStatus.IN_PROCESS if contractor_id else OrderStatus.PUBLISHED).value)
+
+    bulk(Order, (order(i) for i in range(orders)))
+    order_ids = Order.objects.order_by('id').values_list('id', flat=True)
+
+    bulk(OrderTag, (OrderTag(order_id=order_id, tag_id=tag_id)
+                    for order_id in order_ids.iterator() for tag_id in rnd.sample(tag_ids, 3)))
+    bulk(OrderApplication, (OrderApplication(order_id=order_id, applicant_id=rnd.choice(user_ids))
+                            for order_id in order_ids.iterator() for _ in range(applications)))
+
+    bulk(OrderChat, (OrderChat(order_id=order_id, messages_count=messages)
+                     for order_id in order_ids.filter(contractor__isnull=False).iterator()))
+    chats = OrderChat.objects.order_by('id').values_list('id', 'order__customer_id', 'order__contractor_id')
+    bulk(OrderChatMessage, (OrderChatMessage(chat_id=chat_id, message='Сообщение {0}'.format(i),
+                                             sender_id=rnd.choice(participants))
+                            for chat_id, *participants in chats.iterator() for i in range(messages)))
+
+    return handles(OrderChat.objects.order_by('id').first().order, user_ids[:pending + 2], pending)
+
+
+def load(pending=100):
+    """
+    Handles to rows of an already filled database, only benchmark's own rows are created
+    """
+    from django.contrib.auth.models import User
+    from api.models import OrderChat
+
+    chat = OrderChat.objects.select_related('order').filter(order__contractor__isnull=False).order_by('id').first()
+    if chat is None:
+        raise RuntimeError('Database has no chats, fill it with `manage.py generate_data` first')
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:pending + 2])
+
+    dataset = handles(chat.order, user_ids, pending)
+    # registered usernames must not clash with the ones of previous runs
+    dataset.username_prefix = 'bench{0}_'.format(int(time.time()))
+    return dataset
+
+
+def handles(chat_order, user_ids, pending):
+    """
+    Picks scenario rows and creates the ones scenarios change: open order with NEW applications, login user and
+    tokens
+    """
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+    from api.models import OrderCategory, Tag, Order, OrderApplication, ApplicationStatus
+
+    dataset = Dataset()
+    dataset.category = OrderCategory.objects.filter(parent__isnull=False).order_by('id').first()
+    dataset.tag = Tag.objects.order_by('id').first()
+    dataset.chat_order = chat_order
+    dataset.customer = User.objects.get(id=chat_order.customer_id)
+    dataset.contractor = User.objects.get(id=chat_order.contractor_id)
+    dataset.applicant = User.objects.exclude(id__in=[dataset.customer.id, dataset.contractor.id])\
+        .order_by('id').first()
+    dataset.open_order = Order.objects.create(title='Open order', description='Open order', price=1000,
+                                              category=dataset.category, customer=dataset.customer)
+
+    # NEW applications which status scenarios decline one by one
+    bulk(OrderApplication, (OrderApplication(order_id=dataset.open_order.id, applicant_id=user_id)
+                            for user_id in user_ids[:pending] if user_id != dataset.customer.id))
+    dataset.pending_applications = list(OrderApplication.objects.filter(
+        order_id=dataset.open_order.id, status=ApplicationStatus.NEW.value).order_by('id'))
+    Order.objects.filter(id=dataset.open_order.id).update(applications_new_count=len(dataset.pending_applications))
+
+    dataset.login_user = User.objects.filter(username='bench_login').first()
+    if dataset.login_user is None:
+        dataset.login_user = User.objects.create_user('bench_login', 'bench_login@example.com',
+                                                      dataset.login_password)
+
+    for user in (dataset.customer, dataset.contractor, dataset.applicant):
+        Token.objects.get_or_create(user=user)
+
+    return dataset
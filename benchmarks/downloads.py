@@ -0,0 +1,112 @@
+"""
+Attachment download throughput of a single gunicorn worker: file streamed by django versus X-Accel-Redirect
+hand-off, where the worker only checks permissions. With --nginx the hand-off is measured end to end through
+nginx configured with server/conf.d (ATTACHMENTS_ROOT has to be its /app/attachments):
+
+    python -m benchmarks.downloads --size-mb 10 --concurrency 8
+    python -m benchmarks.downloads --nginx http://127.0.0.1:8001
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from benchmarks import setup_django, test_database
+from benchmarks.workers import PORT, load
+
+
+def start_gunicorn(database, accel_prefix, root, worker_class):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS='1',
+               GUNICORN_BIND='127.0.0.1:{0}'.format(PORT), DB_NAME=database,
+               ATTACHMENTS_ACCEL_PREFIX=accel_prefix, ATTACHMENTS_ROOT=root)
+    process = subprocess.Popen(['gunicorn', '-c', 'anon_fl/gunicorn_conf.py', 'anon_fl.wsgi:application'], env=env)
+
+    for _ in range(100):
+        try:
+            requests.get('http://127.0.0.1:{0}/orders/categories/'.format(PORT), timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def create_attachment(size):
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from rest_framework.authtoken.models import Token
+    from api import storage
+    from api.models import Order, OrderAttachment, OrderCategory
+
+    customer = User.objects.create_user('customer', password='customer')
+    Token.objects.create(user=customer)
+    category = OrderCategory.objects.create(title='Category')
+    order = Order.objects.create(title='Order', description='Description', price=10, category=category,
+                                 customer=customer)
+
+    chunk = os.urandom(1024 * 1024)
+    chunks = (chunk[:size - offset] for offset in range(0, size, len(chunk)))
+    with storage.upload(chunks) as blob, transaction.atomic():
+        storage.store(blob)
+        attachment = OrderAttachment.objects.create(order=order, customer=customer, filename='deliverable.zip',
+                                                    hash=blob.hash, url=storage.blob_url(blob.hash))
+    return customer, order, attachment
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--nginx', help='base url of nginx in front of the worker')
+    parser.add_argument('--root', default=None, help='ATTACHMENTS_ROOT, temporary directory by default')
+    args = parser.parse_args(argv)
+
+    root = args.root or tempfile.mkdtemp()
+    os.environ['ATTACHMENTS_ROOT'] = root
+    setup_django()
+
+    size = int(args.size_mb * 1024 * 1024)
+    modes = [('django', '', 'http://127.0.0.1:{0}'.format(PORT)),
+             ('x-accel', '/protected-attachments/', 'http://127.0.0.1:{0}'.format(PORT))]
+    if args.nginx:
+        modes.append(('nginx', '/protected-attachments/', args.nginx))
+
+    with test_database() as connection:
+        customer, order, attachment = create_attachment(size)
+        headers = {'Authorization': 'Token ' + customer.auth_token.key}
+        connection.close()
+        path = '/orders/{0}/attachments/{1}/download'.format(order.id, attachment.id)
+
+        print('{0:8} {1:>8} {2:>9} {3:>8} {4:>8} {5:>6}'.format('mode', 'rps', 'MiB/s', 'p50 ms', 'p99 ms',
+                                                               'errors'))
+        results = {}
+        for mode, accel_prefix, base in modes:
+            process = start_gunicorn(connection.settings_dict['NAME'], accel_prefix, root, args.worker_class)
+            try:
+                def request(session):
+                    response = session.get(base + path, headers=headers, stream=True)
+                    for _ in response.iter_content(256 * 1024):
+                        pass
+                    return response
+
+                result = results[mode] = load(request, args.concurrency, args.duration)
+                # hand-off without nginx sends no body, only the rate of permission checks is meaningful
+                result['mibps'] = result['rps'] * size / 1024 / 1024 if mode != 'x-accel' else 0
+                print('{0:8} {rps:8.1f} {mibps:9.1f} {p50:8.1f} {p99:8.1f} {errors:6}'.format(mode, **result))
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
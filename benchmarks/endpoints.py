@@ -0,0 +1,208 @@
+"""
+Per-endpoint load benchmark. Seeds synthetic dataset in a test database, or with --generated uses the configured
+database filled by `manage.py generate_data`, drives every route of api/urls.py through Django test client and
+reports p50/p95/p99 latency, queries per request and throughput.
+
+    python -m benchmarks.endpoints --save benchmarks/results/baseline.json
+    python -m benchmarks.endpoints --generated --save benchmarks/results/baseline-generated.json
+    python -m benchmarks.endpoints --compare benchmarks/results/baseline.json
+
+Notify service calls and email queueing are replaced with no-ops, only the API process is measured
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
+from benchmarks import setup_django, test_database, configured_database, Timer
+
+# p95 growth over baseline which --compare reports as regression
+REGRESSION_THRESHOLD = 1.2
+
+
+class Scenario:
+    def __init__(self, name, method, path, user=None, data=None):
+        self.name = name
+        self.method = method
+        # path and data may depend on iteration number
+        self.path = path
+        self.user = user
+        self.data = data
+
+    def request(self, client, i):
+        path = self.path(i) if callable(self.path) else self.path
+        data = self.data(i) if callable(self.data) else self.data
+        if data is not None and self.method in ('post', 'put'):
+            return getattr(client, self.method)(path, data=json.dumps(data), content_type='application/json')
+        return getattr(client, self.method)(path, data)
+
+
+def scenarios(dataset):
+    from api.authentication import encode_jwt, JWT_REFRESH
+
+    order, chat_order, open_order = dataset.chat_order.id, dataset.chat_order.id, dataset.open_order.id
+    customer, contractor, applicant = dataset.customer, dataset.contractor, dataset.applicant
+    pending = dataset.pending_applications
+
+    return [
+        Scenario('account-register', 'post', '/account/register',
+                 data=lambda i: {'username': '{0}{1}'.format(dataset.username_prefix, i),
+                                 'email': '{0}{1}@example.com'.format(dataset.username_prefix, i),
+                                 'password': 'johdoe123'}),
+        Scenario('account-login', 'post', '/account/login',
+                 data={'username': dataset.login_user.username, 'password': dataset.login_password}),
+        Scenario('account-token-refresh', 'post', '/account/token/refresh',
+                 data={'jwt_refresh': encode_jwt(dataset.login_user, JWT_REFRESH)}),
+        Scenario('account-settings-notifications', 'get', '/account/settings/notifications', user=customer),
+        Scenario('order-list', 'get', '/orders/'),
+        Scenario('order-list-category', 'get', '/orders/', data={'category': dataset.category.id}),
+        Scenario('order-list-tag', 'get', '/orders/', data={'tag_id': dataset.tag.id}),
+        Scenario('order-detail', 'get', '/orders/{0}/'.format(order), user=customer),
+        Scenario('order-contractor-list', 'get', '/orders/contractor/', user=contractor),
+        Scenario('order-customer-list', 'get', '/orders/customer/', user=customer),
+        Scenario('contractor-application-list', 'get', '/orders/applications/', user=applicant),
+        Scenario('tag-list', 'get', '/tags/'),
+        Scenario('tag-search', 'get', '/tags/search', data={'q': 'tag1'}),
+        Scenario('order-category-list', 'get', '/orders/categories/'),
+        Scenario('order-category-detail', 'get', '/orders/categories/{0}/'.format(dataset.category.id)),
+        Scenario('order-application-list', 'get', '/orders/{0}/applications/'.format(open_order), user=customer),
+        Scenario('order-application-create', 'post', '/orders/{0}/applications/'.format(open_order), user=applicant),
+        Scenario('order-application-status-detail', 'put',
+                 lambda i: '/orders/{0}/applications/{1}/status/'.format(open_order, pending[i % len(pending)].id),
+                 user=customer, data={'status': 2}),
+        Scenario('order-chat-list', 'get', '/orders/{0}/chat/'.format(chat_order), user=customer),
+        Scenario('order-chat-messages-list', 'get', '/orders/{0}/chat/messages/'.format(chat_order), user=customer),
+        Scenario('order-chat-messages-create', 'post', '/orders/{0}/chat/messages/'.format(chat_order),
+                 user=contractor, data={'message': 'Benchmark message'}),
+        Scenario('notifications-mark-as-read', 'post', '/notifications/mark_as_read', user=customer),
+    ]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def client_for(user):
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    if user is not None:
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=user).key)
+    return client
+
+
+def run_scenario(scenario, iterations, warmup):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client = client_for(scenario.user)
+    for i in range(warmup):
+        scenario.request(client, iterations + i)
+
+    latencies, queries, errors = [], 0, 0
+    with Timer() as total:
+        for i in range(iterations):
+            with CaptureQueriesContext(connection) as captured, Timer() as timer:
+                response = scenario.request(client, i)
+            latencies.append(timer.elapsed * 1000)
+            queries += len(captured)
+            errors += response.status_code >= 500
+
+    return {
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'queries': queries / iterations,
+        'rps': iterations / total.elapsed,
+        'errors': errors
+    }
+
+
+def check_coverage(names):
+    from api.urls import urlpatterns
+
+    missing = set(pattern.name for pattern in urlpatterns) - set(names)
+    if missing:
+        print('routes without scenario: {0}'.format(', '.join(sorted(missing))), file=sys.stderr)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = 0
+    print('\n{0:40} {1:>10} {2:>10} {3:>8}'.format('scenario', 'base p95', 'p95', 'change'))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = result['p95'] / baseline[name]['p95'] if baseline[name]['p95'] else 1
+        regressions += change > REGRESSION_THRESHOLD
+        print('{0:40} {1:10.2f} {2:10.2f} {3:7.0%}{4}'.format(name, baseline[name]['p95'], result['p95'], change - 1,
+                                                              ' !' if change > REGRESSION_THRESHOLD else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generated', action='store_true',
+                        help='use configured database filled by generate_data, seeding options are ignored')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--applications', type=int, default=3, help='applications per order')
+    parser.add_argument('--messages', type=int, default=20, help='messages per chat')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--save', help='write results to json file')
+    parser.add_argument('--compare', help='baseline json file to compare with')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from benchmarks.dataset import seed, load
+
+    results = {}
+    pending = args.iterations + args.warmup
+    with (configured_database() if args.generated else test_database()), \
+            mock.patch('anon_fl.notify_api.deliver'), mock.patch('api.serializers.queue_registration_email'), \
+            mock.patch('api.actions.send_notification'):
+        if args.generated:
+            dataset = load(pending=pending)
+        else:
+            dataset = seed(users=args.users, orders=args.orders, applications=args.applications,
+                           messages=args.messages, pending=pending, seed=args.seed)
+        all_scenarios = scenarios(dataset)
+        check_coverage([scenario.name for scenario in all_scenarios])
+
+        only = args.only.split(',') if args.only else None
+        print('{0:40} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}'.format('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'queries',
+                                                                 'rps'))
+        for scenario in all_scenarios:
+            if only and scenario.name not in only:
+                continue
+            result = results[scenario.name] = run_scenario(scenario, args.iterations, args.warmup)
+            print('{0:40} {p50:8.2f} {p95:8.2f} {p99:8.2f} {queries:8.1f} {rps:8.1f}'.format(scenario.name, **result))
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'revision': git_revision(), 'args': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Registration cost: password hashing per configured hasher and registration burst through the API.
+Burst reports signups/sec of a single process, which is the throughput of one sync worker
+"""
+import sys
+from unittest import mock
+
+from benchmarks import setup_django, test_database, Timer, report
+
+
+def bench_hashers(rounds):
+    from django.contrib.auth.hashers import get_hashers
+
+    for hasher in get_hashers():
+        salt = hasher.salt()
+        try:
+            hasher.encode('johdoe123', salt)
+        except ValueError:
+            # optional library (bcrypt, argon2) is not installed
+            continue
+
+        with Timer() as timer:
+            for _ in range(rounds):
+                hasher.encode('johdoe123', salt)
+        report('hash {0}'.format(hasher.algorithm), rounds, timer.elapsed)
+
+
+def bench_burst(count):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+
+    # email queue is benchmarked separately in benchmarks.registration_email
+    with mock.patch('api.serializers.queue_registration_email'), CaptureQueriesContext(connection) as queries:
+        with Timer() as timer:
+            for i in range(count):
+                response = client.post('/account/register', {
+                    'username': 'burst{0}'.format(i),
+                    'email': 'burst{0}@example.com'.format(i),
+                    'password': 'johdoe123'
+                })
+                assert response.status_code == 201, response.data
+
+    report('registration burst', count, timer.elapsed)
+    print('queries per signup: {0:.1f}'.format(len(queries) / count))
+
+
+def main(count=200, rounds=20):
+    setup_django()
+
+    bench_hashers(rounds)
+    with test_database():
+        bench_burst(count)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
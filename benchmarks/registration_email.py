@@ -0,0 +1,41 @@
+"""
+Registration email throughput: one SMTP connection per message versus batches over a single connection.
+Uses local SMTP sink, no broker or redis required
+"""
+import sys
+
+from benchmarks import setup_django, Timer, report
+
+SINK_PORT = 1025
+
+
+def main(count=1000, batch_size=100):
+    setup_django()
+
+    from django.conf import settings
+    from django.core.mail import send_mail
+    from api.tasks import send_registration_emails
+    from benchmarks.smtp_sink import start_sink
+
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    settings.EMAIL_HOST, settings.EMAIL_PORT = '127.0.0.1', SINK_PORT
+    sink = start_sink(port=SINK_PORT)
+
+    recipients = [('user{0}'.format(i), 'user{0}@example.com'.format(i)) for i in range(count)]
+
+    with Timer() as timer:
+        for username, email in recipients:
+            send_mail('Регистрация на Anon FL', '{0}, добро пожаловать на сайт Anon FL'.format(username),
+                      settings.DEFAULT_FROM_EMAIL, [email], fail_silently=False)
+    report('connection per message', count, timer.elapsed)
+
+    with Timer() as timer:
+        for i in range(0, count, batch_size):
+            send_registration_emails(recipients[i:i + batch_size])
+    report('batched by {0}'.format(batch_size), count, timer.elapsed)
+
+    print('sink received {0} messages'.format(sink.received))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
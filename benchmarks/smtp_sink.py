@@ -0,0 +1,60 @@
+"""
+Local SMTP server which accepts and drops every message. Run standalone with
+`python -m benchmarks.smtp_sink [port]` or start in-process with `start_sink()`.
+
+Speaks just enough SMTP for smtplib on top of socketserver, smtpd and asyncore are gone since Python 3.12
+"""
+import socketserver
+import sys
+import threading
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 sink')
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                for data in self.rfile:
+                    if data == b'.\r\n':
+                        break
+                self.server.accepted()
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                # EHLO, MAIL, RCPT, RSET and NOOP are all accepted
+                self.reply('250 OK')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, SinkHandler)
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def accepted(self):
+        with self.lock:
+            self.received += 1
+
+
+def start_sink(host='127.0.0.1', port=1025):
+    server = SinkServer((host, port))
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+    server = SinkServer(('127.0.0.1', port))
+    print('SMTP sink listening on 127.0.0.1:{0}'.format(port))
+    server.serve_forever()
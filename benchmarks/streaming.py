@@ -0,0 +1,85 @@
+"""
+Buffered vs streamed order list: peak Python memory (tracemalloc), time to first byte and total time per page size.
+libpq keeps the fetched rows outside of Python heap, so the numbers are for serialization and rendering only:
+
+    python -m benchmarks.streaming --orders 20000 --page-sizes 10,40,100,500,1000,5000
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from benchmarks import setup_django, test_database
+from benchmarks.endpoints import percentile
+
+MODES = {
+    'buffered': sys.maxsize,
+    'streamed': 1,
+}
+
+
+def measure(client, page_size, i):
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    # unique query string, so response cache middleware is bypassed
+    response = client.get('/orders/', {'page_size': page_size, 'bench': i})
+    if response.streaming:
+        chunks = iter(response.streaming_content)
+        size = len(next(chunks))
+        ttfb = time.perf_counter() - started
+        size += sum(len(chunk) for chunk in chunks)
+    else:
+        size = len(response.content)
+        ttfb = time.perf_counter() - started
+    total = time.perf_counter() - started
+
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ttfb, total, peak, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--page-sizes', default='10,40,100,500,1000,5000')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.test import Client, override_settings
+    from rest_framework.authtoken.models import Token
+    from benchmarks.dataset import seed
+
+    with test_database():
+        seed(orders=args.orders)
+        # pages above ResultsSetPagination.public_max_page_size are for staff only
+        staff = User.objects.create_user('benchmark-staff', is_staff=True)
+        client = Client(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=staff).key)
+
+        print('{0:9} {1:>6} {2:>9} {3:>9} {4:>10} {5:>10}'.format('mode', 'page', 'ttfb ms', 'total ms', 'peak KiB',
+                                                                  'body KiB'))
+        results = {}
+        for page_size in [int(size) for size in args.page_sizes.split(',')]:
+            for mode, min_page_size in MODES.items():
+                with override_settings(STREAMING_MIN_PAGE_SIZE=min_page_size):
+                    client.get('/orders/', {'page_size': page_size})
+                    samples = [measure(client, page_size, i) for i in range(args.repeat)]
+
+                ttfb, total, peak, size = [[sample[j] for sample in samples] for j in range(4)]
+                result = results.setdefault(mode, {})[page_size] = {
+                    'ttfb': percentile(ttfb, 50) * 1000,
+                    'total': percentile(total, 50) * 1000,
+                    'peak': max(peak) / 1024,
+                    'size': size[0] / 1024,
+                }
+                print('{0:9} {1:6} {ttfb:9.1f} {total:9.1f} {peak:10.0f} {size:10.1f}'.format(mode, page_size,
+                                                                                              **result))
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Throughput of gunicorn worker models on chat-send and feed endpoints.
+
+Starts a slow local notify service stand-in, seeds test database, then runs gunicorn with anon_fl/gunicorn_conf.py
+for every worker model and drives it with concurrent HTTP clients:
+
+    python -m benchmarks.workers --models sync,gthread,gevent --concurrency 32 --notify-delay 0.2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from benchmarks import setup_django, test_database
+from benchmarks.endpoints import percentile
+
+PORT = 8010
+NOTIFY_PORT = 8011
+
+
+class SlowNotifyHandler(BaseHTTPRequestHandler):
+    delay = 0.1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_notify(delay):
+    SlowNotifyHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', NOTIFY_PORT), SlowNotifyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_gunicorn(model, workers, database):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=model, GUNICORN_WORKERS=str(workers),
+               GUNICORN_BIND='127.0.0.1:{0}'.format(PORT), DB_NAME=database,
+               NOTIFY_SERVICE_HOST='http://127.0.0.1', NOTIFY_SERVICE_PORT=str(NOTIFY_PORT))
+    process = subprocess.Popen(['gunicorn', '-c', 'anon_fl/gunicorn_conf.py', 'anon_fl.wsgi:application'], env=env)
+
+    for _ in range(100):
+        try:
+            requests.get('http://127.0.0.1:{0}/orders/categories/'.format(PORT), timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def load(request, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    def client():
+        nonlocal errors
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = request(session)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+
+    return {
+        'rps': len(latencies) / duration,
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'errors': errors
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', default='sync,gthread')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--notify-delay', type=float, default=0.1, help='seconds the notify stand-in waits')
+    parser.add_argument('--orders', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from rest_framework.authtoken.models import Token
+    from benchmarks.dataset import seed
+
+    start_notify(args.notify_delay)
+    base = 'http://127.0.0.1:{0}'.format(PORT)
+
+    with test_database(keepdb=False) as connection:
+        dataset = seed(orders=args.orders)
+        connection.close()
+
+        token = 'Token ' + Token.objects.get(user=dataset.contractor).key
+        chat_url = '{0}/orders/{1}/chat/messages/'.format(base, dataset.chat_order.id)
+        scenarios = {
+            'chat-send': lambda session: session.post(chat_url, json={'message': 'Benchmark'},
+                                                      headers={'Authorization': token}),
+            'feed': lambda session: session.get(base + '/orders/'),
+        }
+
+        print('{0:10} {1:10} {2:>8} {3:>8} {4:>8} {5:>6}'.format('model', 'scenario', 'rps', 'p50 ms', 'p99 ms',
+                                                               'errors'))
+        results = {}
+        for model in args.models.split(','):
+            process = start_gunicorn(model, args.workers, connection.settings_dict['NAME'])
+            try:
+                for name, request in scenarios.items():
+                    result = results.setdefault(model, {})[name] = load(request, args.concurrency, args.duration)
+                    print('{0:10} {1:10} {rps:8.1f} {p50:8.1f} {p99:8.1f} {errors:6}'.format(model, name, **result))
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
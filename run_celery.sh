@@ -3,4 +3,12 @@
 # wait for RabbitMQ server to start
 sleep 10
 
-su -m anon_fl -c "celery worker -A api.celeryconf"
+export prometheus_multiproc_dir=/tmp/anon_fl/metrics
+rm -rf $prometheus_multiproc_dir && mkdir -p $prometheus_multiproc_dir && chown anon_fl $prometheus_multiproc_dir
+# prometheus exporter of worker metrics
+export METRICS_PORT=9540
+
+# queues and pool of this worker, see CELERY_WORKER_PROFILES
+WORKER_ARGS=$(python -m api.workers ${CELERY_WORKER_PROFILE:-all}) || exit 1
+
+su -m anon_fl -c "celery worker -A api.celeryconf $WORKER_ARGS"
@@ -0,0 +1,6 @@
+#!/bin/sh
+
+# wait for RabbitMQ server to start
+sleep 10
+
+su -m anon_fl -c "celery beat -A api.celeryconf --schedule /tmp/celerybeat-schedule"
@@ -8,4 +8,8 @@ sleep 10
 su -m anon_fl -c "python manage.py makemigrations api"
 su -m anon_fl -c "python manage.py migrate"
 
-su -m anon_fl -c "gunicorn anon_fl.wsgi:application --bind :8000"
+# metrics of all gunicorn workers are merged from this directory, stale files of previous run are removed
+export prometheus_multiproc_dir=/tmp/anon_fl/metrics
+rm -rf $prometheus_multiproc_dir && mkdir -p $prometheus_multiproc_dir && chown anon_fl $prometheus_multiproc_dir
+
+su -m anon_fl -c "gunicorn -c anon_fl/gunicorn_conf.py anon_fl.wsgi:application"